@@ -0,0 +1 @@
+"""Local performance benchmarks for terrable that run without AWS access."""
@@ -0,0 +1,496 @@
+"""In-process S3 stand-in for running benchmarks without AWS access."""
+
+import collections
+import dataclasses
+import datetime
+import email.utils
+import hashlib
+import http.server
+import threading
+import time
+import typing
+import urllib.parse
+import uuid
+from xml.etree import ElementTree
+
+import boto3
+
+import terrable
+from terrable import _definitions
+
+_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+@dataclasses.dataclass(frozen=True)
+class StoredObject:
+    """Data structure for an object stored in the stand-in."""
+
+    data: bytes
+    etag: str
+    last_modified: datetime.datetime
+    metadata: typing.Dict[str, str] = dataclasses.field(default_factory=lambda: {})
+    content_type: str = "binary/octet-stream"
+
+
+@dataclasses.dataclass(frozen=True)
+class _Upload:
+    """Data structure for a multipart upload in progress."""
+
+    metadata: typing.Dict[str, str]
+    content_type: str
+    parts: typing.Dict[int, bytes] = dataclasses.field(default_factory=lambda: {})
+
+
+class S3Error(Exception):
+    """Error response returned by the stand-in for a failed request."""
+
+    def __init__(self, status: int, code: str, message: str = ""):
+        """Create an error with the HTTP status and the S3 error code."""
+        super().__init__(message or code)
+        self.status = status
+        self.code = code
+
+
+def _decode_aws_chunked(body: bytes) -> bytes:
+    """Decode a request body sent with the aws-chunked content encoding."""
+    data: typing.List[bytes] = []
+    position = 0
+    while True:
+        end = body.index(b"\r\n", position)
+        size = int(body[position:end].split(b";")[0], 16)
+        if size == 0:
+            return b"".join(data)
+        data.append(body[end + 2 : end + 2 + size])
+        position = end + 2 + size + 2
+
+
+def _to_xml(tag: str, children: typing.List[typing.Tuple[str, typing.Any]]) -> bytes:
+    """Serialize a flat or nested S3 response document into XML bytes."""
+    # Error documents are the only ones S3 returns without the namespace.
+    root = ElementTree.Element(tag, {} if tag == "Error" else {"xmlns": _NAMESPACE})
+
+    def _add(parent: ElementTree.Element, items: typing.List[typing.Tuple]) -> None:
+        for name, value in items:
+            element = ElementTree.SubElement(parent, name)
+            if isinstance(value, list):
+                _add(element, value)
+            else:
+                element.text = str(value)
+
+    _add(root, children)
+    return ElementTree.tostring(root, encoding="utf-8")
+
+
+class S3StandIn:
+    """
+    Minimal S3-compatible HTTP server running within the current process.
+
+    It supports the subset of the S3 API used by terrable, including multipart
+    uploads, ranged GETs, conditional writes and metadata, and counts the calls
+    made to each operation so that benchmarks can report them.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        """Create the stand-in with an optional simulated latency per request."""
+        self.latency = latency
+        self.objects: typing.Dict[typing.Tuple[str, str], StoredObject] = {}
+        self.uploads: typing.Dict[str, _Upload] = {}
+        self.calls: typing.Counter[str] = collections.Counter()
+        self.lock = threading.Lock()
+        self._server: typing.Optional[http.server.ThreadingHTTPServer] = None
+        self._thread: typing.Optional[threading.Thread] = None
+
+    @property
+    def endpoint_url(self) -> str:
+        """Get the URL at which the stand-in is served."""
+        assert self._server is not None, "The stand-in has not been started."
+        host, port = self._server.server_address[:2]
+        return f"http://{host!s}:{port}"
+
+    def start(self) -> "S3StandIn":
+        """Start serving requests on a background thread."""
+        handler = type("Handler", (_Handler,), {"stand_in": self})
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving requests."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "S3StandIn":
+        """Start the stand-in for the duration of the context."""
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        """Stop the stand-in when leaving the context."""
+        self.stop()
+
+    def reset_calls(self) -> None:
+        """Clear the recorded call counts."""
+        with self.lock:
+            self.calls.clear()
+
+    def put(
+        self,
+        bucket: str,
+        key: str,
+        data: bytes,
+        metadata: typing.Optional[typing.Dict[str, str]] = None,
+        etag: typing.Optional[str] = None,
+        content_type: str = "binary/octet-stream",
+    ) -> StoredObject:
+        """Store an object directly, as if it had been uploaded."""
+        stored = StoredObject(
+            data=data,
+            etag=etag or f'"{hashlib.md5(data).hexdigest()}"',
+            last_modified=datetime.datetime.now(datetime.timezone.utc),
+            metadata=metadata or {},
+            content_type=content_type,
+        )
+        with self.lock:
+            self.objects[(bucket, key)] = stored
+        return stored
+
+    def create_context(
+        self,
+        command: str = "publish",
+        **kwargs,
+    ) -> "_definitions.Context":
+        """
+        Create a terrable context whose S3 client is connected to this stand-in.
+
+        The arguments are parsed like those of the specified command for the
+        "benchmark" bucket with the local cache disabled. Publish commands target the
+        current directory. Keyword arguments then override the parsed arguments.
+        """
+        arguments = [
+            command,
+            "--bucket=benchmark",
+            "--no-cache",
+            f"--endpoint-url={self.endpoint_url}",
+        ]
+        if command in ("publish", "watch"):
+            arguments.append(".")
+        args = terrable._parse(arguments)
+        vars(args).update(kwargs)
+        session = boto3.Session(
+            aws_access_key_id="benchmark",
+            aws_secret_access_key="benchmark",
+            region_name="us-east-1",
+        )
+        return _definitions.Context(args, session)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Request handler implementing the S3 operations supported by the stand-in."""
+
+    protocol_version = "HTTP/1.1"
+    stand_in: S3StandIn
+
+    def log_message(self, format: str, *args) -> None:
+        """Silence the default request logging."""
+
+    def _parse(self) -> typing.Tuple[str, str, typing.Dict[str, str]]:
+        """Get the bucket, key and query parameters of the request path."""
+        parsed = urllib.parse.urlsplit(self.path)
+        bucket, _, key = parsed.path.lstrip("/").partition("/")
+        query = dict(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True))
+        return bucket, urllib.parse.unquote(key), query
+
+    def _read_body(self) -> bytes:
+        """Read the request body, decoding aws-chunked bodies."""
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        encoding = self.headers.get("Content-Encoding") or ""
+        if "aws-chunked" in encoding or self.headers.get(
+            "X-Amz-Decoded-Content-Length"
+        ):
+            return _decode_aws_chunked(body)
+        return body
+
+    def _respond(
+        self,
+        status: int = 200,
+        body: bytes = b"",
+        headers: typing.Optional[typing.Dict[str, str]] = None,
+    ) -> None:
+        """Send a response with the given status, body and headers."""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _dispatch(self, operations: typing.Dict[str, typing.Callable]) -> None:
+        """Carry out the operation selected for the request and count the call."""
+        bucket, key, query = self._parse()
+        name = next(n for n, _ in operations.items() if _matches(n, key, query))
+        with self.stand_in.lock:
+            self.stand_in.calls[name] += 1
+        if self.stand_in.latency:
+            time.sleep(self.stand_in.latency)
+        try:
+            operations[name](bucket, key, query)
+        except S3Error as error:
+            body = _to_xml("Error", [("Code", error.code), ("Message", str(error))])
+            self._respond(error.status, body, {"Content-Type": "application/xml"})
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Handle GET requests."""
+        self._dispatch(
+            {"ListObjectsV2": self._list_objects, "GetObject": self._get_object}
+        )
+
+    def do_HEAD(self) -> None:  # noqa: N802
+        """Handle HEAD requests."""
+        self._dispatch({"HeadObject": self._get_object})
+
+    def do_PUT(self) -> None:  # noqa: N802
+        """Handle PUT requests."""
+        self._dispatch({"UploadPart": self._upload_part, "PutObject": self._put_object})
+
+    def do_POST(self) -> None:  # noqa: N802
+        """Handle POST requests."""
+        self._dispatch(
+            {
+                "DeleteObjects": self._delete_objects,
+                "CreateMultipartUpload": self._create_upload,
+                "CompleteMultipartUpload": self._complete_upload,
+            }
+        )
+
+    def do_DELETE(self) -> None:  # noqa: N802
+        """Handle DELETE requests."""
+        self._dispatch(
+            {"AbortMultipartUpload": self._abort_upload, "DeleteObject": self._delete}
+        )
+
+    def _get_stored(self, bucket: str, key: str) -> StoredObject:
+        """Get the stored object or raise a not found error."""
+        stored = self.stand_in.objects.get((bucket, key))
+        if stored is None:
+            raise S3Error(404, "NoSuchKey", f"The key {key} does not exist.")
+        return stored
+
+    def _check_conditions(self, bucket: str, key: str) -> None:
+        """Raise a precondition error if the conditional headers are not met."""
+        existing = self.stand_in.objects.get((bucket, key))
+        if_none_match = self.headers.get("If-None-Match")
+        if_match = self.headers.get("If-Match")
+        if if_none_match == "*" and existing is not None:
+            raise S3Error(412, "PreconditionFailed", "The object already exists.")
+        if if_match is not None and (existing is None or existing.etag != if_match):
+            raise S3Error(412, "PreconditionFailed", "The ETag does not match.")
+
+    def _get_upload(self) -> "_Upload":
+        """Get the metadata and content type sent in the request headers."""
+        return _Upload(
+            metadata={
+                name.lower()[len("x-amz-meta-") :]: value
+                for name, value in self.headers.items()
+                if name.lower().startswith("x-amz-meta-")
+            },
+            content_type=self.headers.get("Content-Type") or "binary/octet-stream",
+        )
+
+    def _store(
+        self,
+        bucket: str,
+        key: str,
+        data: bytes,
+        upload: "_Upload",
+        etag: typing.Optional[str] = None,
+    ) -> None:
+        """Store an uploaded object if the conditional request headers are met."""
+        with self.stand_in.lock:
+            self._check_conditions(bucket, key)
+            stored = StoredObject(
+                data=data,
+                etag=etag or f'"{hashlib.md5(data).hexdigest()}"',
+                last_modified=datetime.datetime.now(datetime.timezone.utc),
+                metadata=upload.metadata,
+                content_type=upload.content_type,
+            )
+            self.stand_in.objects[(bucket, key)] = stored
+        self._respond(headers={"ETag": stored.etag})
+
+    def _put_object(self, bucket: str, key: str, query: dict) -> None:
+        """Handle PutObject requests."""
+        self._store(bucket, key, self._read_body(), self._get_upload())
+
+    def _get_object(self, bucket: str, key: str, query: dict) -> None:
+        """Handle GetObject and HeadObject requests, including byte ranges."""
+        stored = self._get_stored(bucket, key)
+        if_none_match = self.headers.get("If-None-Match")
+        headers = {
+            "ETag": stored.etag,
+            "Last-Modified": email.utils.format_datetime(
+                stored.last_modified, usegmt=True
+            ),
+            "Content-Type": stored.content_type,
+            "Accept-Ranges": "bytes",
+            **{f"x-amz-meta-{k}": v for k, v in stored.metadata.items()},
+        }
+        if if_none_match is not None and if_none_match == stored.etag:
+            return self._respond(304, headers=headers)
+
+        data = stored.data
+        byte_range = self.headers.get("Range")
+        if not byte_range:
+            return self._respond(200, data, headers)
+
+        start, _, end = byte_range.split("=")[-1].partition("-")
+        first = int(start)
+        last = min(len(data) - 1, int(end) if end else len(data) - 1)
+        headers["Content-Range"] = f"bytes {first}-{last}/{len(data)}"
+        return self._respond(206, data[first : last + 1], headers)
+
+    def _delete(self, bucket: str, key: str, query: dict) -> None:
+        """Handle DeleteObject requests."""
+        with self.stand_in.lock:
+            self.stand_in.objects.pop((bucket, key), None)
+        self._respond(204)
+
+    def _delete_objects(self, bucket: str, key: str, query: dict) -> None:
+        """Handle DeleteObjects requests."""
+        document = ElementTree.fromstring(self._read_body())
+        keys = [e.text or "" for e in document.iter() if e.tag.endswith("Key")]
+        with self.stand_in.lock:
+            for k in keys:
+                self.stand_in.objects.pop((bucket, k), None)
+        body = _to_xml("DeleteResult", [("Deleted", [("Key", k)]) for k in keys])
+        self._respond(200, body, {"Content-Type": "application/xml"})
+
+    def _describe(self, bucket: str, key: str) -> typing.List[typing.Tuple]:
+        """Get the listing entry of a stored object."""
+        stored = self.stand_in.objects[(bucket, key)]
+        return [
+            ("Key", key),
+            ("LastModified", stored.last_modified.isoformat()),
+            ("ETag", stored.etag),
+            ("Size", len(stored.data)),
+            ("StorageClass", "STANDARD"),
+        ]
+
+    def _get_keys(self, bucket: str, prefix: str, start_after: str) -> typing.List[str]:
+        """List the sorted keys in the bucket with the prefix after the start key."""
+        with self.stand_in.lock:
+            return sorted(
+                k
+                for b, k in self.stand_in.objects
+                if b == bucket and k.startswith(prefix) and k > start_after
+            )
+
+    def _list_objects(self, bucket: str, key: str, query: dict) -> None:
+        """Handle ListObjectsV2 requests, including delimiters and pagination."""
+        prefix = query.get("prefix", "")
+        delimiter = query.get("delimiter", "")
+        max_keys = int(query.get("max-keys") or 1000)
+        start_after = query.get("continuation-token") or query.get("start-after", "")
+        keys = self._get_keys(bucket, prefix, start_after)
+
+        page, prefixes, last_key = _paginate(keys, prefix, delimiter, max_keys)
+        contents = [("Contents", self._describe(bucket, k)) for k in page]
+
+        truncated = bool(keys) and keys[-1] > last_key
+        body = _to_xml(
+            "ListBucketResult",
+            [
+                ("Name", bucket),
+                ("Prefix", prefix),
+                ("KeyCount", len(contents) + len(prefixes)),
+                ("MaxKeys", max_keys),
+                ("IsTruncated", "true" if truncated else "false"),
+                *contents,
+                *[("CommonPrefixes", [("Prefix", p)]) for p in prefixes],
+                *([("NextContinuationToken", last_key)] if truncated else []),
+            ],
+        )
+        self._respond(200, body, {"Content-Type": "application/xml"})
+
+    def _create_upload(self, bucket: str, key: str, query: dict) -> None:
+        """Handle CreateMultipartUpload requests."""
+        upload_id = uuid.uuid4().hex
+        with self.stand_in.lock:
+            self.stand_in.uploads[upload_id] = self._get_upload()
+        body = _to_xml(
+            "InitiateMultipartUploadResult",
+            [("Bucket", bucket), ("Key", key), ("UploadId", upload_id)],
+        )
+        self._respond(200, body, {"Content-Type": "application/xml"})
+
+    def _upload_part(self, bucket: str, key: str, query: dict) -> None:
+        """Handle UploadPart requests."""
+        data = self._read_body()
+        with self.stand_in.lock:
+            upload = self.stand_in.uploads[query["uploadId"]]
+            upload.parts[int(query["partNumber"])] = data
+        self._respond(headers={"ETag": f'"{hashlib.md5(data).hexdigest()}"'})
+
+    def _complete_upload(self, bucket: str, key: str, query: dict) -> None:
+        """Handle CompleteMultipartUpload requests."""
+        self._read_body()
+        with self.stand_in.lock:
+            upload = self.stand_in.uploads.pop(query["uploadId"])
+        ordered = [upload.parts[n] for n in sorted(upload.parts)]
+        digests = b"".join(hashlib.md5(p).digest() for p in ordered)
+        etag = f'"{hashlib.md5(digests).hexdigest()}-{len(ordered)}"'
+        self._store(bucket, key, b"".join(ordered), upload, etag)
+
+    def _abort_upload(self, bucket: str, key: str, query: dict) -> None:
+        """Handle AbortMultipartUpload requests."""
+        with self.stand_in.lock:
+            self.stand_in.uploads.pop(query["uploadId"], None)
+        self._respond(204)
+
+
+def _paginate(
+    keys: typing.List[str],
+    prefix: str,
+    delimiter: str,
+    max_keys: int,
+) -> typing.Tuple[typing.List[str], typing.List[str], str]:
+    """
+    Get a page of sorted keys and common prefixes for a listing.
+
+    :return:
+        A tuple containing the keys and the common prefixes in the page along with
+        the continuation token after which the next page starts.
+    """
+    page: typing.List[str] = []
+    prefixes: typing.List[str] = []
+    token = ""
+    for k in keys:
+        if k <= token:
+            continue
+        if len(page) + len(prefixes) >= max_keys:
+            break
+        remainder = k[len(prefix) :]
+        if delimiter and delimiter in remainder:
+            prefixes.append(prefix + remainder.split(delimiter, 1)[0] + delimiter)
+            # Skip past every other key within the same common prefix.
+            token = prefixes[-1] + chr(0x10FFFF)
+        else:
+            page.append(k)
+            token = k
+    return page, prefixes, token
+
+
+def _matches(operation: str, key: str, query: typing.Dict[str, str]) -> bool:
+    """Determine whether the request path selects the specified operation."""
+    selectors: typing.Dict[str, typing.Callable[[], bool]] = {
+        "ListObjectsV2": lambda: not key,
+        "UploadPart": lambda: "partNumber" in query,
+        "DeleteObjects": lambda: "delete" in query,
+        "CreateMultipartUpload": lambda: "uploads" in query,
+        "CompleteMultipartUpload": lambda: "uploadId" in query,
+        "AbortMultipartUpload": lambda: "uploadId" in query,
+    }
+    return selectors.get(operation, lambda: True)()
@@ -0,0 +1,251 @@
+"""
+Benchmark bundling, comparing, listing and publishing modules at scale.
+
+Synthetic module trees and version histories are generated for a range of sizes
+and every operation is timed against an in-process S3 stand-in, which reports the
+number of calls made to each S3 operation along with the timings. The results are
+written as JSON so that they can be compared between releases. Run with:
+
+    python -m benchmarks.suite --output=results.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+import typing
+
+from benchmarks import _s3_server
+from terrable import _index
+from terrable import _lister
+from terrable import _publisher
+from terrable import _s3
+from terrable import _utils
+
+#: Module trees to bundle and compare as (file count, file size in KiB) tuples.
+_TREES: typing.List[typing.Tuple[int, int]] = [
+    (10, 4),
+    (100, 4),
+    (1000, 1),
+    (10, 1024),
+]
+#: Version history depths of a single module to list the versions of.
+_HISTORIES: typing.List[int] = [10, 1000, 5000]
+#: Catalogs to list and publish as (module count, versions per module) tuples.
+_CATALOGS: typing.List[typing.Tuple[int, int]] = [
+    (10, 10),
+    (100, 10),
+    (50, 100),
+]
+
+
+def _parse(arguments: typing.Optional[typing.List[str]] = None) -> argparse.Namespace:
+    """Parse the benchmark command line arguments."""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Simulated latency in seconds added to each S3 request.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times each operation is repeated. The best time is kept.",
+    )
+    parser.add_argument(
+        "--output",
+        help="Path of a JSON file to which the results are written.",
+    )
+    return parser.parse_args(arguments)
+
+
+def _measure(
+    stand_in: "_s3_server.S3StandIn",
+    function: typing.Callable[[], typing.Any],
+    repeat: int,
+) -> dict:
+    """
+    Time calling the function repeatedly with its printed output suppressed.
+
+    :return:
+        The best elapsed time in seconds along with the S3 calls made by a single
+        call of the function.
+    """
+    stand_in.reset_calls()
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        elapsed.append(time.perf_counter() - start)
+    calls = {k: v // repeat for k, v in sorted(stand_in.calls.items())}
+    return {"seconds": min(elapsed), "calls": calls}
+
+
+def _create_tree(
+    directory: pathlib.Path,
+    file_count: int,
+    file_size: int,
+    seed: str = "",
+) -> pathlib.Path:
+    """
+    Generate a synthetic module with files of the size in KiB spread over folders.
+
+    Half of each file is random, which keeps the files from compressing entirely,
+    while the seed is included in the files to distinguish otherwise equal trees.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    for index in range(file_count):
+        path = directory.joinpath(f"group-{index % 10}", f"file-{index}.tf")
+        path.parent.mkdir(exist_ok=True)
+        half = file_size * 512
+        path.write_bytes(f"# {seed}\n".encode("utf-8") + b"#" * half + os.urandom(half))
+    return directory
+
+
+def _populate(
+    stand_in: "_s3_server.S3StandIn",
+    module_count: int,
+    version_count: int,
+) -> None:
+    """Store the version histories of the modules directly in the stand-in."""
+    for module in range(module_count):
+        for version in range(1, version_count + 1):
+            stand_in.put(
+                "benchmark",
+                f"terrable/module-{module}/{version}.zip",
+                b"PK\x05\x06" + b"\0" * 18,
+                metadata={"digest": f"{module}-{version}"},
+            )
+
+
+def _benchmark_trees(
+    stand_in: "_s3_server.S3StandIn",
+    directory: pathlib.Path,
+    repeat: int,
+) -> typing.List[dict]:
+    """Time bundling module trees and comparing bundles of identical trees."""
+    results = []
+    for file_count, file_size in _TREES:
+        source = _create_tree(
+            directory.joinpath(f"tree-{file_count}-{file_size}", "module"),
+            file_count,
+            file_size,
+        )
+        bundles = []
+        for name in ("a", "b"):
+            destination = source.parent.joinpath(name)
+            destination.mkdir()
+            bundles.append(_publisher._bundle(source, destination))
+        a, b = (typing.cast(pathlib.Path, bundle.path) for bundle in bundles)
+
+        parameters = {"files": file_count, "file_size": file_size * 1024}
+        operations = {
+            "bundle": lambda: _publisher._bundle(source, source.parent),
+            "compare": lambda: _utils.compare_zip_files(a, b),
+            "compare_deep": lambda: _utils.compare_zip_files(a, b, deep=True),
+        }
+        for name, function in operations.items():
+            result = _measure(stand_in, function, repeat)
+            results.append({"benchmark": name, **parameters, **result})
+    return results
+
+
+def _benchmark_histories(
+    stand_in: "_s3_server.S3StandIn",
+    repeat: int,
+) -> typing.List[dict]:
+    """Time listing the versions of modules with version histories of many depths."""
+    results = []
+    for depth in _HISTORIES:
+        stand_in.objects.clear()
+        _populate(stand_in, 1, depth)
+        context = stand_in.create_context()
+        result = _measure(
+            stand_in, lambda: _s3.get_versions(context, "module-0"), repeat
+        )
+        results.append({"benchmark": "get_versions", "versions": depth, **result})
+    return results
+
+
+def _benchmark_catalogs(
+    stand_in: "_s3_server.S3StandIn",
+    directory: pathlib.Path,
+    repeat: int,
+) -> typing.List[dict]:
+    """Time listing and publishing modules within catalogs of many sizes."""
+    results = []
+    for module_count, version_count in _CATALOGS:
+        stand_in.objects.clear()
+        _populate(stand_in, module_count, version_count)
+        parameters = {"modules": module_count, "versions": version_count}
+        root = directory.joinpath(f"catalog-{module_count}-{version_count}")
+        for module in range(module_count):
+            _create_tree(root.joinpath(f"module-{module}"), 10, 1, seed=str(module))
+
+        scan = stand_in.create_context("list", verbose=True, scan=True)
+        indexed = stand_in.create_context("list", verbose=True)
+        publish = stand_in.create_context(directory=str(root), dry_run=True)
+        operations = {
+            "list_scan": lambda: _lister.run(scan),
+            "reindex": lambda: _index.rebuild(indexed),
+            "list_index": lambda: _lister.run(indexed),
+            "publish": lambda: _publisher.run(publish),
+        }
+        for name, function in operations.items():
+            result = _measure(stand_in, function, repeat)
+            results.append({"benchmark": name, **parameters, **result})
+    return results
+
+
+def _echo(result: dict) -> None:
+    """Print a single benchmark result as a row of the results table."""
+    parameters = ", ".join(
+        f"{k}={v}"
+        for k, v in result.items()
+        if k not in ("benchmark", "seconds", "calls")
+    )
+    print(
+        "{benchmark:<14} {parameters:<32} {seconds:>9.4f} {calls:>7}".format(
+            benchmark=result["benchmark"],
+            parameters=parameters,
+            seconds=result["seconds"],
+            calls=sum(result["calls"].values()),
+        )
+    )
+
+
+def run(arguments: typing.Optional[typing.List[str]] = None) -> typing.List[dict]:
+    """Run the benchmark suite and return its results."""
+    args = _parse(arguments)
+    directory = pathlib.Path(tempfile.mkdtemp())
+    print(f"Benchmarking with {args.latency}s latency per request\n")
+    print("benchmark      parameters                         seconds   calls")
+    results = []
+    with _s3_server.S3StandIn(latency=args.latency) as stand_in:
+        for benchmark in (
+            lambda: _benchmark_trees(stand_in, directory, args.repeat),
+            lambda: _benchmark_histories(stand_in, args.repeat),
+            lambda: _benchmark_catalogs(stand_in, directory, args.repeat),
+        ):
+            for result in benchmark():
+                _echo(result)
+                results.append(result)
+
+    shutil.rmtree(directory)
+    if args.output:
+        report = {"latency": args.latency, "repeat": args.repeat, "results": results}
+        pathlib.Path(args.output).write_text(json.dumps(report, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
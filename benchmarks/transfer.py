@@ -0,0 +1,169 @@
+"""
+Benchmark bundle upload and download throughput for different transfer settings.
+
+The transfers are made against an in-process S3 stand-in, which means that the
+results reflect the client side costs of the transfer settings along with any
+simulated per-request latency rather than real network conditions. Run with:
+
+    python -m benchmarks.transfer --size=64 --latency=0.005
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+import typing
+
+from benchmarks import _s3_server
+from terrable import _definitions
+from terrable import _s3
+
+_MIB = 1024 * 1024
+
+#: Transfer settings to compare as (threshold, chunk size, concurrency) tuples where
+#: the threshold and chunk size are in MiB. A threshold of None stands for a
+#: threshold larger than the payload, which forces single request transfers.
+_SETTINGS: typing.List[typing.Tuple[typing.Optional[int], int, int]] = [
+    (None, 8, 1),
+    (8, 8, 1),
+    (8, 8, 4),
+    (8, 8, 10),
+    (8, 16, 10),
+    (8, 4, 20),
+]
+
+
+def _parse(arguments: typing.Optional[typing.List[str]] = None) -> argparse.Namespace:
+    """Parse the benchmark command line arguments."""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.transfer")
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=64,
+        help="Size of the transferred bundle in MiB.",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.005,
+        help="Simulated latency in seconds added to each S3 request.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of times each transfer is repeated. The best time is kept.",
+    )
+    parser.add_argument(
+        "--output",
+        help="Path of a JSON file to which the results are written.",
+    )
+    return parser.parse_args(arguments)
+
+
+def _time(function: typing.Callable[[], typing.Any], repeat: int) -> float:
+    """Get the best elapsed time in seconds of calling the function repeatedly."""
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+def _benchmark_setting(
+    stand_in: "_s3_server.S3StandIn",
+    bundle: "_definitions.Bundle",
+    setting: typing.Tuple[typing.Optional[int], int, int],
+    repeat: int,
+    versions: typing.Iterator[int],
+) -> dict:
+    """
+    Time uploading and downloading the bundle with the transfer setting.
+
+    :param versions:
+        Version numbers to publish the bundle as. Every upload takes the next
+        number because versions are only created if they don't exist yet.
+    """
+    threshold, chunksize, concurrency = setting
+    context = stand_in.create_context(
+        multipart_threshold=(threshold or 1024 * 1024) * _MIB,
+        multipart_chunksize=chunksize * _MIB,
+        max_concurrency=concurrency,
+    )
+    stand_in.reset_calls()
+    uploaded: typing.List[int] = []
+
+    def _upload():
+        uploaded.append(next(versions))
+        _s3.put_bundle(context, bundle, uploaded[-1])
+
+    upload = _time(_upload, repeat)
+    key = f"{context.args.prefix}/{bundle.name}/{uploaded[-1]}.zip"
+    download = _time(lambda: _s3.get_bundle(context, key, io.BytesIO()), repeat)
+
+    size = bundle.size / _MIB
+    return {
+        "multipart_threshold": threshold and threshold * _MIB,
+        "multipart_chunksize": chunksize * _MIB,
+        "max_concurrency": concurrency,
+        "upload_seconds": upload,
+        "upload_mib_per_second": size / upload,
+        "download_seconds": download,
+        "download_mib_per_second": size / download,
+        "calls": {k: v // repeat for k, v in sorted(stand_in.calls.items())},
+    }
+
+
+def _echo(result: dict) -> None:
+    """Print a single benchmark result as a row of the results table."""
+    threshold = result["multipart_threshold"]
+    print(
+        "{threshold:>10} {chunksize:>9} {concurrency:>11} "
+        "{upload:>10.1f} {download:>12.1f}".format(
+            threshold=f"{threshold // _MIB} MiB" if threshold else "single",
+            chunksize=f"{result['multipart_chunksize'] // _MIB} MiB",
+            concurrency=result["max_concurrency"],
+            upload=result["upload_mib_per_second"],
+            download=result["download_mib_per_second"],
+        )
+    )
+
+
+def run(arguments: typing.Optional[typing.List[str]] = None) -> typing.List[dict]:
+    """Run the transfer benchmark and return its results."""
+    args = _parse(arguments)
+    directory = pathlib.Path(tempfile.mkdtemp())
+    path = directory.joinpath("transfer.zip")
+    path.write_bytes(os.urandom(args.size * _MIB))
+    bundle = _definitions.Bundle(name="transfer", path=path, digest="benchmark")
+
+    print(f"Transferring {args.size} MiB with {args.latency}s latency per request\n")
+    print("threshold  chunksize  concurrency  up MiB/s  down MiB/s")
+    results = []
+    versions = itertools.count(1)
+    with _s3_server.S3StandIn(latency=args.latency) as stand_in:
+        for setting in _SETTINGS:
+            result = _benchmark_setting(
+                stand_in, bundle, setting, args.repeat, versions
+            )
+            _echo(result)
+            results.append(result)
+
+    path.unlink()
+    directory.rmdir()
+    if args.output:
+        report = {"size": args.size * _MIB, "latency": args.latency, "results": results}
+        pathlib.Path(args.output).write_text(json.dumps(report, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
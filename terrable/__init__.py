@@ -1,19 +1,48 @@
 """Terrable package for S3 terraform module management."""
+
 import argparse
+import dataclasses
+import json
+import os
+import pathlib
 import typing
 import sys
 
-import boto3
-
 from terrable import _definitions
+from terrable import _index
 from terrable import _lister
+from terrable import _pruner
 from terrable import _publisher
+from terrable import _report
+from terrable import _watcher
+
+#: Names of the commands that can be carried out.
+_COMMANDS = ["list", "publish", "prune", "reindex", "watch"]
+
+
+def _get_command(args: typing.List[str]) -> typing.Optional[str]:
+    """
+    Get the command from the first positional argument.
+
+    The arguments are parsed with the options shared by all commands, so that their
+    values aren't mistaken for commands, while the options of the commands are left
+    unparsed along with their values.
+
+    :return:
+        None if the first positional argument is missing or isn't a known command.
+    """
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    _add_common_arguments(parser)
+    parser.add_argument("positionals", nargs="*")
+    known, _ = parser.parse_known_intermixed_args(args=args)
+    command = next(iter(known.positionals), None)
+    return command if command in _COMMANDS else None
 
 
 def _parse(arguments: typing.List[str] = None):
     """Parse command line arguments for the publish invocation."""
     args = sys.argv[1:] if arguments is None else arguments
-    command = next((n for n in ["list", "publish"] if n in args), None)
+    command = _get_command(args)
 
     parser = argparse.ArgumentParser(
         allow_abbrev=False,
@@ -22,37 +51,12 @@ def _parse(arguments: typing.List[str] = None):
     )
     parser.add_argument(
         "command",
-        choices=["list", "publish"],
+        choices=_COMMANDS,
         # Hide in the help if the command is supplied to behave like a subparser
         # even though that's not being used here for the sake of intermixed args.
         help=argparse.SUPPRESS if command else "Command to carry out.",
     )
-    parser.add_argument(
-        "--aws-directory",
-        default="~/.aws",
-        help="""
-            AWS directory where credentials are stored. Defaults to the standard
-            location expected for AWS.
-            """,
-    )
-    parser.add_argument(
-        "--profile",
-        dest="aws_profile",
-        help="""
-            The name of the AWS profile to use when access the targeted bucket
-            and module files. If not specified the default profile or environment
-            variable values will be used for authentication instead.
-            """,
-    )
-    parser.add_argument(
-        "--bucket",
-        help="Name of the bucket where the modules reside.",
-    )
-    parser.add_argument(
-        "--prefix",
-        default="terrable",
-        help="Shared S3 key prefix for all modules in the specified bucket.",
-    )
+    _add_common_arguments(parser)
 
     if command == "list":
         parser.add_argument(
@@ -80,7 +84,34 @@ def _parse(arguments: typing.List[str] = None):
                 will be specified instead of all of listing all available versions.
                 """,
         )
-    elif command == "publish":
+        parser.add_argument(
+            "--output",
+            choices=["text", "json", "ndjson"],
+            default="text",
+            help="""
+                Format in which the listing is printed. Defaults to text, which is
+                meant for people. The json format prints a single array of records,
+                while ndjson prints one record per line as soon as it is listed
+                without sorting or buffering the listing.
+                """,
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help="""
+                When specified, cached listings are fetched again from the bucket
+                even if they have yet to expire.
+                """,
+        )
+        parser.add_argument(
+            "--scan",
+            action="store_true",
+            help="""
+                When specified, modules and versions are listed from the contents
+                of the bucket instead of being read from the catalog index.
+                """,
+        )
+    elif command in ("publish", "watch"):
         parser.add_argument(
             "directory",
             default=".",
@@ -120,25 +151,350 @@ def _parse(arguments: typing.List[str] = None):
                 modules will be published even if there are no observed changes.
                 """,
         )
+        parser.add_argument(
+            "--in-memory",
+            action="store_true",
+            help="""
+                When specified, bundles are created and uploaded from memory instead
+                of temporary files on disk. Bundles larger than the spool max size
+                are spilled over into temporary files. Bundles created in memory
+                aren't cached locally.
+                """,
+        )
+        parser.add_argument(
+            "--spool-max-size",
+            type=int,
+            default=32 * 1024 * 1024,
+            help="""
+                Size in bytes beyond which in-memory bundles are spilled over into
+                temporary files on disk. Defaults to 32 MiB.
+                """,
+        )
+        parser.add_argument(
+            "--compression",
+            choices=list(_publisher.COMPRESSION_TYPES),
+            default="deflated",
+            help="""
+                Zip compression method with which module bundles are created.
+                Defaults to deflated.
+                """,
+        )
+        parser.add_argument(
+            "--compression-level",
+            type=int,
+            help="""
+                Compression level for the compression method, which is 0-9 for
+                deflated and 1-9 for bzip2 and is ignored otherwise. Defaults to
+                the default level of the compression method.
+                """,
+        )
+        parser.add_argument(
+            "--reproducible",
+            action="store_true",
+            help="""
+                When specified, bundles are created with fixed timestamps and
+                normalized permissions so that identical module contents always
+                produce byte-identical bundles.
+                """,
+        )
+        parser.add_argument(
+            "--jobs",
+            type=_parse_jobs,
+            default=1,
+            help="""
+                Number of modules to publish concurrently. Defaults to 1, which
+                publishes the modules one at a time.
+                """,
+        )
+
+    extra_arguments = {
+        "publish": _add_changes_arguments,
+        "prune": _add_prune_arguments,
+        "watch": _add_watch_arguments,
+    }
+    if command in extra_arguments:
+        extra_arguments[command](parser)
+
+    parsed = parser.parse_intermixed_args(args=args)
+    _validate(parser, parsed)
+    return parsed
+
+
+def _add_common_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments shared by all commands to the parser."""
+    parser.add_argument(
+        "--aws-directory",
+        default="~/.aws",
+        help="""
+            AWS directory where credentials are stored. Defaults to the standard
+            location expected for AWS.
+            """,
+    )
+    parser.add_argument(
+        "--profile",
+        dest="aws_profile",
+        help="""
+            The name of the AWS profile to use when access the targeted bucket
+            and module files. If not specified the default profile or environment
+            variable values will be used for authentication instead.
+            """,
+    )
+    parser.add_argument(
+        "--bucket",
+        help="""
+            Name of the bucket where the modules reside. A file:// URL stores the
+            modules in a local or network-mounted directory instead.
+            """,
+    )
+    parser.add_argument(
+        "--prefix",
+        default="terrable",
+        help="Shared S3 key prefix for all modules in the specified bucket.",
+    )
+    parser.add_argument(
+        "--endpoint-url",
+        default=os.environ.get("TERRABLE_ENDPOINT_URL"),
+        help="""
+            Custom endpoint URL for S3-compatible storage services. Defaults to the
+            TERRABLE_ENDPOINT_URL environment variable if set and the standard
+            AWS endpoint otherwise.
+            """,
+    )
+    parser.add_argument(
+        "--multipart-threshold",
+        type=int,
+        default=os.environ.get("TERRABLE_MULTIPART_THRESHOLD", 8 * 1024 * 1024),
+        help="""
+            Size in bytes at which bundles are transferred in multiple parts. Can
+            also be set with the TERRABLE_MULTIPART_THRESHOLD environment variable.
+            Defaults to 8 MiB.
+            """,
+    )
+    parser.add_argument(
+        "--multipart-chunksize",
+        type=int,
+        default=os.environ.get("TERRABLE_MULTIPART_CHUNKSIZE", 8 * 1024 * 1024),
+        help="""
+            Size in bytes of each part in multipart transfers. Can also be set with
+            the TERRABLE_MULTIPART_CHUNKSIZE environment variable. Defaults to 8 MiB.
+            """,
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=os.environ.get("TERRABLE_MAX_CONCURRENCY", 10),
+        help="""
+            Maximum number of threads transferring the parts of a single bundle
+            concurrently. Can also be set with the TERRABLE_MAX_CONCURRENCY
+            environment variable. Defaults to 10.
+            """,
+    )
+    parser.add_argument(
+        "--max-pool-connections",
+        type=int,
+        help="""
+            Maximum number of connections kept open by the S3 client. Defaults to
+            the largest of 10, the number of concurrent jobs and the max
+            concurrency.
+            """,
+    )
+    parser.add_argument(
+        "--cache-directory",
+        default=os.environ.get("TERRABLE_CACHE_DIRECTORY", "~/.cache/terrable"),
+        help="""
+            Local directory where bundles and other data are cached between
+            invocations. Defaults to the TERRABLE_CACHE_DIRECTORY environment
+            variable if set and "~/.cache/terrable" otherwise.
+            """,
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        type=int,
+        default=256 * 1024 * 1024,
+        help="""
+            Maximum size in bytes of the cached bundles. The least recently used
+            bundles are evicted from the cache when this limit is exceeded.
+            """,
+    )
+    parser.add_argument(
+        "--listing-ttl",
+        type=float,
+        default=os.environ.get("TERRABLE_LISTING_TTL", 60),
+        help="""
+            Number of seconds for which listings of modules and versions are
+            cached locally and reused without any requests to the bucket. Can also
+            be set with the TERRABLE_LISTING_TTL environment variable. Defaults to
+            60 seconds.
+            """,
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="When specified, the local cache will be neither read nor written.",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="""
+            When specified, the time spent in each phase of the command and the
+            number and latency of S3 calls by operation are printed at the end.
+            """,
+    )
+    parser.add_argument(
+        "--report-file",
+        help="""
+            Path of a JSON file to which the timings of the command are written,
+            which are also included in the report of the command result.
+            """,
+    )
+
+
+def _add_changes_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments that select modules by their changes to the parser."""
+    parser.add_argument(
+        "--changed-since",
+        help="""
+            Git ref, such as a branch, tag or commit, since which modules must
+            have changed to be published. Changes include uncommitted and
+            untracked files. Modules that have never been published are always
+            published.
+            """,
+    )
+
+
+def _add_prune_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments of the prune command to the parser."""
+    parser.add_argument(
+        "--target",
+        dest="module_targets",
+        action="append",
+        help="""
+            Limits pruning to the modules with the names specified by these
+            targets. If no module targets are specified, all modules in the
+            bucket will be pruned.
+            """,
+    )
+    parser.add_argument(
+        "--keep-last",
+        type=int,
+        help="Number of the newest versions of each module to keep.",
+    )
+    parser.add_argument(
+        "--keep-newer-than",
+        type=_pruner.parse_duration,
+        help="""
+            Age below which versions are kept, e.g. 90d. The units s, m, h, d
+            and w are supported and the age is in days without a unit.
+            """,
+    )
+    parser.add_argument(
+        "--pin",
+        dest="pins",
+        action="append",
+        type=_pruner.parse_pin,
+        help="""
+            Module version of the form MODULE:VERSION to keep regardless of
+            the other policies. Can be specified multiple times.
+            """,
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="""
+            If this flag is set, the versions that would be deleted are listed
+            without deleting them.
+            """,
+    )
+    parser.add_argument(
+        "--jobs",
+        type=_parse_jobs,
+        default=4,
+        help="Number of modules to prune concurrently. Defaults to 4.",
+    )
+
+
+def _add_watch_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments of the watch command to the parser."""
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="""
+            Number of seconds between polls of the module directories for
+            changed files. Defaults to 1 second.
+            """,
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.5,
+        help="""
+            Number of seconds for which files must stay unchanged before the
+            modules they belong to are published. Defaults to 0.5 seconds.
+            """,
+    )
+
+
+def _parse_jobs(value: str) -> int:
+    """Parse a number of concurrent jobs, which must be at least 1."""
+    try:
+        jobs = int(value)
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(
+            f'Invalid number of jobs "{value}". Expected a number of at least 1.'
+        )
+    return jobs
+
+
+def _validate(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """Fail parsing for combinations of arguments that argparse can't express."""
+    policies = [
+        getattr(args, "keep_last", None),
+        getattr(args, "keep_newer_than", None),
+    ]
+    if args.command == "prune" and all(p is None for p in policies):
+        # Versions are only deleted by policies that keep at least some of them.
+        parser.error("one of --keep-last or --keep-newer-than is required")
+
 
-    return parser.parse_intermixed_args(args=args)
+def _report_timings(
+    context: "_definitions.Context",
+    result: "_definitions.CommandResult",
+) -> "_definitions.CommandResult":
+    """Add the timings of the command to its result and print or write them."""
+    report = context.report.to_dict()
+    if context.args.timings:
+        print(f"\n\n{_report.echo(report)}", file=context.message_stream)
+    if context.args.report_file:
+        path = pathlib.Path(context.args.report_file).expanduser()
+        path.write_text(json.dumps(report, indent=2))
+    return dataclasses.replace(result, report=report)
 
 
 def run(arguments: typing.List[str] = None) -> "_definitions.CommandResult":
     """Execute the publish action to deploy the resources to S3."""
     args = _parse(arguments)
-    session = boto3.Session(profile_name=args.aws_profile)
-    context = _definitions.Context(args, session)
+    # The AWS session is only created once the bucket is first accessed.
+    context = _definitions.Context(args)
 
     actions = {
         "publish": _publisher.run,
+        "prune": _pruner.run,
         "list": _lister.run,
+        "reindex": _index.run,
+        "watch": _watcher.run,
     }
     result = actions[args.command](context)
-    print(f"\n\n{result.message}\n\n")
+    if context.is_reporting:
+        result = _report_timings(context, result)
+    print(f"\n\n{result.message}\n\n", file=context.message_stream)
     return result
 
 
 def main(arguments: typing.List[str] = None) -> None:  # pragma: no-cover
     """Execute wrapper for CLI Execution."""
-    run(arguments)
+    result = run(arguments)
+    if result.errors:
+        sys.exit(1)
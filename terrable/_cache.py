@@ -0,0 +1,361 @@
+import dataclasses
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import threading
+import time
+import typing
+
+from terrable import _definitions
+
+#: Name of the file in each cache entry directory that holds the entry metadata.
+_ENTRY_FILENAME = "entry.json"
+#: Name of the file in each cache entry directory that holds the cached bundle.
+_BUNDLE_FILENAME = "bundle.zip"
+#: Listing key under which the local copy of the catalog index is cached.
+INDEX_LISTING = "index"
+#: Listing key under which the versions of all modules are cached.
+CATALOG_LISTING = "catalog"
+#: Listing key under which the names of all modules are cached.
+MODULES_LISTING = "modules"
+#: Prefix of the listing keys under which the versions of single modules are cached.
+_VERSIONS_LISTING = "versions/"
+#: Serializes changes to cached listings made by concurrently publishing threads.
+_LISTINGS_LOCK = threading.Lock()
+#: Serializes the eviction of cached bundles by concurrently publishing threads.
+_EVICTION_LOCK = threading.Lock()
+
+
+@dataclasses.dataclass(frozen=True)
+class CacheEntry:
+    """Data structure for a cached module bundle and the remote state it matched."""
+
+    #: Stat fingerprint of the module directory at the time it was bundled.
+    fingerprint: str
+    #: The cached bundle, which resides within the cache directory.
+    bundle: "_definitions.Bundle"
+    #: Key of the remote version that the bundle was found identical to or published
+    #: as. None if the bundle hasn't been matched with a remote version.
+    remote_key: typing.Optional[str] = None
+    #: ETag of the matched remote version if it is known.
+    remote_etag: typing.Optional[str] = None
+
+    def matches(self, version: "_definitions.ModuleVersion") -> bool:
+        """
+        Determine whether the specified remote version is the one cached here.
+
+        The ETag isn't known for versions published from this machine, in which case
+        the key alone identifies the version.
+        """
+        if self.remote_key is None or self.remote_key != version.key:
+            return False
+        return self.remote_etag is None or self.remote_etag == version.etag
+
+
+def _get_root(context: "_definitions.Context") -> typing.Optional[pathlib.Path]:
+    """Get the cache directory root or None if caching is disabled."""
+    if context.args.no_cache:
+        return None
+    return pathlib.Path(context.args.cache_directory).expanduser().absolute()
+
+
+def _get_bundles_root(context: "_definitions.Context") -> typing.Optional[pathlib.Path]:
+    """
+    Get the cache directory root for bundles or None if they aren't cached.
+
+    Bundles created in memory aren't cached as that would write each of them to disk,
+    which is what creating them in memory is meant to avoid.
+    """
+    if context.args.in_memory:
+        return None
+    return _get_root(context)
+
+
+def _get_entry_directory(
+    root: pathlib.Path,
+    source_directory: pathlib.Path,
+) -> pathlib.Path:
+    """Get the cache entry directory for the specified module source directory."""
+    identifier = str(source_directory.absolute()).encode("utf-8")
+    return root.joinpath("bundles", hashlib.sha256(identifier).hexdigest()[:32])
+
+
+def get_fingerprint(
+    source_directory: pathlib.Path,
+    paths: typing.Iterable[pathlib.Path],
+    options: typing.Iterable[str] = (),
+) -> str:
+    """
+    Compute a fingerprint of the module from file stats instead of file contents.
+
+    The fingerprint covers the relative paths, sizes and modification times of the
+    paths to be bundled so that it can be computed without reading any files.
+
+    :param options:
+        Bundling options that change the bundle produced from the same files, such
+        as its compression, which are included in the fingerprint.
+    """
+    hasher = hashlib.sha256()
+    hasher.update("\0".join(options).encode("utf-8") + b"\n")
+    for p in sorted(paths):
+        stat = p.stat()
+        name = p.relative_to(source_directory).as_posix()
+        hasher.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def load(
+    context: "_definitions.Context",
+    source_directory: pathlib.Path,
+    fingerprint: str,
+) -> typing.Optional["CacheEntry"]:
+    """
+    Load the cache entry for the module if it matches the specified fingerprint.
+
+    :return:
+        None if caching is disabled or there is no valid cache entry for the module
+        in its current state.
+    """
+    root = _get_bundles_root(context)
+    if root is None:
+        return None
+
+    directory = _get_entry_directory(root, source_directory)
+    entry_path = directory.joinpath(_ENTRY_FILENAME)
+    bundle_path = directory.joinpath(_BUNDLE_FILENAME)
+    try:
+        data = json.loads(entry_path.read_text())
+    except (OSError, ValueError):
+        return None
+
+    if data.get("fingerprint") != fingerprint or not bundle_path.exists():
+        return None
+
+    # Refresh the modified time to track recent use for eviction purposes.
+    os.utime(entry_path)
+    return CacheEntry(
+        fingerprint=fingerprint,
+        bundle=_definitions.Bundle(
+            name=source_directory.name,
+            path=bundle_path,
+            digest=data["digest"],
+            files=data["files"],
+        ),
+        remote_key=data.get("remote_key"),
+        remote_etag=data.get("remote_etag"),
+    )
+
+
+def store(
+    context: "_definitions.Context",
+    source_directory: pathlib.Path,
+    entry: "CacheEntry",
+) -> None:
+    """Save the cache entry for the module and evict entries beyond the size limit."""
+    root = _get_bundles_root(context)
+    if root is None:
+        return
+
+    directory = _get_entry_directory(root, source_directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    bundle_path = directory.joinpath(_BUNDLE_FILENAME)
+    source = entry.bundle.source
+    if not isinstance(source, pathlib.Path):
+        with bundle_path.open("wb") as f:
+            shutil.copyfileobj(source, f)
+    elif source != bundle_path:
+        shutil.copyfile(source, bundle_path)
+
+    data = {
+        "path": str(source_directory.absolute()),
+        "fingerprint": entry.fingerprint,
+        "digest": entry.bundle.digest,
+        "files": entry.bundle.files,
+        "remote_key": entry.remote_key,
+        "remote_etag": entry.remote_etag,
+    }
+    directory.joinpath(_ENTRY_FILENAME).write_text(json.dumps(data))
+    evict(root, context.args.cache_max_size)
+
+
+def _get_listings_path(
+    root: pathlib.Path,
+    context: "_definitions.Context",
+) -> pathlib.Path:
+    """Get the path of the file holding the cached listings of the context bucket."""
+    identifier = "\0".join(
+        [
+            getattr(context.args, "endpoint_url", None) or "",
+            getattr(context.args, "aws_profile", None) or "",
+            context.args.bucket,
+            context.args.prefix,
+        ]
+    )
+    digest = hashlib.sha256(identifier.encode("utf-8")).hexdigest()[:32]
+    return root.joinpath("listings", f"{digest}.json")
+
+
+def _read_listings(path: pathlib.Path) -> dict:
+    """Read the cached listings from the file, which are empty if it is unreadable."""
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_listings(path: pathlib.Path, listings: dict) -> None:
+    """
+    Write the cached listings to the file.
+
+    The file is replaced atomically so that other processes never read it only
+    partially written.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}")
+    temp_path.write_text(json.dumps(listings))
+    os.replace(temp_path, path)
+
+
+def load_listing(
+    context: "_definitions.Context",
+    key: str,
+) -> typing.Optional[dict]:
+    """
+    Load the cached listing result stored under the key for the context bucket.
+
+    :return:
+        The cached entry, which includes the time it was fetched at regardless of
+        whether it has since expired. None if there is no such entry or caching is
+        disabled.
+    """
+    root = _get_root(context)
+    if root is None:
+        return None
+    return _read_listings(_get_listings_path(root, context)).get(key)
+
+
+def is_fresh(context: "_definitions.Context", entry: typing.Optional[dict]) -> bool:
+    """
+    Determine whether the cached listing entry can be used without fetching it again.
+
+    Entries expire once they are older than the listing TTL and are never fresh when
+    a refresh was requested.
+    """
+    if entry is None or getattr(context.args, "refresh", False):
+        return False
+    age = time.time() - entry.get("fetched_at", 0)
+    return 0 <= age < context.args.listing_ttl
+
+
+def store_listing(context: "_definitions.Context", key: str, **fields) -> None:
+    """Save a listing result fetched from the bucket under the key."""
+    root = _get_root(context)
+    if root is None:
+        return
+
+    path = _get_listings_path(root, context)
+    with _LISTINGS_LOCK:
+        listings = _read_listings(path)
+        listings[key] = {**fields, "fetched_at": time.time()}
+        _write_listings(path, listings)
+
+
+def invalidate_listings(
+    context: "_definitions.Context",
+    module_name: typing.Optional[str] = None,
+) -> None:
+    """
+    Expire the cached listings that include the specified module.
+
+    Listings of all modules are expired along with those of the specified module,
+    or all listings if no module is specified. The local copy of the catalog index
+    is kept so that it can still be revalidated instead of fetched again.
+    """
+    root = _get_root(context)
+    if root is None:
+        return
+
+    path = _get_listings_path(root, context)
+    with _LISTINGS_LOCK:
+        listings = _read_listings(path)
+        if not listings:
+            return
+        expired = (
+            set(listings)
+            if module_name is None
+            else {
+                CATALOG_LISTING,
+                MODULES_LISTING,
+                get_versions_listing_key(module_name),
+            }
+        )
+        listings = {
+            key: entry
+            for key, entry in listings.items()
+            if key == INDEX_LISTING or key not in expired
+        }
+        if INDEX_LISTING in listings:
+            listings[INDEX_LISTING]["fetched_at"] = 0
+        _write_listings(path, listings)
+
+
+def get_versions_listing_key(module_name: str) -> str:
+    """Get the listing key under which the versions of the module are cached."""
+    return f"{_VERSIONS_LISTING}{module_name}"
+
+
+def _get_entry_size(directory: pathlib.Path) -> int:
+    """
+    Get the total size of the files within a cache entry directory.
+
+    Entries that another process removes while they are sized count as empty.
+    """
+    try:
+        return sum(p.stat().st_size for p in directory.iterdir() if p.is_file())
+    except FileNotFoundError:
+        return 0
+
+
+def _get_last_used(directory: pathlib.Path) -> float:
+    """Get the timestamp when the cache entry was last used."""
+    try:
+        return directory.joinpath(_ENTRY_FILENAME).stat().st_mtime
+    except OSError:
+        return 0
+
+
+def evict(root: pathlib.Path, max_size: int) -> typing.List[pathlib.Path]:
+    """
+    Remove the least recently used cache entries until they fit within the max size.
+
+    Threads of this process evict one at a time, while entries removed by other
+    processes in the meantime are skipped.
+
+    :return:
+        The cache entry directories that were removed.
+    """
+    with _EVICTION_LOCK:
+        return _evict(root, max_size)
+
+
+def _evict(root: pathlib.Path, max_size: int) -> typing.List[pathlib.Path]:
+    """Remove the least recently used cache entries beyond the max size."""
+    bundles_directory = root.joinpath("bundles")
+    if not bundles_directory.exists():
+        return []
+
+    directories = sorted(
+        (p for p in bundles_directory.iterdir() if p.is_dir()),
+        key=_get_last_used,
+        reverse=True,
+    )
+    total = 0
+    removed = []
+    for directory in directories:
+        total += _get_entry_size(directory)
+        if total > max_size:
+            shutil.rmtree(directory, ignore_errors=True)
+            removed.append(directory)
+    return removed
@@ -1,8 +1,47 @@
 import argparse
 import dataclasses
 import datetime
+import pathlib
+import sys
+import threading
+import typing
 
-import boto3
+from terrable import _report
+
+if typing.TYPE_CHECKING:  # pragma: no cover
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+
+#: Default number of connections kept in the connection pool of the S3 client.
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+#: Default size in bytes at which bundles are transferred in multiple parts.
+DEFAULT_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+#: Default size in bytes of each part of a multipart transfer.
+DEFAULT_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+#: Default number of threads used to transfer the parts of a single bundle.
+DEFAULT_MAX_CONCURRENCY = 10
+#: Scheme of bucket URLs that select the backend storing modules in a local or
+#: network-mounted directory instead of in S3.
+FILESYSTEM_SCHEME = "file://"
+
+
+def is_filesystem(bucket: str) -> bool:
+    """Determine whether the bucket refers to a directory rather than an S3 bucket."""
+    return bucket.lower().startswith(FILESYSTEM_SCHEME)
+
+
+class VersionConflictError(Exception):
+    """Error raised when another publisher created a module version first."""
+
+
+class DependencyCycleError(Exception):
+    """Error raised when modules reference each other as sources in a cycle."""
+
+    def __init__(self, modules: typing.List[str]):
+        """Create the error for the modules of the cycle in reference order."""
+        super().__init__(" -> ".join(modules))
+        #: Names of the modules in the cycle, which starts and ends with the same one.
+        self.modules = modules
 
 
 @dataclasses.dataclass(frozen=True)
@@ -10,7 +49,142 @@ class Context:
     """Data structure for execution contexts."""
 
     args: argparse.Namespace
-    session: boto3.Session
+    #: AWS session through which the bucket is accessed. When not specified, it is
+    #: created from the profile in the arguments once it's first needed because
+    #: importing boto3 and resolving credentials slows down every command.
+    session: typing.Optional["boto3.Session"] = None
+    #: Timings of the phases of the command and of the S3 calls made by it, which
+    #: are only reported when requested on the command line.
+    report: "_report.Report" = dataclasses.field(
+        default_factory=_report.Report,
+        repr=False,
+        compare=False,
+    )
+    _clients: dict = dataclasses.field(
+        default_factory=lambda: {},
+        init=False,
+        repr=False,
+        compare=False,
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock,
+        init=False,
+        repr=False,
+        compare=False,
+    )
+
+    def get_session(self) -> "boto3.Session":
+        """Get the AWS session, creating it on first use if none was specified."""
+        if self.session is not None:
+            return self.session
+
+        with self._lock:
+            if "session" not in self._clients:
+                import boto3
+
+                profile = getattr(self.args, "aws_profile", None)
+                self._clients["session"] = boto3.Session(profile_name=profile)
+            return self._clients["session"]
+
+    @property
+    def region(self) -> str:
+        """
+        Get the AWS region of the session used for the bucket.
+
+        Buckets that are file:// directories have no region, which spares them from
+        creating a session at all.
+        """
+        if is_filesystem(getattr(self.args, "bucket", None) or ""):
+            return ""
+        return self.get_session().region_name or "us-east-1"
+
+    @property
+    def max_pool_connections(self) -> int:
+        """
+        Get the size of the connection pool of the S3 client.
+
+        Unless explicitly specified, the pool is made large enough to serve every
+        concurrent job and every concurrent transfer thread with a connection.
+        """
+        explicit = getattr(self.args, "max_pool_connections", None)
+        jobs = getattr(self.args, "jobs", None) or 1
+        concurrency = (
+            getattr(self.args, "max_concurrency", None) or DEFAULT_MAX_CONCURRENCY
+        )
+        return explicit or max(DEFAULT_MAX_POOL_CONNECTIONS, jobs, concurrency)
+
+    @property
+    def is_reporting(self) -> bool:
+        """Determine whether the timings of the command should be reported."""
+        return bool(
+            getattr(self.args, "timings", False)
+            or getattr(self.args, "report_file", None)
+        )
+
+    @property
+    def message_stream(self) -> typing.TextIO:
+        """
+        Get the stream to which messages meant for people are printed.
+
+        This is stderr when the command prints machine-readable output to stdout,
+        which then remains parsable.
+        """
+        if getattr(self.args, "output", "text") == "text":
+            return sys.stdout
+        return sys.stderr
+
+    @property
+    def transfer_config(self) -> "TransferConfig":
+        """Get the configuration for uploading and downloading bundles."""
+        from boto3.s3.transfer import TransferConfig
+
+        return TransferConfig(
+            multipart_threshold=(
+                getattr(self.args, "multipart_threshold", None)
+                or DEFAULT_MULTIPART_THRESHOLD
+            ),
+            multipart_chunksize=(
+                getattr(self.args, "multipart_chunksize", None)
+                or DEFAULT_MULTIPART_CHUNKSIZE
+            ),
+            max_concurrency=(
+                getattr(self.args, "max_concurrency", None) or DEFAULT_MAX_CONCURRENCY
+            ),
+        )
+
+    @property
+    def client(self) -> typing.Any:
+        """
+        Get the S3 client shared by everything that uses this context.
+
+        The client is created on first use because creating clients is expensive
+        and each new client starts with an empty connection pool. Creation happens
+        under a lock because boto3 sessions are not thread-safe.
+        """
+        if "s3" in self._clients:
+            return self._clients["s3"]
+
+        # The session is created first because creating it takes the same lock.
+        session = self.get_session()
+        with self._lock:
+            if "s3" not in self._clients:
+                from botocore.config import Config
+
+                endpoint_url = getattr(self.args, "endpoint_url", None)
+                config = Config(
+                    max_pool_connections=self.max_pool_connections,
+                    # S3-compatible services reached through custom endpoints
+                    # generally do not support virtual-hosted bucket addressing.
+                    s3={"addressing_style": "path"} if endpoint_url else None,
+                )
+                self._clients["s3"] = session.client(
+                    "s3",
+                    endpoint_url=endpoint_url,
+                    config=config,
+                )
+                if self.is_reporting:
+                    self.report.attach(self._clients["s3"])
+            return self._clients["s3"]
 
 
 @dataclasses.dataclass(frozen=True)
@@ -20,11 +194,72 @@ class CommandResult:
     code: str
     message: str
     data: dict = dataclasses.field(default_factory=lambda: {})
+    #: Error messages for failures that occurred during the command keyed by the
+    #: names of the modules in which they occurred.
+    errors: typing.Dict[str, str] = dataclasses.field(default_factory=lambda: {})
+    #: Timings of the phases and S3 calls of the command, which are kept apart from
+    #: the data so that they never collide with module names. None unless timings
+    #: were requested.
+    report: typing.Optional[dict] = None
+
+
+@dataclasses.dataclass(frozen=True)
+class Bundle:
+    """Data structure for a locally bundled module and its content manifest."""
+
+    #: Name of the module that was bundled.
+    name: str
+    #: Local path where the zip bundle file resides. None if the bundle resides in
+    #: the buffer instead.
+    path: typing.Optional[pathlib.Path]
+    #: Digest of the entire bundle contents, independent of zip file metadata.
+    digest: str
+    #: Content digests for each file in the bundle keyed by their archive names.
+    files: typing.Dict[str, str] = dataclasses.field(default_factory=lambda: {})
+    #: Spooled buffer holding the bundle when it was created in memory.
+    buffer: typing.Optional[typing.IO[bytes]] = None
+
+    @property
+    def source(self) -> typing.Union[pathlib.Path, typing.IO[bytes]]:
+        """Get the path or buffer from which the bundle can be read."""
+        if self.buffer is not None:
+            self.buffer.seek(0)
+            return self.buffer
+        return typing.cast(pathlib.Path, self.path)
+
+    @property
+    def size(self) -> int:
+        """Get the size of the zip bundle in bytes."""
+        if self.buffer is not None:
+            return self.buffer.seek(0, 2)
+        return typing.cast(pathlib.Path, self.path).stat().st_size
+
+    def close(self) -> None:
+        """Release the buffer of in-memory bundles, which has no effect otherwise."""
+        if self.buffer is not None:
+            self.buffer.close()
 
 
 @dataclasses.dataclass(frozen=True)
 class ModuleVersion:
-    """Data structure for metadata about a bundled module version."""
+    """
+    Data structure for metadata about a bundled module version.
+
+    Fields are parsed once from listing entries when the version is created instead
+    of on every access, and the slots keep large version histories compact.
+    """
+
+    __slots__ = (
+        "name",
+        "region",
+        "bucket",
+        "key",
+        "version",
+        "size",
+        "last_modified",
+        "etag",
+        "raw",
+    )
 
     #: Name of the module that this is a version of.
     name: str
@@ -32,24 +267,51 @@ class ModuleVersion:
     region: str
     #: Bucket where this module resides
     bucket: str
-    #: Response entry from an s3.list_objects_v2 entry response.
-    raw: dict
+    #: S3 key for the remote module zip file.
+    key: str
+    #: Remote module version parsed from its key.
+    version: int
+    #: Size of the object in bytes.
+    size: int
+    #: Last modified datetime for the module.
+    last_modified: datetime.datetime
+    #: ETag of the object if it was listed along with it.
+    etag: typing.Optional[str]
+    #: Response entry from an s3.list_objects_v2 entry response from which the
+    #: version was created. None unless it was explicitly kept.
+    raw: typing.Optional[dict]
 
-    @property
-    def version(self) -> int:
-        """Get the remote module version from its key."""
-        return int(self.raw.get("Key", "").rsplit("/", 1)[-1].split(".")[0] or "0")
+    @classmethod
+    def from_entry(
+        cls,
+        name: str,
+        region: str,
+        bucket: str,
+        entry: dict,
+        keep_raw: bool = False,
+    ) -> "ModuleVersion":
+        """
+        Create the version from an s3.list_objects_v2 response entry.
 
-    @property
-    def key(self) -> str:
-        """Get the S3 key for the remote module zip file."""
-        return self.raw.get("Key", "").lstrip("/")
+        Other storage backends create entries with the same fields.
 
-    @property
-    def last_modified(self) -> datetime.datetime:
-        """Get the last modified datetime for the module."""
-        return self.raw.get("LastModified") or datetime.datetime.utcnow().astimezone(
-            datetime.timezone.utc
+        :param keep_raw:
+            Whether to keep the entry itself on the version as well.
+        """
+        key = entry.get("Key", "").lstrip("/")
+        return cls(
+            name=name,
+            region=region,
+            bucket=bucket,
+            key=key,
+            version=int(key.rsplit("/", 1)[-1].split(".")[0] or "0"),
+            size=entry.get("Size") or 0,
+            last_modified=(
+                entry.get("LastModified")
+                or datetime.datetime.utcnow().astimezone(datetime.timezone.utc)
+            ),
+            etag=entry.get("ETag"),
+            raw=entry if keep_raw else None,
         )
 
     @property
@@ -57,18 +319,27 @@ class ModuleVersion:
         """
         Get the URL to use as the source for this version in a terraform module block.
 
-        These are prefixed by `s3::https://s3-` as desired by terraform.
+        These are prefixed by `s3::https://s3-` as desired by terraform. Versions
+        stored in a file:// bucket directory are referenced by their file URL.
         """
+        if is_filesystem(self.bucket):
+            return f"{self.bucket.rstrip('/')}/{self.key}"
         return "s3::https://s3-{region}.amazonaws.com/{bucket}/{key}".format(
             region=self.region,
             bucket=self.bucket,
             key=self.key,
         )
 
-    @property
-    def size(self) -> int:
-        """Get the size of the object in bytes."""
-        return self.raw.get("Size") or 0
+    def to_dict(self) -> dict:
+        """Return a JSON serializable representation of this version."""
+        return {
+            "module": self.name,
+            "version": self.version,
+            "key": self.key,
+            "size": self.size,
+            "last_modified": self.last_modified.isoformat(),
+            "url": self.module_url,
+        }
 
     def echo(self) -> str:
         """Return a human-friendly representation of this version."""
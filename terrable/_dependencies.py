@@ -0,0 +1,123 @@
+import pathlib
+import re
+import typing
+
+from terrable import _definitions
+
+#: Comments, which are removed before module blocks are searched for, along with
+#: strings that are matched only so that comment markers within them are kept.
+_COMMENT_PATTERN = re.compile(r'"(?:\\.|[^"\\])*"|#[^\n]*|//[^\n]*|/\*.*?\*/', re.S)
+#: Start of a module block up to and including its opening brace.
+_MODULE_PATTERN = re.compile(r'\bmodule\s+"[^"]*"\s*\{')
+#: Source argument of a module block with a local path.
+_SOURCE_PATTERN = re.compile(r'\bsource\s*=\s*"(\.\.?/[^"]*)"')
+
+
+def _strip_comments(text: str) -> str:
+    """Remove the comments from the HCL text while keeping its strings intact."""
+    return _COMMENT_PATTERN.sub(
+        lambda match: match.group(0) if match.group(0).startswith('"') else "",
+        text,
+    )
+
+
+def _get_block(text: str, start: int) -> str:
+    """Get the body of the block whose opening brace precedes the start index."""
+    depth = 1
+    for index in range(start, len(text)):
+        if text[index] == "{":
+            depth += 1
+        elif text[index] == "}":
+            depth -= 1
+        if depth == 0:
+            return text[start:index]
+    return text[start:]
+
+
+def get_sources(text: str) -> typing.List[str]:
+    """
+    Get the local paths referenced as the sources of module blocks.
+
+    Sources of registry, git, S3 and other remote modules are left out, as are the
+    source arguments of nested blocks that appear before that of the module.
+    """
+    text = _strip_comments(text)
+    sources = []
+    for match in _MODULE_PATTERN.finditer(text):
+        source = _SOURCE_PATTERN.search(_get_block(text, match.end()))
+        if source:
+            sources.append(source.group(1))
+    return sources
+
+
+def get_dependencies(
+    directory: pathlib.Path,
+    paths: typing.Iterable[pathlib.Path],
+) -> typing.Set[str]:
+    """
+    Get the names of the sibling module directories referenced by the module.
+
+    :param directory:
+        Module directory, which is a child of the directory of all modules.
+    :param paths:
+        Files of the module, of which the terraform files are searched for module
+        blocks. Relative sources are resolved from the directory of each file.
+    """
+    root = directory.parent.resolve()
+    names = set()
+    for path in paths:
+        if path.suffix != ".tf":
+            continue
+        for source in get_sources(path.read_text(errors="replace")):
+            try:
+                relative = path.parent.joinpath(source).resolve().relative_to(root)
+            except ValueError:
+                continue
+            if relative.parts and relative.parts[0] != directory.name:
+                names.add(relative.parts[0])
+    return names
+
+
+def get_waves(
+    dependencies: typing.Dict[str, typing.Set[str]],
+) -> typing.List[typing.List[str]]:
+    """
+    Order the modules into waves that only depend on modules of earlier waves.
+
+    Dependencies on modules that aren't keys of the dependencies are ignored, which
+    means that modules excluded from a run don't hold back the modules using them.
+    Modules are sorted by name within each wave.
+
+    :return:
+        The module names of each wave. A DependencyCycleError is raised if modules
+        depend on each other in a cycle.
+    """
+    remaining = {
+        name: {d for d in required if d in dependencies and d != name}
+        for name, required in dependencies.items()
+    }
+    waves = []
+    while remaining:
+        waves.append(_pop_wave(remaining))
+    return waves
+
+
+def _pop_wave(remaining: typing.Dict[str, typing.Set[str]]) -> typing.List[str]:
+    """Remove the modules without dependencies left to publish as the next wave."""
+    wave = sorted(name for name, required in remaining.items() if not required)
+    if not wave:
+        raise _definitions.DependencyCycleError(_find_cycle(remaining))
+    for name in wave:
+        del remaining[name]
+    for required in remaining.values():
+        required.difference_update(wave)
+    return wave
+
+
+def _find_cycle(remaining: typing.Dict[str, typing.Set[str]]) -> typing.List[str]:
+    """Find a cycle among modules that all have dependencies left to publish."""
+    path = [next(iter(remaining))]
+    while path.count(path[-1]) < 2:
+        path.append(min(remaining[path[-1]]))
+    start = path.index(path[-1])
+    return path[start:]
@@ -0,0 +1,390 @@
+import datetime
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import threading
+import time
+import typing
+import urllib.parse
+
+from terrable import _definitions
+
+#: Age in seconds beyond which a lock file is assumed to have been left behind by a
+#: process that died while holding it.
+_STALE_LOCK_AGE = 30
+#: Suffix of the files holding the metadata of the bundles that they sit next to.
+_METADATA_SUFFIX = ".json"
+
+
+def get_root(context: "_definitions.Context") -> pathlib.Path:
+    """
+    Get the directory that the file:// bucket URL of the context points to.
+
+    Both file:///absolute/path and file://relative/path URLs are supported.
+    """
+    # Imported here as it pulls in the HTTP client and SSL modules.
+    from urllib.request import url2pathname
+
+    parsed = urllib.parse.urlsplit(context.args.bucket)
+    host = "" if parsed.netloc == "localhost" else parsed.netloc
+    return pathlib.Path(url2pathname(f"{host}{parsed.path}"))
+
+
+def _get_path(context: "_definitions.Context", key: str) -> pathlib.Path:
+    """Get the path of the file stored under the key."""
+    return get_root(context).joinpath(*key.strip("/").split("/"))
+
+
+def _get_key(context: "_definitions.Context", path: pathlib.Path) -> str:
+    """Get the key under which the file at the path is stored."""
+    return path.relative_to(get_root(context)).as_posix()
+
+
+def _create_version(
+    context: "_definitions.Context",
+    module_name: str,
+    path: pathlib.Path,
+) -> "_definitions.ModuleVersion":
+    """Create the module version for the bundle file at the path."""
+    stat = path.stat()
+    entry = {
+        "Key": _get_key(context, path),
+        "Size": stat.st_size,
+        "LastModified": datetime.datetime.fromtimestamp(
+            stat.st_mtime, datetime.timezone.utc
+        ),
+    }
+    return _definitions.ModuleVersion.from_entry(
+        module_name, context.region, context.args.bucket, entry
+    )
+
+
+def _is_bundle(path: pathlib.Path) -> bool:
+    """Determine whether the path is that of a module version bundle file."""
+    stem, _, extension = path.name.partition(".")
+    return stem.isdigit() and extension == "zip" and path.is_file()
+
+
+def iter_modules(context: "_definitions.Context") -> typing.Iterator[str]:
+    """Fetch the modules within the prefix directory in no particular order."""
+    directory = get_root(context).joinpath(context.args.prefix)
+    if directory.is_dir():
+        yield from (p.name for p in directory.iterdir() if p.is_dir())
+
+
+def get_modules(context: "_definitions.Context") -> typing.List[str]:
+    """Fetch the modules available within the prefix directory."""
+    return list(sorted(iter_modules(context)))
+
+
+def iter_versions(
+    context: "_definitions.Context",
+    module_name: str,
+) -> typing.Iterator["_definitions.ModuleVersion"]:
+    """Fetch the deployed versions of a given module in no particular order."""
+    directory = get_root(context).joinpath(context.args.prefix, module_name)
+    if directory.is_dir():
+        for path in directory.iterdir():
+            if _is_bundle(path):
+                yield _create_version(context, module_name, path)
+
+
+def get_versions(
+    context: "_definitions.Context",
+    module_name: str,
+) -> typing.List["_definitions.ModuleVersion"]:
+    """
+    Fetch version information for all deployed versions of a given module.
+
+    The versions are sorted from oldest to newest.
+    """
+    results = iter_versions(context, module_name)
+    return list(sorted(results, key=lambda s: s.version))
+
+
+def iter_catalog(
+    context: "_definitions.Context",
+) -> typing.Iterator["_definitions.ModuleVersion"]:
+    """Fetch the deployed versions of all modules one module after another."""
+    for module_name in iter_modules(context):
+        yield from iter_versions(context, module_name)
+
+
+def get_catalog(
+    context: "_definitions.Context",
+) -> typing.Dict[str, typing.List["_definitions.ModuleVersion"]]:
+    """
+    Fetch version information for all deployed versions of all modules.
+
+    The versions of each module are sorted from oldest to newest.
+    """
+    catalog = {name: get_versions(context, name) for name in get_modules(context)}
+    return {name: versions for name, versions in catalog.items() if versions}
+
+
+def _get_metadata_path(path: pathlib.Path) -> pathlib.Path:
+    """Get the path of the metadata file of the bundle file at the path."""
+    return path.with_suffix(_METADATA_SUFFIX)
+
+
+def get_manifest(
+    context: "_definitions.Context",
+    key: str,
+) -> typing.Optional[dict]:
+    """
+    Fetch the content manifest stored in the metadata of a published bundle.
+
+    :return:
+        A dictionary with the "digest" of the bundle and its per-file digests in
+        "files". None is returned instead if the bundle has no stored manifest.
+    """
+    try:
+        metadata = json.loads(_get_metadata_path(_get_path(context, key)).read_text())
+    except (OSError, ValueError):
+        return None
+    if not metadata.get("digest"):
+        return None
+    return {"digest": metadata["digest"], "files": metadata.get("files")}
+
+
+def _write_atomically(
+    path: pathlib.Path,
+    source: typing.Union[pathlib.Path, typing.IO[bytes], bytes],
+) -> None:
+    """
+    Write the contents of the source file, buffer or bytes to the path.
+
+    The contents are written to a temporary file next to the path that then
+    replaces it, which means that readers never see a partially written file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    try:
+        if isinstance(source, bytes):
+            temp_path.write_bytes(source)
+        elif isinstance(source, pathlib.Path):
+            shutil.copyfile(source, temp_path)
+        else:
+            with temp_path.open("wb") as f:
+                shutil.copyfileobj(source, f)
+        os.replace(temp_path, path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def _write_exclusively(path: pathlib.Path, source: bytes) -> bool:
+    """
+    Write the contents to the path only if the path doesn't exist yet.
+
+    The contents are written to a temporary file that is then hard linked to the
+    path, which fails if the path exists and otherwise makes it appear complete.
+
+    :return:
+        Whether the path was written, which is False if it existed already.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    try:
+        temp_path.write_bytes(source)
+        os.link(temp_path, path)
+    except FileExistsError:
+        return False
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+    return True
+
+
+def put_bundle(
+    context: "_definitions.Context",
+    bundle: "_definitions.Bundle",
+    version: int,
+) -> typing.Optional["_definitions.ModuleVersion"]:
+    """
+    Publish the version of the module to the bucket directory.
+
+    The metadata of the bundle is written before the bundle itself so that every
+    bundle visible to readers has its metadata in place. Creating the metadata file
+    also allocates the version, which fails if another publisher created it first.
+
+    :return:
+        The published module version. None is returned if publishing was skipped
+        as a dry run. A VersionConflictError is raised if the version was published
+        by another publisher in the meantime.
+    """
+    key = f"{context.args.prefix}/{bundle.name}/{version}.zip"
+    if context.args.dry_run:
+        print(f"   ! DRY RUN skipped publishing bundle to {key}")
+        return None
+
+    path = _get_path(context, key)
+    metadata = {
+        "version": version,
+        "module": bundle.name,
+        "digest": bundle.digest,
+        "files": bundle.files,
+    }
+    body = json.dumps(metadata).encode("utf-8")
+    if not _write_exclusively(_get_metadata_path(path), body):
+        raise _definitions.VersionConflictError(key)
+    print(f"   + Copying {bundle.name} {bundle.size:,.0f} bytes")
+    _write_atomically(path, bundle.source)
+    return _create_version(context, bundle.name, path)
+
+
+def delete_bundles(
+    context: "_definitions.Context",
+    keys: typing.List[str],
+) -> typing.Dict[str, str]:
+    """
+    Delete the published bundles from the bucket directory.
+
+    Bundles are deleted before their metadata so that every bundle visible to
+    readers keeps its metadata in place, as when they are published.
+
+    :return:
+        Error messages of the bundles that could not be deleted keyed by their keys.
+    """
+    errors = {}
+    for key in keys:
+        path = _get_path(context, key)
+        try:
+            for target in (path, _get_metadata_path(path)):
+                if target.exists():
+                    target.unlink()
+        except OSError as error:
+            errors[key] = str(error)
+    return errors
+
+
+def get_bundle(
+    context: "_definitions.Context",
+    key: str,
+    destination: typing.Union[pathlib.Path, typing.IO[bytes]],
+):
+    """Copy the bundle to the specified location or writable buffer."""
+    path = _get_path(context, key)
+    if isinstance(destination, pathlib.Path):
+        shutil.copyfile(path, destination)
+    else:
+        with path.open("rb") as f:
+            shutil.copyfileobj(f, destination)
+
+
+def open_bundle(
+    context: "_definitions.Context",
+    version: "_definitions.ModuleVersion",
+) -> typing.IO[bytes]:
+    """Open the published bundle for reading."""
+    return _get_path(context, version.key).open("rb")
+
+
+def _get_index_path(context: "_definitions.Context") -> pathlib.Path:
+    """Get the path of the catalog index file for the prefix."""
+    return get_root(context).joinpath(context.args.prefix, "index.json")
+
+
+def _get_etag(body: bytes) -> str:
+    """Get the entity tag identifying the contents of the catalog index."""
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def get_index(
+    context: "_definitions.Context",
+    etag: typing.Optional[str] = None,
+) -> typing.Tuple[typing.Optional[bytes], typing.Optional[str]]:
+    """
+    Read the contents of the catalog index file along with its entity tag.
+
+    :param etag:
+        Entity tag of a previously read copy of the index, in which case the
+        contents are only returned if they have changed since.
+    :return:
+        A tuple containing the contents and entity tag of the index, in the same
+        way as the S3 backend returns them.
+    """
+    try:
+        body = _get_index_path(context).read_bytes()
+    except FileNotFoundError:
+        return None, None
+    current = _get_etag(body)
+    return (None if current == etag else body), current
+
+
+def _acquire_lock(path: pathlib.Path) -> typing.Optional[int]:
+    """
+    Create the lock file exclusively.
+
+    :return:
+        The descriptor of the created lock file or None if it's held by another
+        writer. Lock files left behind by writers that died are removed.
+    """
+    try:
+        return os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            if time.time() - path.stat().st_mtime > _STALE_LOCK_AGE:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+        return None
+
+
+def put_index(
+    context: "_definitions.Context",
+    body: bytes,
+    etag: typing.Optional[str],
+) -> bool:
+    """
+    Write the catalog index file if it hasn't changed since it was read.
+
+    The comparison and write are made while holding an exclusive lock file, which
+    works on network filesystems that don't support file locking.
+
+    :param etag:
+        Entity tag of the index when it was read or None if there was no index, in
+        which case the write only succeeds if the index still doesn't exist.
+    :return:
+        Whether the index was written, which is False if another writer changed it
+        in the meantime or is currently changing it.
+    """
+    path = _get_index_path(context)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lock_path = path.with_name(f"{path.name}.lock")
+    descriptor = _acquire_lock(lock_path)
+    if descriptor is None:
+        return False
+
+    try:
+        if get_index(context)[1] != etag:
+            return False
+        _write_atomically(path, body)
+        return True
+    finally:
+        os.close(descriptor)
+        lock_path.unlink()
+
+
+def _get_stale_marker_path(context: "_definitions.Context") -> pathlib.Path:
+    """Get the path of the file marking the catalog index as stale."""
+    return get_root(context).joinpath(context.args.prefix, "index.stale")
+
+
+def is_index_stale(context: "_definitions.Context") -> bool:
+    """Determine whether the file marking the catalog index as stale exists."""
+    return _get_stale_marker_path(context).is_file()
+
+
+def mark_index_stale(context: "_definitions.Context") -> None:
+    """Create the file marking the catalog index as stale."""
+    path = _get_stale_marker_path(context)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+
+
+def unmark_index_stale(context: "_definitions.Context") -> None:
+    """Delete the file marking the catalog index as stale if it exists."""
+    _get_stale_marker_path(context).unlink(missing_ok=True)
@@ -0,0 +1,49 @@
+import pathlib
+import subprocess
+import typing
+
+
+def _run(directory: pathlib.Path, arguments: typing.List[str]) -> typing.List[str]:
+    """
+    Run the git command within the directory and return the paths it lists.
+
+    A CalledProcessError with the output of git is raised if the command fails,
+    e.g. because the directory isn't within a repository or the ref doesn't exist.
+    """
+    result = subprocess.run(
+        ["git", *arguments],
+        cwd=directory,
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    return [p for p in result.stdout.split("\0") if p]
+
+
+def get_changed_paths(directory: pathlib.Path, ref: str) -> typing.List[str]:
+    """
+    List the files within the directory that changed since the git ref.
+
+    Changes include the staged and unstaged changes of the working tree as well as
+    files that are untracked and not ignored by git. Renamed files are listed with
+    both their old and new paths.
+
+    :return:
+        Paths of the changed files relative to the directory with forward slashes.
+    """
+    # Paths are listed relative to, and limited to, the directory itself.
+    changed = _run(
+        directory,
+        ["diff", "--name-only", "--relative", "--no-renames", "-z", ref, "--"],
+    )
+    untracked = _run(directory, ["ls-files", "--others", "--exclude-standard", "-z"])
+    return changed + untracked
+
+
+def get_changed_modules(directory: pathlib.Path, ref: str) -> typing.Set[str]:
+    """Get the names of the module directories with files changed since the ref."""
+    return {
+        path.split("/", 1)[0]
+        for path in get_changed_paths(directory, ref)
+        if "/" in path
+    }
@@ -0,0 +1,184 @@
+import dataclasses
+import os
+import pathlib
+import re
+import typing
+
+#: Name of the files holding gitignore-style rules for excluding paths from bundles.
+IGNORE_FILENAME = ".terrableignore"
+
+#: Patterns of paths that don't belong in module bundles. These are applied before
+#: those of exclusion files, which can therefore re-include them with negations.
+DEFAULT_PATTERNS = [
+    ".git/",
+    ".terraform/",
+    "*.tfstate",
+    "*.tfstate.*",
+    ".terraform.tfstate.lock.info",
+    "crash.log",
+    "crash.*.log",
+    "__pycache__/",
+    ".idea/",
+    ".vscode/",
+    ".DS_Store",
+    "*.swp",
+    "*~",
+    IGNORE_FILENAME,
+]
+
+
+@dataclasses.dataclass(frozen=True)
+class Rule:
+    """Data structure for a single gitignore-style exclusion pattern."""
+
+    #: Path prefix of the directory relative to which the pattern is matched,
+    #: including its trailing separator.
+    base: str
+    #: Compiled expression that matches relative paths with forward slashes.
+    expression: typing.Pattern[str]
+    #: Whether the pattern re-includes paths excluded by earlier patterns.
+    negated: bool = False
+    #: Whether the pattern only matches directories.
+    directory_only: bool = False
+
+    def matches(self, path: str, is_directory: bool) -> bool:
+        """Determine whether the pattern matches the specified absolute path."""
+        if self.directory_only and not is_directory:
+            return False
+        if not path.startswith(self.base):
+            return False
+        relative = path[len(self.base) :].replace(os.sep, "/")
+        return self.expression.fullmatch(relative) is not None
+
+
+def _translate_class(pattern: str, index: int) -> typing.Tuple[str, int]:
+    """
+    Translate the character class starting at the index into a regular expression.
+
+    :return:
+        A tuple containing the translated expression and the index following the
+        class, which is a literal bracket if the class isn't closed.
+    """
+    end = pattern.find("]", index + 2)
+    if end < 0:
+        return re.escape("["), index + 1
+    contents = pattern[index + 1 : end].replace("\\", "\\\\")
+    if contents.startswith("!"):
+        contents = f"^{contents[1:]}"
+    return f"[{contents}]", end + 1
+
+
+def _translate(pattern: str) -> str:
+    """
+    Translate a gitignore-style pattern into a regular expression.
+
+    Patterns containing a slash are matched relative to the directory of the rule,
+    while those without one match the name of a path at any depth.
+    """
+    prefix = "" if "/" in pattern else "(?:.*/)?"
+    pattern = pattern.lstrip("/")
+    tokens = {
+        "/**/": "/(?:.*/)?",
+        "**/": "(?:.*/)?",
+        "/**": "/.*",
+        "**": ".*",
+        "*": "[^/]*",
+        "?": "[^/]",
+    }
+    parts = []
+    index = 0
+    while index < len(pattern):
+        token = next((t for t in tokens if pattern.startswith(t, index)), None)
+        if token is not None:
+            parts.append(tokens[token])
+            index += len(token)
+        elif pattern[index] == "[":
+            part, index = _translate_class(pattern, index)
+            parts.append(part)
+        elif pattern[index] == "\\" and index + 1 < len(pattern):
+            parts.append(re.escape(pattern[index + 1]))
+            index += 2
+        else:
+            parts.append(re.escape(pattern[index]))
+            index += 1
+    return prefix + "".join(parts)
+
+
+def parse(
+    lines: typing.Iterable[str],
+    directory: pathlib.Path,
+) -> typing.List["Rule"]:
+    """
+    Parse gitignore-style patterns into rules relative to the specified directory.
+
+    Blank lines and lines starting with a # are skipped. A leading ! negates the
+    pattern and a trailing / restricts it to matching directories.
+    """
+    base = os.path.join(str(directory.absolute()), "")
+    rules = []
+    for line in lines:
+        pattern = line.strip()
+        if not pattern or pattern.startswith("#"):
+            continue
+        negated = pattern.startswith("!")
+        pattern = pattern[1:] if negated else pattern
+        directory_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if pattern:
+            expression = re.compile(_translate(pattern), re.DOTALL)
+            rules.append(Rule(base, expression, negated, directory_only))
+    return rules
+
+
+def load(directory: pathlib.Path) -> typing.List["Rule"]:
+    """Load the rules of the exclusion file within the directory if it has one."""
+    path = directory.joinpath(IGNORE_FILENAME)
+    if not path.is_file():
+        return []
+    return parse(path.read_text().splitlines(), directory)
+
+
+def get_defaults(directory: pathlib.Path) -> typing.List["Rule"]:
+    """Get the built-in exclusion rules relative to the specified directory."""
+    return parse(DEFAULT_PATTERNS, directory)
+
+
+def is_ignored(rules: typing.Iterable["Rule"], path: str, is_directory: bool) -> bool:
+    """
+    Determine whether the absolute path is excluded by the rules.
+
+    As with gitignore files, the last rule matching the path decides whether it is
+    excluded.
+    """
+    ignored = False
+    for rule in rules:
+        if rule.negated == ignored and rule.matches(path, is_directory):
+            ignored = not rule.negated
+    return ignored
+
+
+def walk(
+    directory: pathlib.Path,
+    rules: typing.List["Rule"],
+) -> typing.List[pathlib.Path]:
+    """
+    List the files within the directory that aren't excluded by the rules.
+
+    Excluded directories are pruned from the walk so that none of their contents
+    are ever listed. Symbolic links to directories aren't followed, which could
+    otherwise loop back into the module. The files are listed in a deterministic
+    order.
+    """
+    paths: typing.List[pathlib.Path] = []
+    for current, directories, files in os.walk(directory.absolute()):
+        directories[:] = sorted(
+            d
+            for d in directories
+            if not is_ignored(rules, os.path.join(current, d), True)
+        )
+        paths.extend(
+            pathlib.Path(current, f)
+            for f in sorted(files)
+            if not is_ignored(rules, os.path.join(current, f), False)
+        )
+    return paths
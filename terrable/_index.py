@@ -0,0 +1,319 @@
+import concurrent.futures
+import datetime
+import json
+import random
+import threading
+import time
+import typing
+
+from terrable import _cache
+from terrable import _definitions
+from terrable import _storage
+
+#: Version of the structure of catalog indexes. Indexes with a different format are
+#: treated as stale and are ignored until they are rebuilt.
+FORMAT_VERSION = 1
+#: Number of times writing the index is attempted when other writers change it.
+_WRITE_ATTEMPTS = 5
+#: Serializes the index updates made by this process, which would otherwise
+#: conflict with each other when modules are published concurrently.
+_LOCK = threading.Lock()
+
+
+def encode(data: dict) -> bytes:
+    """Encode the catalog index for storing it."""
+    return json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def decode(body: typing.Optional[bytes]) -> typing.Optional[dict]:
+    """
+    Decode the stored catalog index.
+
+    :return:
+        None if there is no index or if it's malformed or of another format.
+    """
+    try:
+        data = json.loads(body or b"")
+    except ValueError:
+        return None
+
+    valid = (
+        isinstance(data, dict)
+        and data.get("format") == FORMAT_VERSION
+        and isinstance(data.get("modules"), dict)
+    )
+    return data if valid else None
+
+
+def create_entry(
+    version: "_definitions.ModuleVersion",
+    digest: typing.Optional[str] = None,
+) -> dict:
+    """Create the catalog index entry for the module version."""
+    return {
+        "key": version.key,
+        "size": version.size,
+        "last_modified": version.last_modified.isoformat(),
+        "etag": version.etag,
+        "digest": digest,
+    }
+
+
+def _add_entry(
+    data: dict,
+    version: "_definitions.ModuleVersion",
+    digest: typing.Optional[str],
+) -> None:
+    """Add the module version to the catalog index, replacing any existing entry."""
+    entries = [
+        e for e in data["modules"].get(version.name, []) if e["key"] != version.key
+    ]
+    entries.append(create_entry(version, digest))
+    data["modules"][version.name] = entries
+
+
+def from_catalog(
+    catalog: typing.Dict[str, typing.List["_definitions.ModuleVersion"]],
+) -> dict:
+    """Convert the versions of modules into a catalog index without digests."""
+    return {
+        "format": FORMAT_VERSION,
+        "modules": {
+            name: [create_entry(v) for v in versions]
+            for name, versions in catalog.items()
+        },
+    }
+
+
+def to_catalog(
+    context: "_definitions.Context",
+    data: dict,
+) -> typing.Dict[str, typing.List["_definitions.ModuleVersion"]]:
+    """
+    Convert the catalog index into the versions of all modules it holds.
+
+    As with listings, the modules are sorted by name and their versions from oldest
+    to newest.
+    """
+    catalog = {}
+    for name, entries in sorted(data["modules"].items()):
+        versions = []
+        for entry in entries:
+            raw = {
+                "Key": entry["key"],
+                "Size": entry["size"],
+                "LastModified": datetime.datetime.fromisoformat(entry["last_modified"]),
+            }
+            if entry.get("etag"):
+                raw["ETag"] = entry["etag"]
+            versions.append(
+                _definitions.ModuleVersion.from_entry(
+                    name, context.region, context.args.bucket, raw
+                )
+            )
+        catalog[name] = list(sorted(versions, key=lambda v: v.version))
+    return catalog
+
+
+def load(
+    context: "_definitions.Context",
+) -> typing.Tuple[
+    typing.Optional[typing.Dict[str, typing.List["_definitions.ModuleVersion"]]], bool
+]:
+    """
+    Load the versions of all modules from the catalog index.
+
+    A local copy of the index is used without any requests until the listing TTL
+    expires. After that, the index is only downloaded again if it has changed since
+    the local copy was fetched, and whether it was marked as stale is checked again.
+
+    :return:
+        A tuple containing the versions of all modules and whether the index was
+        marked as stale. The versions are None if there is no valid index in the
+        bucket, in which case the versions have to be listed instead.
+    """
+    cached = _cache.load_listing(context, _cache.INDEX_LISTING) or {}
+    body = cached["body"].encode("utf-8") if cached.get("body") else None
+    stale = bool(cached.get("stale"))
+    if not _cache.is_fresh(context, cached):
+        fetched, etag = _storage.get_index(context, cached.get("etag"))
+        # Nothing is fetched when the index is unchanged since the local copy.
+        if fetched is not None or etag is None:
+            body = fetched
+        stale = body is not None and _storage.is_index_stale(context)
+        _cache.store_listing(
+            context,
+            _cache.INDEX_LISTING,
+            body=body.decode("utf-8") if body else None,
+            etag=etag,
+            stale=stale,
+        )
+
+    data = decode(body)
+    return (None if data is None else to_catalog(context, data)), stale
+
+
+def _wait(attempt: int) -> None:
+    """Wait before retrying a conflicting write, backing off with each attempt."""
+    time.sleep(random.uniform(0, 0.1 * 2**attempt))
+
+
+def _modify(
+    context: "_definitions.Context",
+    change: typing.Callable[[dict], None],
+) -> bool:
+    """
+    Apply the change to the catalog index and write it back.
+
+    The index is written conditionally on it being unchanged since it was fetched,
+    which is retried with the change applied to the new index when other writers
+    change it in the meantime.
+
+    :return:
+        Whether the index was changed, which is False if there is no index.
+    """
+    with _LOCK:
+        try:
+            for attempt in range(_WRITE_ATTEMPTS):
+                body, etag = _storage.get_index(context)
+                data = decode(body)
+                if data is None:
+                    return False
+
+                change(data)
+                if _storage.put_index(context, encode(data), etag):
+                    return True
+                _wait(attempt)
+        except Exception:
+            _mark_stale(context)
+            raise
+
+    print("   ! Catalog index was not updated due to concurrent changes to it.")
+    _mark_stale(context)
+    print("   ! Run the reindex command to bring it up to date.")
+    return False
+
+
+def _mark_stale(context: "_definitions.Context") -> None:
+    """
+    Mark the catalog index as stale after failing to update it.
+
+    Listings then list the bucket instead of reading the index until it's rebuilt.
+    Failing to mark the index is only reported because the index update failed
+    already.
+    """
+    try:
+        _storage.mark_index_stale(context)
+    except Exception as error:
+        print(f"   ! Failed to mark the catalog index as stale. {error}")
+    else:
+        print("   ! Marked the catalog index as stale.")
+
+
+def update(
+    context: "_definitions.Context",
+    version: "_definitions.ModuleVersion",
+    digest: typing.Optional[str],
+) -> bool:
+    """
+    Add the newly published module version to the catalog index.
+
+    Missing or stale indexes are left for the reindex command to create because
+    adding a single version to them would not make them complete.
+
+    :return:
+        Whether the index was updated.
+    """
+    return _modify(context, lambda data: _add_entry(data, version, digest))
+
+
+def _remove_entries(data: dict, keys: typing.Set[str]) -> None:
+    """Remove the versions with the keys from the catalog index."""
+    for name, entries in list(data["modules"].items()):
+        remaining = [e for e in entries if e["key"] not in keys]
+        if remaining:
+            data["modules"][name] = remaining
+        else:
+            del data["modules"][name]
+
+
+def remove(context: "_definitions.Context", keys: typing.Iterable[str]) -> bool:
+    """
+    Remove the deleted module versions from the catalog index.
+
+    :return:
+        Whether the index was updated.
+    """
+    removed = set(keys)
+    return _modify(context, lambda data: _remove_entries(data, removed))
+
+
+def _get_digests(
+    context: "_definitions.Context",
+    versions: typing.List["_definitions.ModuleVersion"],
+    known: typing.Dict[str, str],
+) -> typing.List[typing.Optional[str]]:
+    """
+    Get the bundle digests of the versions from their metadata.
+
+    Digests already known from the previous index are reused, while those of the
+    other versions are fetched concurrently.
+    """
+
+    def _get_digest(version: "_definitions.ModuleVersion") -> typing.Optional[str]:
+        if version.key in known:
+            return known[version.key]
+        manifest = _storage.get_manifest(context, version.key)
+        return manifest["digest"] if manifest else None
+
+    workers = context.max_pool_connections
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_get_digest, versions))
+
+
+def rebuild(context: "_definitions.Context") -> dict:
+    """
+    Rebuild the catalog index from a listing of all module versions.
+
+    :return:
+        The written catalog index.
+    """
+    # The stale marker is removed before listing the versions so that publishes
+    # failing to update the index in the meantime mark the rebuilt index again.
+    _storage.unmark_index_stale(context)
+    for attempt in range(_WRITE_ATTEMPTS):
+        body, etag = _storage.get_index(context)
+        previous = decode(body) or {"modules": {}}
+        known = {
+            e["key"]: e["digest"]
+            for entries in previous["modules"].values()
+            for e in entries
+            if e.get("digest")
+        }
+
+        catalog = _storage.get_catalog(context)
+        versions = [v for name in catalog for v in catalog[name]]
+        data: dict = {"format": FORMAT_VERSION, "modules": {}}
+        for version, digest in zip(versions, _get_digests(context, versions, known)):
+            _add_entry(data, version, digest)
+
+        if _storage.put_index(context, encode(data), etag):
+            return data
+        _wait(attempt)
+
+    raise RuntimeError("The catalog index kept changing while it was being rebuilt.")
+
+
+def run(context: "_definitions.Context") -> "_definitions.CommandResult":
+    """Execute a reindex action for the given command context."""
+    with context.report.phase("reindex"):
+        data = rebuild(context)
+    _cache.invalidate_listings(context)
+    modules = list(sorted(data["modules"]))
+    count = sum(len(entries) for entries in data["modules"].values())
+    print(f"\n\nIndexed {count} versions of {len(modules)} modules.")
+    return _definitions.CommandResult(
+        code="REINDEXED",
+        message="Catalog index has been rebuilt.",
+        data={"modules": modules},
+    )
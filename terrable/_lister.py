@@ -1,12 +1,154 @@
+import dataclasses
+import itertools
+import json
 import textwrap
+import typing
 
+from terrable import _cache
 from terrable import _definitions
-from terrable import _s3
+from terrable import _index
+from terrable import _storage
 
 
-def _list_versions_for(context: "_definitions.Context", module_name: str):
-    """List versions for a module."""
-    versions = _s3.get_versions(context, module_name)
+def _get_cached(
+    context: "_definitions.Context",
+    key: str,
+    fetch: typing.Callable[[], typing.Any],
+) -> typing.Any:
+    """
+    Get a listing result from the local cache or by fetching it from the bucket.
+
+    :param fetch:
+        Function that lists the result from the bucket in a JSON serializable form
+        when there is no cached result that has yet to expire.
+    """
+    cached = _cache.load_listing(context, key)
+    if cached is not None and _cache.is_fresh(context, cached):
+        return cached["value"]
+
+    with context.report.phase("list"):
+        value = fetch()
+    _cache.store_listing(context, key, value=value)
+    return value
+
+
+def _get_catalog(
+    context: "_definitions.Context",
+) -> typing.Dict[str, typing.List["_definitions.ModuleVersion"]]:
+    """Get the versions of all modules from a cached or fresh bucket listing."""
+    data = _get_cached(
+        context,
+        _cache.CATALOG_LISTING,
+        lambda: _index.from_catalog(_storage.get_catalog(context)),
+    )
+    return _index.to_catalog(context, data)
+
+
+def _get_versions(
+    context: "_definitions.Context",
+    module_name: str,
+) -> typing.List["_definitions.ModuleVersion"]:
+    """Get the versions of the module from a cached or fresh bucket listing."""
+    data = _get_cached(
+        context,
+        _cache.get_versions_listing_key(module_name),
+        lambda: _index.from_catalog(
+            {module_name: _storage.get_versions(context, module_name)}
+        ),
+    )
+    return _index.to_catalog(context, data).get(module_name, [])
+
+
+def _load_index(
+    context: "_definitions.Context",
+) -> typing.Optional[typing.Dict[str, typing.List["_definitions.ModuleVersion"]]]:
+    """
+    Load the versions of all modules from the catalog index unless scanning.
+
+    :return:
+        None if the versions should be listed from the bucket instead, either
+        because a scan was requested, because there is no valid catalog index or
+        because the index was marked as stale by a publish that couldn't update it.
+    """
+    if context.args.scan:
+        return None
+
+    with context.report.phase("index"):
+        catalog, stale = _index.load(context)
+    stream = context.message_stream
+    if catalog is None:
+        print(
+            "\n! No catalog index found. Listing the bucket contents instead.",
+            file=stream,
+        )
+        print("! Run the reindex command to create the catalog index.", file=stream)
+    elif stale:
+        print(
+            "\n! The catalog index is out of date. Listing the bucket contents"
+            " instead.",
+            file=stream,
+        )
+        print("! Run the reindex command to update the catalog index.", file=stream)
+        return None
+    return catalog
+
+
+def _get_module_versions(
+    context: "_definitions.Context",
+    module_name: str,
+) -> typing.List["_definitions.ModuleVersion"]:
+    """Get the versions of the module from the catalog index or a bucket listing."""
+    # Modules missing from the catalog index were likely published without
+    # updating it, which is why they are listed from the bucket instead.
+    catalog = _load_index(context) or {}
+    return catalog.get(module_name) or _get_versions(context, module_name)
+
+
+def _get_modules(
+    context: "_definitions.Context",
+) -> typing.Tuple[
+    typing.List[str],
+    typing.Optional[typing.Dict[str, typing.List["_definitions.ModuleVersion"]]],
+]:
+    """
+    Get the names of the modules in the bucket prefix along with their versions.
+
+    :return:
+        A tuple containing the module names and the versions of all modules, which
+        are None if they weren't needed to list the modules.
+    """
+    verbose = bool(context.args.verbose or context.args.latest)
+
+    # Verbose listings need the versions of every module, which are fetched with a
+    # single listing of the entire prefix rather than listing each module in turn
+    # when there is no catalog index to read them from.
+    catalog = _load_index(context)
+    if catalog is None and verbose:
+        catalog = _get_catalog(context)
+    module_names = (
+        _get_cached(
+            context, _cache.MODULES_LISTING, lambda: _storage.get_modules(context)
+        )
+        if catalog is None
+        else list(catalog)
+    )
+    return module_names, catalog
+
+
+def _list_versions_for(
+    context: "_definitions.Context",
+    module_name: str,
+    versions: typing.Optional[typing.List["_definitions.ModuleVersion"]] = None,
+):
+    """
+    List versions for a module.
+
+    :param versions:
+        Versions of the module if they have already been fetched. Otherwise, they
+        will be fetched here.
+    """
+    if versions is None:
+        versions = _get_module_versions(context, module_name)
 
     print(f"\n\n=== {module_name} ===")
 
@@ -28,13 +170,13 @@ def _list_versions_for(context: "_definitions.Context", module_name: str):
 
 def _list_modules(context: "_definitions.Context") -> "_definitions.CommandResult":
     """Show the modules available in the specified bucket prefix."""
-    module_names = _s3.get_modules(context)
     verbose = bool(context.args.verbose or context.args.latest)
+    module_names, catalog = _get_modules(context)
 
     print("\n\nAvailable Modules:")
     for name in module_names:
-        if verbose:
-            _list_versions_for(context, name)
+        if verbose and catalog is not None:
+            _list_versions_for(context, name, catalog[name])
         else:
             print(f"  - {name}")
 
@@ -54,8 +196,125 @@ def _list_versions(context: "_definitions.Context") -> "_definitions.CommandResu
     return _list_versions_for(context, context.args.module_target)
 
 
+def _get_latest(
+    versions: typing.Iterable["_definitions.ModuleVersion"],
+) -> typing.Iterator["_definitions.ModuleVersion"]:
+    """
+    Get the latest version of each module from versions grouped by their module.
+
+    The latest version of a module is yielded as soon as the versions of the next
+    module start, which means that the versions never need to be held in memory.
+    """
+    for _, group in itertools.groupby(versions, key=lambda v: v.name):
+        yield max(group, key=lambda v: v.version)
+
+
+def _get_result(context: "_definitions.Context") -> "_definitions.CommandResult":
+    """Get the result of a machine-readable listing for the command arguments."""
+    if context.args.module_target and context.args.latest:
+        code, message = "LISTED_LATEST_VERSION", "Latest version data has been listed."
+    elif context.args.module_target:
+        code, message = "LISTED_VERSIONS", "Module versions have been listed."
+    else:
+        code, message = "LISTED_MODULES", "Modules have been listed."
+    return _definitions.CommandResult(code=code, message=message)
+
+
+def _iter_versions(
+    context: "_definitions.Context",
+    catalog: typing.Optional[
+        typing.Dict[str, typing.List["_definitions.ModuleVersion"]]
+    ],
+) -> typing.Iterator["_definitions.ModuleVersion"]:
+    """
+    Get the versions to list from the catalog index or as the bucket lists them.
+
+    The versions of each module are always listed together.
+    """
+    target = context.args.module_target
+    if catalog is not None and (target is None or target in catalog):
+        return (v for name in catalog if target in (None, name) for v in catalog[name])
+    if target:
+        return _storage.iter_versions(context, target)
+    return _storage.iter_catalog(context)
+
+
+def _iter_records(context: "_definitions.Context") -> typing.Iterator[dict]:
+    """
+    List the modules or versions as records while they are listed in the bucket.
+
+    Records are read from the catalog index if there is one. Otherwise, they are
+    yielded as each page of the bucket listing arrives, in the order in which the
+    bucket lists them.
+    """
+    catalog = _load_index(context)
+    verbose = bool(context.args.verbose or context.args.latest)
+    if not context.args.module_target and not verbose:
+        names = _storage.iter_modules(context) if catalog is None else iter(catalog)
+        yield from ({"module": name} for name in names)
+        return
+
+    versions = _iter_versions(context, catalog)
+    if context.args.latest:
+        versions = _get_latest(versions)
+    yield from (v.to_dict() for v in versions)
+
+
+def _stream(context: "_definitions.Context") -> "_definitions.CommandResult":
+    """Print each listed record on a line of its own as soon as it's listed."""
+    count = 0
+    for record in _iter_records(context):
+        print(json.dumps(record), flush=True)
+        count += 1
+
+    result = _get_result(context)
+    return dataclasses.replace(result, data={"count": count})
+
+
+def _select(
+    context: "_definitions.Context",
+    versions: typing.List["_definitions.ModuleVersion"],
+) -> typing.List["_definitions.ModuleVersion"]:
+    """Select the versions of a module to list, which is only the latest if asked."""
+    return versions[-1:] if context.args.latest else versions
+
+
+def _get_records(context: "_definitions.Context") -> typing.Tuple[list, dict]:
+    """
+    Get the sorted listing as records.
+
+    :return:
+        A tuple containing the records and the data of the command result.
+    """
+    target = context.args.module_target
+    if target:
+        versions = _get_module_versions(context, target)
+        return [v.to_dict() for v in _select(context, versions)], {}
+
+    module_names, catalog = _get_modules(context)
+    data = {"modules": module_names}
+    if catalog is None or not (context.args.verbose or context.args.latest):
+        return [{"module": name} for name in module_names], data
+    records = [
+        v.to_dict() for name in module_names for v in _select(context, catalog[name])
+    ]
+    return records, data
+
+
+def _dump(context: "_definitions.Context") -> "_definitions.CommandResult":
+    """Print the sorted listing as a single array of JSON records."""
+    records, data = _get_records(context)
+    print(json.dumps(records, indent=2))
+    return dataclasses.replace(_get_result(context), data=data)
+
+
 def run(context: "_definitions.Context") -> "_definitions.CommandResult":
     """List version information for the specified command invocation."""
+    if context.args.output == "ndjson":
+        return _stream(context)
+    if context.args.output == "json":
+        return _dump(context)
+
     if not context.args.module_target:
         return _list_modules(context)
 
@@ -0,0 +1,215 @@
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import re
+import typing
+
+from terrable import _cache
+from terrable import _definitions
+from terrable import _index
+from terrable import _storage
+from terrable import _utils
+
+#: Lengths of retention duration units in seconds keyed by their suffixes.
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_duration(value: str) -> datetime.timedelta:
+    """
+    Parse a retention duration such as "90d" or "12h" as a command line argument.
+
+    Durations without a unit are in days.
+    """
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smhdw]?)", value.strip().lower())
+    if not match:
+        raise argparse.ArgumentTypeError(
+            f'Invalid duration "{value}". Expected a number followed by one of the'
+            " units s, m, h, d or w."
+        )
+    seconds = float(match.group(1)) * _DURATION_UNITS[match.group(2) or "d"]
+    return datetime.timedelta(seconds=seconds)
+
+
+def parse_pin(value: str) -> typing.Tuple[str, int]:
+    """Parse a pinned module version of the form MODULE:VERSION."""
+    name, _, version = value.rpartition(":")
+    if not name or not version.isdigit():
+        raise argparse.ArgumentTypeError(
+            f'Invalid pinned version "{value}". Expected MODULE:VERSION.'
+        )
+    return name, int(version)
+
+
+def select(
+    versions: typing.List["_definitions.ModuleVersion"],
+    keep_last: typing.Optional[int] = None,
+    keep_newer_than: typing.Optional[datetime.timedelta] = None,
+    pinned: typing.Collection[int] = (),
+    now: typing.Optional[datetime.datetime] = None,
+) -> typing.List["_definitions.ModuleVersion"]:
+    """
+    Select the versions of a module that none of the retention policies keep.
+
+    The latest version is always kept, which means that the numbers of deleted
+    versions are never allocated again when the module is published next.
+
+    :param versions:
+        Versions of the module sorted from oldest to newest.
+    :param keep_last:
+        Number of the newest versions to keep.
+    :param keep_newer_than:
+        Age of the oldest versions to keep.
+    :param pinned:
+        Numbers of the versions to keep regardless of the other policies.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    kept = max(keep_last or 0, 1)
+    return [
+        v
+        for v in versions[:-kept]
+        if v.version not in pinned
+        and (keep_newer_than is None or now - v.last_modified > keep_newer_than)
+    ]
+
+
+def _delete(
+    context: "_definitions.Context",
+    module_name: str,
+    versions: typing.List["_definitions.ModuleVersion"],
+) -> typing.Tuple[typing.List[str], typing.Optional[str]]:
+    """
+    Delete the versions of the module unless this is a dry run.
+
+    :return:
+        A tuple containing the keys of the deleted versions, or of those that would
+        have been deleted for dry runs, and the error message if some versions
+        could not be deleted.
+    """
+    print(f"\nPRUNING: {module_name}")
+    keys = [v.key for v in versions]
+    if context.args.dry_run:
+        for key in keys:
+            print(f"   ! DRY RUN skipped deleting {key}")
+        return keys, None
+
+    try:
+        errors = _storage.delete_bundles(context, keys)
+    except Exception as error:
+        message = f"{type(error).__name__}: {error}"
+        print(f'   ! Failed to prune "{module_name}". {message}')
+        return [], message
+
+    deleted = [key for key in keys if key not in errors]
+    for key in deleted:
+        print(f"   - Deleted {key}")
+    for key, message in errors.items():
+        print(f"   ! Failed to delete {key}. {message}")
+    if not errors:
+        return deleted, None
+    return deleted, "Failed to delete {}.".format(", ".join(errors))
+
+
+def _delete_buffered(
+    context: "_definitions.Context",
+    module_name: str,
+    versions: typing.List["_definitions.ModuleVersion"],
+) -> typing.Tuple[typing.List[str], typing.Optional[str], str]:
+    """Delete the versions of the module while buffering its printed output."""
+    with _utils.buffered_output() as buffer:
+        deleted, error = _delete(context, module_name, versions)
+    return deleted, error, buffer.getvalue()
+
+
+def _delete_all(
+    context: "_definitions.Context",
+    selected: typing.Dict[str, typing.List["_definitions.ModuleVersion"]],
+) -> typing.Dict[str, typing.Tuple[typing.List[str], typing.Optional[str]]]:
+    """
+    Delete the selected versions of the modules on a pool of threads.
+
+    The output of each module is printed in the order of the modules once it has
+    finished so that the output of modules is never interleaved.
+    """
+    outcomes = {}
+    with _utils.routed_output(), concurrent.futures.ThreadPoolExecutor(
+        max_workers=context.args.jobs
+    ) as executor:
+        futures = {
+            name: executor.submit(_delete_buffered, context, name, versions)
+            for name, versions in selected.items()
+        }
+        for name, future in futures.items():
+            deleted, error, output = future.result()
+            print(output, end="")
+            outcomes[name] = (deleted, error)
+    return outcomes
+
+
+def _select_all(
+    context: "_definitions.Context",
+    catalog: typing.Dict[str, typing.List["_definitions.ModuleVersion"]],
+) -> typing.Dict[str, typing.List["_definitions.ModuleVersion"]]:
+    """Select the versions to delete of each targeted module with any to delete."""
+    args = context.args
+    pinned = collections.defaultdict(set)
+    for name, version in args.pins or []:
+        pinned[name].add(version)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    selected = {}
+    for name, versions in catalog.items():
+        if args.module_targets and name not in args.module_targets:
+            continue
+        selected[name] = select(
+            versions, args.keep_last, args.keep_newer_than, pinned[name], now
+        )
+    return {name: versions for name, versions in selected.items() if versions}
+
+
+def _forget(
+    context: "_definitions.Context",
+    outcomes: typing.Dict[str, typing.Tuple[typing.List[str], typing.Optional[str]]],
+) -> None:
+    """Remove the deleted versions from the catalog index and cached listings."""
+    deleted = [key for keys, _ in outcomes.values() for key in keys]
+    if not deleted:
+        return
+    with context.report.phase("index"):
+        if _index.remove(context, deleted):
+            print("\n   + Removed the deleted versions from the catalog index")
+    for name, (keys, _) in outcomes.items():
+        if keys:
+            _cache.invalidate_listings(context, name)
+
+
+def run(context: "_definitions.Context") -> "_definitions.CommandResult":
+    """Execute a prune action for the given command context."""
+    # Versions are listed from the bucket rather than read from the catalog index,
+    # which could be missing versions published without updating it.
+    with context.report.phase("catalog"):
+        catalog = _storage.get_catalog(context)
+    selected = _select_all(context, catalog)
+
+    with context.report.phase("delete"):
+        outcomes = _delete_all(context, selected)
+    if not context.args.dry_run:
+        _forget(context, outcomes)
+
+    results = {name: keys for name, (keys, _) in outcomes.items()}
+    errors = {name: error for name, (_, error) in outcomes.items() if error}
+    if errors:
+        return _definitions.CommandResult(
+            code="PRUNE_FAILED",
+            message="Failed to prune modules: {}.".format(", ".join(errors)),
+            data=results,
+            errors=errors,
+        )
+
+    count = sum(len(keys) for keys in results.values())
+    outcome = "would have been" if context.args.dry_run else "have been"
+    return _definitions.CommandResult(
+        code="PRUNED",
+        message=f"{count} version(s) {outcome} deleted.",
+        data=results,
+    )
@@ -1,123 +1,931 @@
+import concurrent.futures
+import contextlib
+import dataclasses
+import io
+import multiprocessing
 import pathlib
 import shutil
+import struct
+import subprocess
 import tempfile
+import threading
 import typing
 import zipfile
 
+from terrable import _cache
 from terrable import _definitions
-from terrable import _s3
+from terrable import _dependencies
+from terrable import _git
+from terrable import _ignore
+from terrable import _index
+from terrable import _storage
 from terrable import _utils
 
+#: Total size in bytes of the files of a module beyond which they are compressed in
+#: parallel on a pool of processes instead of one after the other.
+_PARALLEL_THRESHOLD = 8 * 1024 * 1024
+#: Size in bytes of the fixed length portion of zip local file headers.
+_LOCAL_HEADER_SIZE = 30
+#: Size in bytes of the fixed length portion of zip central directory headers.
+_CENTRAL_HEADER_SIZE = 46
+#: Position of the offset of the local header within zip central directory headers.
+_OFFSET_FIELD = slice(42, 46)
+#: Layout of the end of central directory record that completes zip files.
+_END_RECORD = struct.Struct("<4s4H2LH")
+#: Timestamp given to every bundled file in reproducible bundles, which is the
+#: earliest that zip files can represent.
+_REPRODUCIBLE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+#: Number of version numbers that publishing a module attempts to allocate when
+#: other publishers keep creating the same versions concurrently.
+_ALLOCATION_ATTEMPTS = 10
+#: Zip compression methods that can be selected for bundles keyed by their names.
+COMPRESSION_TYPES = {
+    "stored": zipfile.ZIP_STORED,
+    "deflated": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+
+
+class _LazyProcessPool(concurrent.futures.Executor):
+    """
+    Process pool that only starts its worker processes once work is submitted.
+
+    Workers are started with the forkserver method, or the spawn method where it's
+    unavailable, rather than forked from a process whose other threads could be in
+    the middle of publishing modules concurrently.
+    """
+
+    def __init__(self) -> None:
+        self._executor: typing.Optional[concurrent.futures.Executor] = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs) -> "concurrent.futures.Future":
+        """Schedule the function to be executed on a worker process."""
+        with self._lock:
+            if self._executor is None:
+                methods = multiprocessing.get_all_start_methods()
+                method = "forkserver" if "forkserver" in methods else "spawn"
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    mp_context=multiprocessing.get_context(method)
+                )
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, **kwargs) -> None:
+        """Stop the worker processes if they have been started."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait, **kwargs)
+
+
+@dataclasses.dataclass(frozen=True)
+class Workspace:
+    """Data structure for state shared by all modules published in a run."""
+
+    #: Temporary directory in which bundles are created.
+    temp_directory: pathlib.Path
+    #: Versions of all modules when they were fetched together in a single listing,
+    #: to which the versions published within the workspace are added. None if the
+    #: versions of each module should be listed separately instead.
+    catalog: typing.Optional[
+        typing.Dict[str, typing.List["_definitions.ModuleVersion"]]
+    ] = None
+    #: Process pool on which the files of large modules are compressed. None if
+    #: files are always compressed one after the other.
+    executor: typing.Optional[concurrent.futures.Executor] = None
+    #: Exclusion rules from the root directory that apply to every module.
+    ignore_rules: typing.List["_ignore.Rule"] = dataclasses.field(
+        default_factory=lambda: []
+    )
+
+
+def _normalize_info(info: zipfile.ZipInfo) -> None:
+    """
+    Replace the filesystem metadata of the zip member with fixed values.
+
+    Only whether the file is executable is kept from its permissions, which is
+    what version control systems track as well.
+    """
+    executable = (info.external_attr >> 16) & 0o111
+    info.date_time = _REPRODUCIBLE_DATE_TIME
+    info.create_system = 3
+    info.external_attr = (0o100755 if executable else 0o100644) << 16
+
+
+def _write_file(
+    zipper: zipfile.ZipFile,
+    path: pathlib.Path,
+    arcname: str,
+    reproducible: bool = False,
+) -> str:
+    """
+    Write the file into the zip bundle while computing its content digest.
+
+    The file is read only once, with its contents both hashed and compressed.
+
+    :param reproducible:
+        Whether to write the file with normalized metadata instead of that of the
+        file on disk.
+    :return:
+        The content digest of the written file.
+    """
+    hasher = _utils.create_file_hasher()
+    # Timestamps are only validated when they are kept because zip files can't
+    # represent those of files modified before 1980.
+    info = zipfile.ZipInfo.from_file(
+        path, arcname=arcname, strict_timestamps=not reproducible
+    )
+    if reproducible:
+        _normalize_info(info)
+    data = path.read_bytes()
+    hasher.update(data)
+    zipper.writestr(
+        info,
+        data,
+        compress_type=zipper.compression,
+        compresslevel=zipper.compresslevel,
+    )
+    return _utils.get_file_digest(hasher)
+
+
+def _compress_file(
+    path: pathlib.Path,
+    arcname: str,
+    compression: int,
+    compression_level: typing.Optional[int],
+    reproducible: bool = False,
+) -> typing.Tuple[str, bytes]:
+    """
+    Compress the file into a zip archive of its own within a worker process.
+
+    :return:
+        A tuple containing the content digest of the file and the bytes of the
+        single member zip archive holding it.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(
+        buffer,
+        mode="w",
+        compression=compression,
+        compresslevel=compression_level,
+    ) as zipper:
+        digest = _write_file(zipper, path, arcname, reproducible)
+    return digest, buffer.getvalue()
+
+
+def _split_member(archive: bytes) -> typing.Tuple[bytes, bytearray]:
+    """
+    Split a single member archive into its member and its central directory header.
+
+    :return:
+        A tuple containing the local header of the member followed by its
+        compressed data, and the central directory header of the member.
+    """
+    with zipfile.ZipFile(io.BytesIO(archive)) as source:
+        info = source.infolist()[0]
+
+    # The local header ends with the lengths of the file name and extra field that
+    # follow it, which may differ from those in the central directory.
+    start = info.header_offset
+    name_length, extra_length = struct.unpack(
+        "<HH", archive[start + _LOCAL_HEADER_SIZE - 4 : start + _LOCAL_HEADER_SIZE]
+    )
+    end = start + _LOCAL_HEADER_SIZE + name_length + extra_length
+    end += info.compress_size
+
+    # The central directory header directly follows the only member.
+    lengths = struct.unpack("<3H", archive[end + 28 : end + 34])
+    header = archive[end : end + _CENTRAL_HEADER_SIZE + sum(lengths)]
+    return archive[start:end], bytearray(header)
+
+
+def _assemble(
+    destination: typing.Union[pathlib.Path, typing.IO[bytes]],
+    source_directory: pathlib.Path,
+    futures: typing.Dict[pathlib.Path, "concurrent.futures.Future"],
+) -> typing.Dict[str, str]:
+    """
+    Assemble the members compressed on other processes into the zip bundle.
+
+    The local headers and compressed data of the members are copied as they are,
+    which means they are not compressed a second time. Their central directory
+    headers are copied with only the offsets of the local headers changed, after
+    which the end of central directory record completes the bundle.
+
+    :param futures:
+        Futures of the single member archives of the files keyed by their paths in
+        the order in which they are bundled.
+    :return:
+        The content digests of the bundled files keyed by their names.
+    """
+    files: typing.Dict[str, str] = {}
+    headers: typing.List[bytearray] = []
+    with contextlib.ExitStack() as stack:
+        output = (
+            stack.enter_context(destination.open("wb"))
+            if isinstance(destination, pathlib.Path)
+            else destination
+        )
+        for path, future in futures.items():
+            arcname = path.relative_to(source_directory).as_posix()
+            files[arcname], archive = future.result()
+            member, header = _split_member(archive)
+            header[_OFFSET_FIELD] = struct.pack("<L", output.tell())
+            output.write(member)
+            headers.append(header)
+
+        start = output.tell()
+        output.writelines(headers)
+        size = output.tell() - start
+        count = len(headers)
+        output.write(
+            _END_RECORD.pack(b"PK\x05\x06", 0, 0, count, count, size, start, 0)
+        )
+    return files
+
+
+def _get_paths(
+    source_directory: pathlib.Path,
+    root_rules: typing.Optional[typing.List["_ignore.Rule"]] = None,
+) -> typing.List[pathlib.Path]:
+    """
+    List the files within the module source directory to include in its bundle.
+
+    Files are excluded by the built-in exclusion rules, followed by the specified
+    rules of the root directory and finally those of the module directory itself.
+    """
+    rules = [
+        *_ignore.get_defaults(source_directory),
+        *(root_rules or []),
+        *_ignore.load(source_directory),
+    ]
+    return _ignore.walk(source_directory, rules)
+
+
+def _submit_compression(
+    source_directory: pathlib.Path,
+    paths: typing.List[pathlib.Path],
+    compression: int,
+    compression_level: typing.Optional[int],
+    executor: typing.Optional[concurrent.futures.Executor],
+    reproducible: bool = False,
+) -> typing.Dict[pathlib.Path, "concurrent.futures.Future"]:
+    """
+    Start compressing the files of large modules in parallel on the executor.
+
+    :return:
+        The futures of the files being compressed keyed by their paths, which is
+        empty if the files should be compressed one after the other instead.
+    """
+    # Bundles assembled from the compressed members never need the zip64 extensions
+    # because their sizes and member counts are kept below the limits of zip files.
+    if (
+        executor is None
+        or compression == zipfile.ZIP_STORED
+        or not 2 <= len(paths) < zipfile.ZIP_FILECOUNT_LIMIT
+    ):
+        return {}
+    size = sum(p.stat().st_size for p in paths)
+    if not _PARALLEL_THRESHOLD <= size < zipfile.ZIP64_LIMIT:
+        return {}
+
+    return {
+        p: executor.submit(
+            _compress_file,
+            p,
+            p.relative_to(source_directory).as_posix(),
+            compression,
+            compression_level,
+            reproducible,
+        )
+        for p in paths
+    }
+
 
 def _bundle(
     source_directory: pathlib.Path,
-    temp_bundle_directory: pathlib.Path,
-) -> pathlib.Path:
+    destination: typing.Union[pathlib.Path, typing.IO[bytes]],
+    paths: typing.Optional[typing.List[pathlib.Path]] = None,
+    compression: int = zipfile.ZIP_DEFLATED,
+    compression_level: typing.Optional[int] = None,
+    executor: typing.Optional[concurrent.futures.Executor] = None,
+    reproducible: bool = False,
+) -> "_definitions.Bundle":
     """
-    Create a bundle for the specified module in the temporary bundle directory.
+    Create a bundle for the specified module.
 
+    :param destination:
+        Either the temporary bundle directory in which to create the bundle file or
+        a writable buffer into which the bundle will be written instead.
+    :param paths:
+        Files within the source directory to include in the bundle if they have
+        already been listed. Otherwise, they will be listed here.
+    :param compression:
+        Zip compression method with which the files are compressed.
+    :param compression_level:
+        Compression level for the compression method or None for its default.
+    :param executor:
+        Process pool on which the files of large modules are compressed in
+        parallel before being assembled into the bundle in their listed order.
+    :param reproducible:
+        Whether to normalize the timestamps and permissions of the bundled files,
+        which makes bundles of identical files byte-identical. Files are always
+        bundled in sorted order and without directory entries.
     :return:
-        The path to the created zip bundle.
+        The created zip bundle along with its content manifest.
     """
-    path = temp_bundle_directory.joinpath(f"{source_directory.name}.zip")
+    buffer: typing.Optional[typing.IO[bytes]] = None
+    path: typing.Optional[pathlib.Path] = None
+    if isinstance(destination, pathlib.Path):
+        path = destination.joinpath(f"{source_directory.name}.zip")
+    else:
+        buffer = destination
 
-    paths = source_directory.rglob("**/*")
-    with zipfile.ZipFile(path, mode="w") as zipper:
-        for p in paths:
-            zipper.write(p, arcname=p.relative_to(source_directory))
+    files: typing.Dict[str, str] = {}
+    paths = _get_paths(source_directory) if paths is None else paths
+    futures = _submit_compression(
+        source_directory,
+        paths,
+        compression,
+        compression_level,
+        executor,
+        reproducible,
+    )
+    if futures:
+        files = _assemble(path or destination, source_directory, futures)
+    else:
+        with zipfile.ZipFile(
+            path or destination,
+            mode="w",
+            compression=compression,
+            compresslevel=compression_level,
+        ) as zipper:
+            for p in paths:
+                arcname = p.relative_to(source_directory).as_posix()
+                files[arcname] = _write_file(zipper, p, arcname, reproducible)
+
+    return _definitions.Bundle(
+        name=source_directory.name,
+        path=path,
+        digest=_utils.get_bundle_digest(files),
+        files=files,
+        buffer=buffer,
+    )
 
-    return path
+
+def _create_spool(context: "_definitions.Context") -> typing.IO[bytes]:
+    """
+    Create a buffer for keeping a bundle in memory.
+
+    The buffer only spills over into a temporary file on disk once it grows beyond
+    the configured spool size.
+    """
+    return typing.cast(
+        typing.IO[bytes],
+        tempfile.SpooledTemporaryFile(max_size=context.args.spool_max_size),
+    )
 
 
 def _compare(
     context: "_definitions.Context",
-    bundle_path: pathlib.Path,
+    bundle: "_definitions.Bundle",
     remote_version: "_definitions.ModuleVersion",
 ) -> bool:
     """
     Compare the bundled module with the specified remote version.
 
+    The content manifest stored in the remote version's metadata is used when
+    available. Versions published without a manifest are compared from the zip
+    central directory of the remote bundle, which is read with ranged requests
+    instead of downloading the entire bundle.
+
     :return:
         True if they appear to be identical.
     """
-    download_path = bundle_path.parent.joinpath(f"{bundle_path.name}.compare")
-    _s3.get_bundle(context, remote_version.key, download_path)
-    result = _utils.compare_zip_files(bundle_path, download_path)
-    return result.identical
+    manifest = _storage.get_manifest(context, remote_version.key)
+    if manifest is not None:
+        result = _utils.compare_manifests(
+            bundle.digest,
+            bundle.files,
+            manifest["digest"],
+            manifest["files"],
+        )
+        return result.identical
+
+    with contextlib.closing(_storage.open_bundle(context, remote_version)) as remote:
+        return _utils.compare_zip_files(bundle.source, remote).identical
 
 
 def _get_source_directories(
     root_directory: pathlib.Path,
     module_filters: typing.List[str],
+    rules: typing.Optional[typing.List["_ignore.Rule"]] = None,
 ) -> typing.List[pathlib.Path]:
     """
     List source directories to include in the run operation.
 
     These will be children of the root directory that match the list of module
     filters. If not filters are specified, all children directories will be included
-    in the output.
+    in the output. Directories excluded by the rules are never included.
     """
     return [
         p
         for p in root_directory.iterdir()
-        if p.is_dir() and (not module_filters or p.name in module_filters)
+        if p.is_dir()
+        and (not module_filters or p.name in module_filters)
+        and not _ignore.is_ignored(rules or [], str(p), True)
     ]
 
 
+def _get_bundle(
+    context: "_definitions.Context",
+    directory: pathlib.Path,
+    workspace: "Workspace",
+) -> typing.Tuple["_definitions.Bundle", str, typing.Optional["_cache.CacheEntry"]]:
+    """
+    Get the bundle for the module directory from the cache or by bundling it.
+
+    :return:
+        A tuple containing the bundle, the stat fingerprint of the module directory
+        and the cache entry if the bundle was loaded from the cache.
+    """
+    compression = COMPRESSION_TYPES[context.args.compression]
+    compression_level = context.args.compression_level
+    paths = _get_paths(directory, workspace.ignore_rules)
+    fingerprint = _cache.get_fingerprint(
+        directory,
+        paths,
+        options=[
+            context.args.compression,
+            str(compression_level),
+            str(context.args.reproducible),
+        ],
+    )
+    cached = _cache.load(context, directory, fingerprint)
+    if cached is not None:
+        print(f"   + Unchanged since cached bundle {cached.bundle.path}")
+        return cached.bundle, fingerprint, cached
+
+    destination = (
+        _create_spool(context) if context.args.in_memory else workspace.temp_directory
+    )
+    bundle = _bundle(
+        directory,
+        destination,
+        paths,
+        compression=compression,
+        compression_level=compression_level,
+        executor=workspace.executor,
+        reproducible=context.args.reproducible,
+    )
+    if bundle.path is None:
+        print(f"   + Bundled in memory ({bundle.size:,.0f} bytes)")
+    else:
+        print(f"   + Bundled to local path {bundle.path}")
+    return bundle, fingerprint, None
+
+
+def _is_unchanged(
+    context: "_definitions.Context",
+    bundle: "_definitions.Bundle",
+    cached: typing.Optional["_cache.CacheEntry"],
+    latest: "_definitions.ModuleVersion",
+) -> bool:
+    """Determine whether the bundle is identical to the latest remote version."""
+    if context.args.force:
+        return False
+
+    # A cache entry that matches the latest remote version means that neither the
+    # module nor the remote have changed since they were last found to be identical.
+    if cached is not None and cached.matches(latest):
+        return True
+
+    # Reproducible bundles are byte-identical to the remote bundle when their
+    # contents are, which makes their entity tags equal without fetching anything.
+    etag = latest.etag
+    if context.args.reproducible and etag == _utils.get_etag(bundle.source):
+        return True
+
+    return _compare(context, bundle, latest)
+
+
+def _get_versions(
+    context: "_definitions.Context",
+    module_name: str,
+    workspace: "Workspace",
+) -> typing.List["_definitions.ModuleVersion"]:
+    """Get the remote versions of the module from the catalog or by listing them."""
+    if workspace.catalog is not None:
+        return workspace.catalog.get(module_name, [])
+    return _storage.get_versions(context, module_name)
+
+
+def _put_version(
+    context: "_definitions.Context",
+    bundle: "_definitions.Bundle",
+    version: int,
+) -> typing.Tuple[bool, typing.Optional["_definitions.ModuleVersion"]]:
+    """
+    Publish the bundle as the version unless another publisher created it first.
+
+    :return:
+        A tuple containing whether the version was allocated and the published
+        version, which is None for dry runs.
+    """
+    print(f"   + Publishing version {version}")
+    try:
+        with context.report.phase("upload", bundle.name) as handled:
+            published = _storage.put_bundle(context, bundle, version)
+            handled["bytes"] = bundle.size if published else 0
+    except _definitions.VersionConflictError:
+        print(f"   ! Version {version} was published concurrently by another run")
+        return False, None
+    return True, published
+
+
+def _allocate_version(
+    context: "_definitions.Context",
+    directory: pathlib.Path,
+    bundle: "_definitions.Bundle",
+    cached: typing.Optional["_cache.CacheEntry"],
+    versions: typing.List["_definitions.ModuleVersion"],
+) -> typing.Tuple[bool, typing.Optional["_definitions.ModuleVersion"]]:
+    """
+    Publish the bundle as the next version unless it matches the latest version.
+
+    New versions are only created if they don't exist yet. When another publisher
+    creates the version first, the versions are listed again and the bundle is
+    compared with, and then published after, the version of the other publisher.
+
+    :return:
+        A tuple containing whether the bundle was published and the published
+        version, which is None for dry runs or when the bundle was unchanged.
+    """
+    module_name = directory.name
+    attempted = 0
+    for _ in range(_ALLOCATION_ATTEMPTS):
+        latest = versions[-1] if versions else None
+        with context.report.phase("compare", module_name):
+            unchanged = latest is not None and _is_unchanged(
+                context, bundle, cached, latest
+            )
+        if unchanged:
+            print(f'   + No changes found. Aborted publishing "{module_name}".')
+            return False, latest
+
+        # Versions that were allocated but never listed, e.g. because their
+        # publisher failed, are skipped rather than attempted again.
+        attempted = 1 + max(attempted, latest.version if latest else 0)
+        allocated, published = _put_version(context, bundle, attempted)
+        if allocated:
+            return True, published
+        versions = _storage.get_versions(context, module_name)
+
+    raise RuntimeError(
+        f"No version could be allocated after {_ALLOCATION_ATTEMPTS} attempts."
+    )
+
+
 def _publish_directory(
     context: "_definitions.Context",
     directory: pathlib.Path,
-    temp_directory: pathlib.Path,
+    workspace: "Workspace",
 ) -> bool:
     """Publish the specified directory as a terraform module."""
     module_name: str = directory.name
     print(f"\nBUNDLING: {module_name}")
+    report = context.report
 
-    bundle_path = _bundle(directory, temp_directory)
-    print(f"   + Bundled to local path {bundle_path}")
+    with report.phase("bundle", module_name) as handled:
+        bundle, fingerprint, cached = _get_bundle(context, directory, workspace)
+        handled["bytes"] = bundle.size
+    with contextlib.closing(bundle):
+        with report.phase("list", module_name):
+            versions = _get_versions(context, module_name, workspace)
+        changed, version = _allocate_version(
+            context, directory, bundle, cached, versions
+        )
+        remote_key = version.key if version else None
+        remote_etag = None if changed or version is None else version.etag
+        entry = _cache.CacheEntry(fingerprint, bundle, remote_key, remote_etag)
+        _cache.store(context, directory, entry)
 
-    versions = _s3.get_versions(context, module_name)
+    if changed and version is not None:
+        print(f"   + Module {module_name} has been published as {version.key}")
+        print(f"   + Source URL: {version.module_url}")
+        with report.phase("index", module_name):
+            updated = _index.update(context, version, bundle.digest)
+        if updated:
+            print("   + Added the published version to the catalog index")
+        _cache.invalidate_listings(context, module_name)
+        if workspace.catalog is not None:
+            workspace.catalog[module_name] = [*versions, version]
 
-    should_publish = (
-        context.args.force
-        or not versions
-        or not _compare(context, bundle_path, versions[-1])
-    )
-    if not should_publish:
-        print(f'   + No changes found. Aborted publishing "{module_name}".')
-        return False
+    return changed
 
-    next_version = 1 if not versions else (1 + versions[-1].version)
-    print(f"   + Publishing version {next_version}")
 
-    result = _s3.put_bundle(context, bundle_path, module_name, next_version)
-    print(f"   + Module {module_name} has been published as {result['key']}")
+def _publish_safely(
+    context: "_definitions.Context",
+    directory: pathlib.Path,
+    workspace: "Workspace",
+) -> typing.Tuple[bool, typing.Optional[str]]:
+    """
+    Publish the specified directory capturing any error that occurs.
 
-    if result["published"]:
-        version = _s3.get_version(context, module_name, next_version)
-        print(f"   + Source URL: {version.module_url}")
+    :return:
+        A tuple containing whether the module was published and the error message
+        if publishing failed.
+    """
+    try:
+        return _publish_directory(context, directory, workspace), None
+    except Exception as error:
+        message = f"{type(error).__name__}: {error}"
+        print(f'   ! Failed to publish "{directory.name}". {message}')
+        return False, message
 
-    return True
 
+def _publish_buffered(
+    context: "_definitions.Context",
+    directory: pathlib.Path,
+    workspace: "Workspace",
+) -> typing.Tuple[bool, typing.Optional[str], str]:
+    """
+    Publish the specified directory while buffering its printed output.
 
-def run(context: "_definitions.Context") -> "_definitions.CommandResult":
-    """Execute a publish action for the given command context."""
+    :return:
+        The result of publishing along with the buffered output.
+    """
+    with _utils.buffered_output() as buffer:
+        published, error = _publish_safely(context, directory, workspace)
+    return published, error, buffer.getvalue()
+
+
+def _publish_concurrently(
+    context: "_definitions.Context",
+    source_directories: typing.List[pathlib.Path],
+    workspace: "Workspace",
+) -> typing.List[typing.Tuple[bool, typing.Optional[str]]]:
+    """
+    Publish the directories on a pool of threads.
+
+    The output of each module is buffered and printed in the order of the source
+    directories once it has finished so that the output of modules is never
+    interleaved.
+    """
+    results = []
+    with _utils.routed_output(), concurrent.futures.ThreadPoolExecutor(
+        max_workers=context.args.jobs
+    ) as executor:
+        futures = [
+            executor.submit(_publish_buffered, context, d, workspace)
+            for d in source_directories
+        ]
+        for future in futures:
+            published, error, output = future.result()
+            print(output, end="")
+            results.append((published, error))
+    return results
+
+
+def _publish_all(
+    context: "_definitions.Context",
+    source_directories: typing.List[pathlib.Path],
+    workspace: "Workspace",
+) -> typing.List[typing.Tuple[bool, typing.Optional[str]]]:
+    """Publish the directories either concurrently or one after the other."""
+    if context.args.jobs > 1:
+        return _publish_concurrently(context, source_directories, workspace)
+    return [
+        _publish_safely(context, directory, workspace)
+        for directory in source_directories
+    ]
+
+
+def _get_waves(
+    source_directories: typing.List[pathlib.Path],
+    dependencies: typing.Dict[str, typing.Set[str]],
+) -> typing.List[typing.List[pathlib.Path]]:
+    """
+    Order the source directories into waves after the modules they reference.
+
+    A DependencyCycleError is raised if modules reference each other in a cycle.
+    """
+    directories = {d.name: d for d in source_directories}
+    waves = _dependencies.get_waves(dependencies)
+    return [[directories[name] for name in wave] for wave in waves]
+
+
+def _echo_waves(waves: typing.List[typing.List[pathlib.Path]]) -> None:
+    """Print the modules that are published in each wave."""
+    print(f"\nPUBLISHING IN {len(waves)} WAVE(S):")
+    for number, wave in enumerate(waves, 1):
+        print(f"   {number}: {', '.join(d.name for d in wave)}")
+
+
+def publish_waves(
+    context: "_definitions.Context",
+    waves: typing.List[typing.List[pathlib.Path]],
+    dependencies: typing.Dict[str, typing.Set[str]],
+    workspace: "Workspace",
+) -> typing.Dict[str, typing.Tuple[bool, typing.Optional[str]]]:
+    """
+    Publish the directories one wave after the other.
+
+    The modules of a wave are published like all modules would be otherwise, i.e.
+    concurrently if multiple jobs are allowed. Modules that reference a module that
+    failed to publish, directly or through other modules, are skipped and reported
+    as failed themselves.
+
+    :return:
+        A tuple containing whether each module was published and the error message
+        if publishing failed, keyed by the module names.
+    """
+    outcomes: typing.Dict[str, typing.Tuple[bool, typing.Optional[str]]] = {}
+    for wave in waves:
+        ready = []
+        for directory in wave:
+            failed = sorted(
+                name
+                for name in dependencies[directory.name]
+                if name in outcomes and outcomes[name][1]
+            )
+            if not failed:
+                ready.append(directory)
+                continue
+            message = "Referenced modules failed to publish: {}.".format(
+                ", ".join(failed)
+            )
+            print(f"\nSKIPPED: {directory.name}\n   ! {message}")
+            outcomes[directory.name] = (False, message)
+        published = _publish_all(context, ready, workspace)
+        outcomes.update((d.name, outcome) for d, outcome in zip(ready, published))
+    return outcomes
+
+
+def get_sources(
+    context: "_definitions.Context",
+) -> typing.Tuple[typing.List[pathlib.Path], typing.List["_ignore.Rule"]]:
+    """
+    List the module directories to publish from the directory of the command.
+
+    :return:
+        A tuple containing the module directories and the exclusion rules of the
+        root directory that apply to every module.
+    """
     root_directory = pathlib.Path(context.args.directory).expanduser().absolute()
+    root_rules = _ignore.load(root_directory)
     source_directories = _get_source_directories(
         root_directory=root_directory,
         module_filters=context.args.module_targets,
+        rules=[*_ignore.get_defaults(root_directory), *root_rules],
     )
-    temp_directory = pathlib.Path(tempfile.mkdtemp())
+    return source_directories, root_rules
+
+
+def get_fingerprint(
+    directory: pathlib.Path,
+    root_rules: typing.List["_ignore.Rule"],
+) -> str:
+    """Compute a fingerprint of the module that changes when its files change."""
+    return _cache.get_fingerprint(directory, _get_paths(directory, root_rules))
+
 
+def plan(
+    context: "_definitions.Context",
+    source_directories: typing.List[pathlib.Path],
+    root_rules: typing.List["_ignore.Rule"],
+) -> typing.Tuple[
+    typing.List[typing.List[pathlib.Path]], typing.Dict[str, typing.Set[str]]
+]:
+    """
+    Order the directories into waves after the modules they reference as sources.
+
+    The plan is printed for dry runs. A DependencyCycleError is raised if modules
+    reference each other in a cycle.
+
+    :return:
+        A tuple containing the directories of each wave and the names of the
+        modules referenced by each module.
+    """
+    with context.report.phase("plan"):
+        dependencies = {
+            d.name: _dependencies.get_dependencies(d, _get_paths(d, root_rules))
+            for d in source_directories
+        }
+        waves = _get_waves(source_directories, dependencies)
+    if context.args.dry_run:
+        _echo_waves(waves)
+    return waves, dependencies
+
+
+@contextlib.contextmanager
+def open_workspace(
+    catalog: typing.Optional[
+        typing.Dict[str, typing.List["_definitions.ModuleVersion"]]
+    ],
+    root_rules: typing.List["_ignore.Rule"],
+) -> typing.Iterator["Workspace"]:
+    """Create the state shared by the modules published within the context."""
+    # Worker processes are only started once the files of a large module are
+    # submitted for compression.
+    with _LazyProcessPool() as executor:
+        workspace = Workspace(
+            temp_directory=pathlib.Path(tempfile.mkdtemp()),
+            catalog=catalog,
+            executor=executor,
+            ignore_rules=root_rules,
+        )
+        try:
+            yield workspace
+        finally:
+            shutil.rmtree(workspace.temp_directory)
+
+
+def _select_changed(
+    context: "_definitions.Context",
+    source_directories: typing.List[pathlib.Path],
+) -> typing.List[pathlib.Path]:
+    """
+    Narrow the directories down to the modules that changed since the git ref.
+
+    Modules that have never been published are selected as well, which are found
+    with a listing of the module names rather than of all versions.
+    """
+    ref = context.args.changed_since
+    root_directory = pathlib.Path(context.args.directory).expanduser().absolute()
+    with context.report.phase("changes"):
+        changed = _git.get_changed_modules(root_directory, ref)
+        unchanged = [d for d in source_directories if d.name not in changed]
+        published = set(_storage.get_modules(context)) if unchanged else set()
+    selected = [
+        d for d in source_directories if d.name in changed or d.name not in published
+    ]
+    names = ", ".join(sorted(d.name for d in selected)) or "None"
+    print(f"\nCHANGED SINCE {ref}: {names}")
+    return selected
+
+
+def _create_result(
+    source_directories: typing.List[pathlib.Path],
+    outcomes: typing.Dict[str, typing.Tuple[bool, typing.Optional[str]]],
+) -> "_definitions.CommandResult":
+    """
+    Create the result of publishing the directories.
+
+    Modules without an outcome weren't candidates for publishing and are reported
+    as not published.
+    """
     results = {
-        directory.name: _publish_directory(context, directory, temp_directory)
-        for directory in source_directories
+        d.name: outcomes.get(d.name, (False, None))[0] for d in source_directories
     }
-
-    shutil.rmtree(temp_directory)
+    errors = {name: e for name, (_, e) in outcomes.items() if e}
+    if errors:
+        return _definitions.CommandResult(
+            code="PUBLISH_FAILED",
+            message="Failed to publish modules: {}.".format(", ".join(errors)),
+            data=results,
+            errors=errors,
+        )
 
     return _definitions.CommandResult(
         code="PUBLISHED",
         message="Modified module targets have been published.",
         data=results,
     )
+
+
+def run(context: "_definitions.Context") -> "_definitions.CommandResult":
+    """Execute a publish action for the given command context."""
+    source_directories, root_rules = get_sources(context)
+    candidates = source_directories
+    if context.args.changed_since:
+        try:
+            candidates = _select_changed(context, source_directories)
+        except (subprocess.CalledProcessError, OSError) as error:
+            # Failed git commands are described by their output rather than status.
+            message = (getattr(error, "stderr", None) or str(error)).strip()
+            return _definitions.CommandResult(
+                code="CHANGES_UNKNOWN",
+                message=f"Failed to determine the changed modules: {message}",
+                errors={d.name: message for d in source_directories},
+            )
+
+    # Modules are published after the modules they reference as local sources,
+    # which is planned before any module is bundled to fail fast on cycles.
+    try:
+        waves, dependencies = plan(context, candidates, root_rules)
+    except _definitions.DependencyCycleError as error:
+        return _definitions.CommandResult(
+            code="DEPENDENCY_CYCLE",
+            message=f"Modules reference each other in a cycle: {error}.",
+            errors={name: str(error) for name in error.modules},
+        )
+
+    with context.report.phase("catalog"):
+        # The versions of all modules are fetched in a single listing when more
+        # than one module is involved instead of listing each module separately.
+        catalog = _storage.get_catalog(context) if len(candidates) > 1 else None
+    with open_workspace(catalog, root_rules) as workspace:
+        outcomes = publish_waves(context, waves, dependencies, workspace)
+
+    return _create_result(source_directories, outcomes)
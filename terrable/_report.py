@@ -0,0 +1,152 @@
+import collections
+import contextlib
+import threading
+import time
+import typing
+
+#: Key in the botocore request context under which the start time of a call is kept.
+_STARTED_KEY = "terrable_started"
+
+
+class Report:
+    """
+    Thread-safe recorder of the time spent in each phase of a command.
+
+    Phases are recorded with their wall time and the number of bytes they handled,
+    either for a single module or for the command as a whole. The number and latency
+    of S3 calls are recorded by operation through botocore event hooks.
+    """
+
+    def __init__(self):
+        """Create an empty report that starts timing the command immediately."""
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._phases: typing.Dict[
+            typing.Optional[str], typing.Dict[str, typing.Dict[str, float]]
+        ] = collections.defaultdict(dict)
+        self._calls: typing.Dict[str, typing.Dict[str, float]] = {}
+
+    def add_phase(
+        self,
+        name: str,
+        seconds: float,
+        size: int = 0,
+        module_name: typing.Optional[str] = None,
+    ) -> None:
+        """
+        Add the time and bytes of the phase to those already recorded for it.
+
+        :param module_name:
+            Name of the module the phase belongs to or None if it belongs to the
+            command as a whole.
+        """
+        with self._lock:
+            phase = self._phases[module_name].setdefault(
+                name, {"seconds": 0.0, "bytes": 0, "count": 0}
+            )
+            phase["seconds"] += seconds
+            phase["bytes"] += size
+            phase["count"] += 1
+
+    @contextlib.contextmanager
+    def phase(
+        self,
+        name: str,
+        module_name: typing.Optional[str] = None,
+    ) -> typing.Iterator[typing.Dict[str, int]]:
+        """
+        Time the phase for the duration of the context.
+
+        :return:
+            A dictionary in which the number of "bytes" handled by the phase can be
+            set within the context.
+        """
+        handled = {"bytes": 0}
+        started = time.perf_counter()
+        try:
+            yield handled
+        finally:
+            elapsed = time.perf_counter() - started
+            self.add_phase(name, elapsed, handled["bytes"], module_name)
+
+    def add_call(self, operation: str, seconds: float, size: int = 0) -> None:
+        """Add an S3 call of the operation with its latency and downloaded bytes."""
+        with self._lock:
+            call = self._calls.setdefault(
+                operation, {"count": 0, "seconds": 0.0, "bytes": 0}
+            )
+            call["count"] += 1
+            call["seconds"] += seconds
+            call["bytes"] += size
+
+    def _before_call(self, context: dict, **kwargs) -> None:
+        """Record the start of an S3 call in its request context."""
+        context[_STARTED_KEY] = time.perf_counter()
+
+    def _after_call(
+        self,
+        context: dict,
+        model: typing.Any,
+        parsed: typing.Optional[dict] = None,
+        **kwargs,
+    ) -> None:
+        """Record the latency and size of a completed S3 call."""
+        started = context.pop(_STARTED_KEY, None)
+        if started is not None:
+            size = (parsed or {}).get("ContentLength") or 0
+            self.add_call(model.name, time.perf_counter() - started, size)
+
+    def attach(self, client: typing.Any) -> None:
+        """Register the event hooks that record the S3 calls made by the client."""
+        # Parameters are built before any other handler can short-circuit the call,
+        # which means that every call that completes has a recorded start.
+        client.meta.events.register("before-parameter-build.s3", self._before_call)
+        client.meta.events.register("after-call.s3", self._after_call)
+
+    def to_dict(self) -> dict:
+        """
+        Get the recorded timings in a JSON serializable form.
+
+        Module totals are the sums of their phases, which are timed separately on
+        each thread when modules are processed concurrently.
+        """
+        with self._lock:
+            modules = {
+                name: {
+                    "seconds": sum(p["seconds"] for p in phases.values()),
+                    "bytes": sum(p["bytes"] for p in phases.values()),
+                    "phases": {k: dict(v) for k, v in sorted(phases.items())},
+                }
+                for name, phases in sorted(
+                    (k, v) for k, v in self._phases.items() if k is not None
+                )
+            }
+            return {
+                "seconds": time.perf_counter() - self._started,
+                "phases": {
+                    k: dict(v) for k, v in sorted(self._phases.get(None, {}).items())
+                },
+                "modules": modules,
+                "s3": {k: dict(v) for k, v in sorted(self._calls.items())},
+            }
+
+
+def echo(data: dict) -> str:
+    """Return a human-friendly table of the timings in the report data."""
+    lines = [f"Timings ({data['seconds']:.3f}s total):"]
+    groups = [("command", data["phases"])] + [
+        (name, module["phases"]) for name, module in data["modules"].items()
+    ]
+    for group, phases in groups:
+        for name, phase in phases.items():
+            lines.append(
+                f"  {group:<24} {name:<24} {phase['seconds']:>9.3f}s"
+                f" {phase['bytes']:>14,.0f} bytes"
+            )
+    for operation, call in data["s3"].items():
+        average = 1000 * call["seconds"] / call["count"]
+        lines.append(
+            f"  {'s3':<24} {operation:<24} {call['count']:>6} calls"
+            f" {average:>9.1f}ms avg"
+        )
+    return "\n".join(lines)
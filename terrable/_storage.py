@@ -0,0 +1,147 @@
+import pathlib
+import types
+import typing
+
+from terrable import _definitions
+from terrable import _filesystem
+
+
+def _get_backend(context: "_definitions.Context") -> types.ModuleType:
+    """
+    Get the storage backend module for the bucket of the context.
+
+    Every backend module provides the functions of this module with the same
+    signatures and stores modules with the same key layout. The S3 backend is only
+    imported when it's used because importing botocore takes a significant part of
+    the startup time of every command.
+    """
+    if _definitions.is_filesystem(context.args.bucket):
+        return _filesystem
+
+    from terrable import _s3
+
+    return _s3
+
+
+def iter_modules(context: "_definitions.Context") -> typing.Iterator[str]:
+    """Fetch the modules available within the prefix as they are listed."""
+    return _get_backend(context).iter_modules(context)
+
+
+def get_modules(context: "_definitions.Context") -> typing.List[str]:
+    """Fetch the modules available within the prefix."""
+    return _get_backend(context).get_modules(context)
+
+
+def iter_versions(
+    context: "_definitions.Context",
+    module_name: str,
+) -> typing.Iterator["_definitions.ModuleVersion"]:
+    """Fetch the deployed versions of a given module unsorted as they are listed."""
+    return _get_backend(context).iter_versions(context, module_name)
+
+
+def get_versions(
+    context: "_definitions.Context",
+    module_name: str,
+) -> typing.List["_definitions.ModuleVersion"]:
+    """Fetch version information for all deployed versions of a given module."""
+    return _get_backend(context).get_versions(context, module_name)
+
+
+def iter_catalog(
+    context: "_definitions.Context",
+) -> typing.Iterator["_definitions.ModuleVersion"]:
+    """
+    Fetch the deployed versions of all modules unsorted as they are listed.
+
+    The versions of each module are fetched together with no other versions in
+    between them.
+    """
+    return _get_backend(context).iter_catalog(context)
+
+
+def get_catalog(
+    context: "_definitions.Context",
+) -> typing.Dict[str, typing.List["_definitions.ModuleVersion"]]:
+    """Fetch version information for all deployed versions of all modules."""
+    return _get_backend(context).get_catalog(context)
+
+
+def get_manifest(
+    context: "_definitions.Context",
+    key: str,
+) -> typing.Optional[dict]:
+    """Fetch the content manifest stored with a published bundle."""
+    return _get_backend(context).get_manifest(context, key)
+
+
+def put_bundle(
+    context: "_definitions.Context",
+    bundle: "_definitions.Bundle",
+    version: int,
+) -> typing.Optional["_definitions.ModuleVersion"]:
+    """Publish the version of the module to the storage backend."""
+    return _get_backend(context).put_bundle(context, bundle, version)
+
+
+def delete_bundles(
+    context: "_definitions.Context",
+    keys: typing.List[str],
+) -> typing.Dict[str, str]:
+    """
+    Delete the published bundles along with their metadata.
+
+    :return:
+        Error messages of the bundles that could not be deleted keyed by their keys.
+    """
+    return _get_backend(context).delete_bundles(context, keys)
+
+
+def get_bundle(
+    context: "_definitions.Context",
+    key: str,
+    destination: typing.Union[pathlib.Path, typing.IO[bytes]],
+):
+    """Fetch the bundle to the specified location or writable buffer."""
+    return _get_backend(context).get_bundle(context, key, destination)
+
+
+def open_bundle(
+    context: "_definitions.Context",
+    version: "_definitions.ModuleVersion",
+) -> typing.IO[bytes]:
+    """Open the published bundle for reading without fetching all of it."""
+    return _get_backend(context).open_bundle(context, version)
+
+
+def get_index(
+    context: "_definitions.Context",
+    etag: typing.Optional[str] = None,
+) -> typing.Tuple[typing.Optional[bytes], typing.Optional[str]]:
+    """Fetch the contents of the catalog index along with its entity tag."""
+    return _get_backend(context).get_index(context, etag)
+
+
+def put_index(
+    context: "_definitions.Context",
+    body: bytes,
+    etag: typing.Optional[str],
+) -> bool:
+    """Write the catalog index if it hasn't changed since it was fetched."""
+    return _get_backend(context).put_index(context, body, etag)
+
+
+def is_index_stale(context: "_definitions.Context") -> bool:
+    """Determine whether the catalog index was marked as stale."""
+    return _get_backend(context).is_index_stale(context)
+
+
+def mark_index_stale(context: "_definitions.Context") -> None:
+    """Mark the catalog index as stale after versions changed without updating it."""
+    _get_backend(context).mark_index_stale(context)
+
+
+def unmark_index_stale(context: "_definitions.Context") -> None:
+    """Remove the stale marker of the catalog index if there is one."""
+    _get_backend(context).unmark_index_stale(context)
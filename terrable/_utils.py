@@ -1,9 +1,21 @@
 import contextlib
 import dataclasses
+import hashlib
+import io
+import json
 import pathlib
+import sys
+import threading
 import typing
 import zipfile
 
+#: Number of hex characters retained for each per-file digest in a manifest. These
+#: are truncated to keep the manifest small enough to fit within S3 object metadata.
+FILE_DIGEST_LENGTH = 16
+
+#: Size of the chunks in which zip file members are read when comparing their bytes.
+_COMPARE_CHUNK_SIZE = 64 * 1024
+
 
 @dataclasses.dataclass(frozen=True)
 class ZipComparison:
@@ -11,33 +23,152 @@ class ZipComparison:
 
     identical: bool
     code: str
+    #: Name of the first mismatched file, which is described by the code.
     mismatch: typing.Optional[str] = None
+    #: Codes describing each mismatched file keyed by the file names.
+    mismatches: typing.Dict[str, str] = dataclasses.field(default_factory=lambda: {})
+
+    @classmethod
+    def from_mismatches(cls, mismatches: typing.Dict[str, str]) -> "ZipComparison":
+        """Create a comparison result from the mismatches found, if any."""
+        if not mismatches:
+            return cls(True, "all_comparisons_matched")
+        mismatch, code = next(iter(mismatches.items()))
+        return cls(False, code, mismatch, mismatches)
+
+
+#: Thread-local storage for output buffers of threads whose output is being buffered.
+_output_buffers = threading.local()
+
+
+class _OutputRouter:
+    """Standard output replacement that routes writes into thread output buffers."""
+
+    def __init__(self, stream: typing.TextIO):
+        """Wrap the stream where output is written when a thread isn't buffered."""
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        """Write to the current thread's buffer if it has one or the stream if not."""
+        buffer = getattr(_output_buffers, "buffer", None)
+        return (buffer or self.stream).write(text)
+
+    def __getattr__(self, item: str) -> typing.Any:
+        """Defer everything else to the wrapped stream."""
+        return getattr(self.stream, item)
+
 
+@contextlib.contextmanager
+def routed_output() -> typing.Iterator[None]:
+    """
+    Route standard output into thread output buffers while this context is active.
+
+    Threads that aren't buffering their output with `buffered_output` continue to
+    write to standard output as usual.
+    """
+    original = sys.stdout
+    sys.stdout = typing.cast(typing.TextIO, _OutputRouter(original))
+    try:
+        yield
+    finally:
+        sys.stdout = original
+
+
+@contextlib.contextmanager
+def buffered_output() -> typing.Iterator[io.StringIO]:
+    """
+    Buffer the standard output of the current thread while this context is active.
+
+    This requires output to be routed with `routed_output` to take effect.
+    """
+    buffer = io.StringIO()
+    _output_buffers.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        _output_buffers.buffer = None
 
-def _compare_zip_files(
+
+def get_output() -> typing.TextIO:
+    """
+    Get the stream to which the current thread prints its output.
+
+    This is the output buffer of the thread if it's buffering its output and
+    standard output otherwise. Threads that print on behalf of the current thread,
+    e.g. progress callbacks of transfers, write to this stream to keep the output
+    of the current thread together.
+    """
+    return getattr(_output_buffers, "buffer", None) or sys.stdout
+
+
+def _compare_member_bytes(
     filename: str,
     a_zip: zipfile.ZipFile,
     b_zip: zipfile.ZipFile,
-) -> "ZipComparison":
-    """Compare the two specified files to see if they differ."""
-    try:
-        a = a_zip.read(filename)
-        b = b_zip.read(filename)
-    except KeyError:
-        # Raised when the filename doesn't appear in one of the comparisons.
-        return ZipComparison(False, "mismatched_missing_file", filename)
+) -> bool:
+    """
+    Compare the contents of the file within the two zip files.
+
+    The contents are streamed from both zip files in fixed-size chunks to avoid
+    reading entire files into memory.
 
-    if a == b:
-        return ZipComparison(True, "matched_files", filename)
-    return ZipComparison(False, "mismatched_file_diff", filename)
+    :return:
+        True if the contents are identical.
+    """
+    with a_zip.open(filename) as a, b_zip.open(filename) as b:
+        while True:
+            a_chunk = a.read(_COMPARE_CHUNK_SIZE)
+            if a_chunk != b.read(_COMPARE_CHUNK_SIZE):
+                return False
+            if not a_chunk:
+                return True
+
+
+def _compare_member(
+    a_info: zipfile.ZipInfo,
+    b_info: zipfile.ZipInfo,
+    a_zip: zipfile.ZipFile,
+    b_zip: zipfile.ZipFile,
+    deep: bool,
+) -> bool:
+    """
+    Compare the two specified files to see if they are identical.
 
+    The CRC and size recorded in the central directories of the zip files are
+    compared first, which is enough to find files that differ. Otherwise, the
+    contents are only compared when a deep comparison is requested.
+    """
+    if a_info.CRC != b_info.CRC or a_info.file_size != b_info.file_size:
+        return False
+    return not deep or _compare_member_bytes(a_info.filename, a_zip, b_zip)
 
-def compare_zip_files(a: pathlib.Path, b: pathlib.Path) -> "ZipComparison":
+
+def _get_file_infos(zipper: zipfile.ZipFile) -> typing.Dict[str, zipfile.ZipInfo]:
+    """
+    Get the infos of the files within the zip file keyed by their names.
+
+    Directory entries are excluded as they are implied by the files they contain.
+    """
+    return {info.filename: info for info in zipper.infolist() if not info.is_dir()}
+
+
+def compare_zip_files(
+    a: typing.Union[pathlib.Path, typing.IO[bytes]],
+    b: typing.Union[pathlib.Path, typing.IO[bytes]],
+    deep: bool = False,
+) -> "ZipComparison":
     """
     Compare two zip files to see if the contents are identical.
 
+    The comparison is made from the names, CRCs and sizes of the files stored in
+    the central directories of the zip files, which doesn't require reading any of
+    their contents. Differences in compression do not affect the comparison.
+
+    :param deep:
+        Whether to also compare the contents of files whose CRCs and sizes match,
+        guarding against CRC collisions at the expense of reading both files.
     :return:
-        True if they appear to be identical.
+        The comparison result, which lists every mismatched file.
     """
     with contextlib.ExitStack() as stack:
         a_zip = typing.cast(
@@ -60,12 +191,103 @@ def compare_zip_files(a: pathlib.Path, b: pathlib.Path) -> "ZipComparison":
             ),
         )
 
-        mismatched_file_finder = (
-            result
-            for item in a_zip.filelist
-            if not (result := _compare_zip_files(item.filename, a_zip, b_zip)).identical
-        )
-        if mismatched := next(mismatched_file_finder, None):
-            return mismatched
+        a_infos = _get_file_infos(a_zip)
+        b_infos = _get_file_infos(b_zip)
+        mismatches = {}
+        for name in [*a_infos, *(n for n in b_infos if n not in a_infos)]:
+            if name not in a_infos or name not in b_infos:
+                mismatches[name] = "mismatched_missing_file"
+            elif not _compare_member(a_infos[name], b_infos[name], a_zip, b_zip, deep):
+                mismatches[name] = "mismatched_file_diff"
+
+    return ZipComparison.from_mismatches(mismatches)
+
+
+def create_file_hasher() -> "hashlib._Hash":
+    """Create the hasher used to compute the digest of a bundled file's contents."""
+    return hashlib.sha256()
+
+
+def get_file_digest(hasher: "hashlib._Hash") -> str:
+    """Get the truncated per-file digest stored in bundle manifests."""
+    return hasher.hexdigest()[:FILE_DIGEST_LENGTH]
+
+
+def get_bundle_digest(files: typing.Dict[str, str]) -> str:
+    """
+    Compute the digest for an entire bundle from its per-file digests.
+
+    The result depends only on the archive names and file contents, which means that
+    zip metadata such as timestamps or ordering will not affect it.
+    """
+    hasher = hashlib.sha256()
+    for name, digest in sorted(files.items()):
+        hasher.update(f"{name}\0{digest}\n".encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def get_etag(source: typing.Union[pathlib.Path, typing.IO[bytes]]) -> str:
+    """
+    Compute the entity tag that S3 assigns to the bundle when uploaded in one part.
 
-    return ZipComparison(True, "all_comparisons_matched")
+    Bundles uploaded in multiple parts have entity tags derived from their parts
+    instead, which this never matches.
+    """
+    hasher = hashlib.md5()
+    with contextlib.ExitStack() as stack:
+        if isinstance(source, pathlib.Path):
+            source = stack.enter_context(source.open("rb"))
+        source.seek(0)
+        while chunk := source.read(_COMPARE_CHUNK_SIZE):
+            hasher.update(chunk)
+    return f'"{hasher.hexdigest()}"'
+
+
+def encode_manifest(files: typing.Dict[str, str]) -> str:
+    """Serialize per-file digests into an ASCII-only string for object metadata."""
+    return json.dumps(files, sort_keys=True, separators=(",", ":"), ensure_ascii=True)
+
+
+def decode_manifest(value: typing.Optional[str]) -> typing.Optional[dict]:
+    """
+    Deserialize per-file digests previously encoded with `encode_manifest`.
+
+    :return:
+        None if the value is missing or cannot be decoded.
+    """
+    try:
+        return json.loads(value) if value else None
+    except ValueError:
+        return None
+
+
+def compare_manifests(
+    a_digest: str,
+    a_files: typing.Dict[str, str],
+    b_digest: str,
+    b_files: typing.Optional[typing.Dict[str, str]] = None,
+) -> "ZipComparison":
+    """
+    Compare two bundles using their content digests instead of their contents.
+
+    Per-file digests are optional on the second bundle and are only used to identify
+    which file differs when the bundle digests do not match.
+    """
+    if a_digest == b_digest:
+        return ZipComparison(True, "matched_digests")
+
+    if b_files is None:
+        return ZipComparison(False, "mismatched_digest")
+
+    mismatches = {
+        name: (
+            "mismatched_missing_file"
+            if name not in a_files or name not in b_files
+            else "mismatched_file_diff"
+        )
+        for name in sorted(set(a_files) | set(b_files))
+        if a_files.get(name) != b_files.get(name)
+    }
+    if not mismatches:
+        return ZipComparison(False, "mismatched_digest")
+    return ZipComparison.from_mismatches(mismatches)
@@ -0,0 +1,127 @@
+import pathlib
+import time
+import typing
+
+from terrable import _definitions
+from terrable import _publisher
+from terrable import _storage
+
+#: Fingerprints of the files of each module directory keyed by the directories.
+#: Fingerprints are None for modules whose files changed while they were read.
+_Snapshot = typing.Dict[pathlib.Path, typing.Optional[str]]
+
+
+def _take_snapshot(context: "_definitions.Context") -> "_Snapshot":
+    """Fingerprint the files of every module directory from their file stats."""
+    source_directories, root_rules = _publisher.get_sources(context)
+    snapshot: "_Snapshot" = {}
+    for directory in source_directories:
+        try:
+            snapshot[directory] = _publisher.get_fingerprint(directory, root_rules)
+        except OSError:
+            snapshot[directory] = None
+    return snapshot
+
+
+def _settle(
+    context: "_definitions.Context",
+    snapshot: "_Snapshot",
+) -> "_Snapshot":
+    """
+    Wait until the files of the modules stop changing.
+
+    Editors and tools often write many files, or the same file multiple times, in
+    quick succession. Changes are therefore only acted upon once no files changed
+    for the debounce period.
+    """
+    while True:
+        time.sleep(context.args.debounce)
+        settled = _take_snapshot(context)
+        if settled == snapshot:
+            return settled
+        snapshot = settled
+
+
+def _publish_changed(
+    context: "_definitions.Context",
+    directories: typing.List[pathlib.Path],
+    workspace: "_publisher.Workspace",
+) -> typing.Dict[str, typing.Tuple[bool, typing.Optional[str]]]:
+    """
+    Publish the module directories.
+
+    The known versions of the modules in the workspace catalog are updated with
+    the published versions, which means that they never need to be listed again.
+
+    :return:
+        A tuple containing whether each module was published and the error message
+        if publishing failed, keyed by the module names.
+    """
+    root_rules = workspace.ignore_rules
+    try:
+        waves, dependencies = _publisher.plan(context, directories, root_rules)
+    except _definitions.DependencyCycleError as error:
+        message = f"Modules reference each other in a cycle: {error}."
+        print(f"\n   ! {message}")
+        return {d.name: (False, message) for d in directories}
+
+    return _publisher.publish_waves(context, waves, dependencies, workspace)
+
+
+def _watch(
+    context: "_definitions.Context",
+    workspace: "_publisher.Workspace",
+    published: typing.Dict[str, int],
+    errors: typing.Dict[str, str],
+) -> None:
+    """
+    Poll the module directories and publish modules whenever their files change.
+
+    The first poll publishes every module that differs from its latest version,
+    after which only modules whose files changed since they were last published
+    are bundled and compared again. Polling continues until it's interrupted.
+
+    :param published:
+        Number of versions published of each module, which is updated in place.
+    :param errors:
+        Error messages of modules whose latest publish failed, which are updated
+        in place.
+    """
+    known: "_Snapshot" = {}
+    while True:
+        snapshot = _take_snapshot(context)
+        if snapshot != known and known:
+            snapshot = _settle(context, snapshot)
+        changed = [d for d, f in snapshot.items() if f is None or known.get(d) != f]
+        if changed:
+            outcomes = _publish_changed(context, changed, workspace)
+            for name, (is_published, error) in outcomes.items():
+                published[name] = published.get(name, 0) + int(is_published)
+                errors[name] = error or ""
+            print(f"\n\nWATCHING: {context.args.directory} (Ctrl+C to stop)")
+        known = snapshot
+        time.sleep(context.args.interval)
+
+
+def run(context: "_definitions.Context") -> "_definitions.CommandResult":
+    """Execute a watch action for the given command context."""
+    _, root_rules = _publisher.get_sources(context)
+    # The versions of all modules are kept in memory and updated as modules are
+    # published, which means that polls never list the bucket again.
+    with context.report.phase("catalog"):
+        catalog = _storage.get_catalog(context)
+
+    published: typing.Dict[str, int] = {}
+    errors: typing.Dict[str, str] = {}
+    with _publisher.open_workspace(catalog, root_rules) as workspace:
+        try:
+            _watch(context, workspace, published, errors)
+        except KeyboardInterrupt:
+            pass
+
+    return _definitions.CommandResult(
+        code="WATCH_STOPPED",
+        message="Stopped watching modules for changes.",
+        data=published,
+        errors={name: error for name, error in errors.items() if error},
+    )
@@ -0,0 +1,13 @@
+"""Shared fixtures for the terrable tests."""
+
+import pathlib
+
+from pytest import fixture
+
+
+@fixture(autouse=True)
+def cache_directory(tmp_path: pathlib.Path, monkeypatch) -> pathlib.Path:
+    """Isolate the local cache of each test within its own temporary directory."""
+    directory = tmp_path.joinpath("cache")
+    monkeypatch.setenv("TERRABLE_CACHE_DIRECTORY", str(directory))
+    return directory
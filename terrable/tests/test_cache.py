@@ -0,0 +1,51 @@
+import os
+import pathlib
+import shutil
+
+from terrable import _cache
+
+
+def _create_entry(root: pathlib.Path, name: str, size: int, used: int):
+    """Create a cache entry directory of the given size last used at a timestamp."""
+    directory = root.joinpath("bundles", name)
+    directory.mkdir(parents=True)
+    directory.joinpath("bundle.zip").write_bytes(b"0" * size)
+    entry_path = directory.joinpath("entry.json")
+    entry_path.write_text("{}")
+    os.utime(entry_path, (used, used))
+    return directory
+
+
+def test_evict(tmp_path: pathlib.Path):
+    """Should evict the least recently used entries beyond the max size."""
+    oldest = _create_entry(tmp_path, "a", 100, 1000)
+    older = _create_entry(tmp_path, "b", 100, 2000)
+    newest = _create_entry(tmp_path, "c", 100, 3000)
+
+    removed = _cache.evict(tmp_path, max_size=150)
+
+    assert removed == [older, oldest]
+    assert newest.exists()
+    assert not older.exists()
+    assert not oldest.exists()
+
+
+def test_evict_removed(tmp_path: pathlib.Path, monkeypatch):
+    """Should skip entries that are removed by someone else while evicting."""
+    removed = _create_entry(tmp_path, "a", 100, 1000)
+    kept = _create_entry(tmp_path, "b", 100, 2000)
+    get_last_used = _cache._get_last_used
+
+    def remove_while_sorting(directory: pathlib.Path) -> float:
+        last_used = get_last_used(directory)
+        shutil.rmtree(removed, ignore_errors=True)
+        return last_used
+
+    monkeypatch.setattr(_cache, "_get_last_used", remove_while_sorting)
+    assert _cache.evict(tmp_path, max_size=150) == []
+    assert kept.exists()
+
+
+def test_evict_empty(tmp_path: pathlib.Path):
+    """Should do nothing when the cache holds no bundles."""
+    assert _cache.evict(tmp_path, max_size=0) == []
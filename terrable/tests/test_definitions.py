@@ -0,0 +1,93 @@
+import argparse
+from unittest.mock import MagicMock
+
+import terrable
+from terrable import _definitions
+
+
+def _create_context(**kwargs) -> "_definitions.Context":
+    """Create a context with a mock session and the given arguments."""
+    return _definitions.Context(argparse.Namespace(**kwargs), MagicMock())
+
+
+def test_context_client():
+    """Should create the client once and reuse it afterwards."""
+    context = _create_context(max_pool_connections=None)
+    assert context.client is context.client
+    context.session.client.assert_called_once()
+    config = context.session.client.call_args.kwargs["config"]
+    assert config.max_pool_connections == 10
+
+
+def test_context_client_config_once(monkeypatch):
+    """Should only configure the client when creating it."""
+    import botocore.config
+
+    config = MagicMock()
+    monkeypatch.setattr(botocore.config, "Config", config)
+    context = _create_context(max_pool_connections=None)
+    for _ in range(3):
+        assert context.client is context.session.client.return_value
+    config.assert_called_once()
+
+
+def test_context_max_pool_connections():
+    """Should size the connection pool for the jobs unless explicitly set."""
+    assert _create_context().max_pool_connections == 10
+    assert _create_context(jobs=32).max_pool_connections == 32
+    assert _create_context(jobs=32, max_pool_connections=4).max_pool_connections == 4
+
+
+def test_context_transfer_config():
+    """Should configure transfers from the arguments or use defaults otherwise."""
+    config = _create_context().transfer_config
+    assert config.multipart_threshold == 8 * 1024 * 1024
+    assert config.max_request_concurrency == 10
+
+    config = _create_context(
+        multipart_threshold=1024,
+        multipart_chunksize=2048,
+        max_concurrency=3,
+    ).transfer_config
+    assert config.multipart_threshold == 1024
+    assert config.multipart_chunksize == 2048
+    assert config.max_request_concurrency == 3
+
+
+def test_parse_transfer_environment(monkeypatch):
+    """Should read the transfer settings from environment variables."""
+    monkeypatch.setenv("TERRABLE_MULTIPART_CHUNKSIZE", "1234")
+    monkeypatch.setenv("TERRABLE_MAX_CONCURRENCY", "4")
+    args = terrable._parse(["list", "--bucket=foo", "--multipart-threshold=99"])
+    assert args.multipart_threshold == 99
+    assert args.multipart_chunksize == 1234
+    assert args.max_concurrency == 4
+
+
+def test_module_version_from_entry():
+    """Should parse the listing entry once and only keep it when asked to."""
+    entry = {"Key": "/terrable/foo/12.zip", "Size": 34, "ETag": '"abc"'}
+    version = _definitions.ModuleVersion.from_entry("foo", "us-east-1", "bar", entry)
+    assert (version.key, version.version, version.size) == (
+        "terrable/foo/12.zip",
+        12,
+        34,
+    )
+    assert version.etag == '"abc"'
+    assert version.raw is None
+    assert not hasattr(version, "__dict__")
+
+    kept = _definitions.ModuleVersion.from_entry("foo", "", "bar", entry, True)
+    assert kept.raw is entry
+
+
+def test_filesystem_bucket():
+    """Should give file:// buckets file URLs and no region without a session."""
+    context = _create_context(bucket="FILE:///tmp/modules")
+    assert context.region == ""
+
+    entry = {"Key": "terrable/foo/1.zip", "Size": 1}
+    version = _definitions.ModuleVersion.from_entry(
+        "foo", "", "file:///tmp/modules/", entry
+    )
+    assert version.module_url == "file:///tmp/modules/terrable/foo/1.zip"
@@ -0,0 +1,73 @@
+import pathlib
+
+import pytest
+
+from terrable import _definitions
+from terrable import _dependencies
+
+_MAIN = """
+# module "commented" { source = "../commented" }
+module "network" {
+  source = "../network"
+  tags   = { name = "#not-a-comment" }
+}
+
+/*
+module "disabled" {
+  source = "../disabled"
+}
+*/
+module "remote" {
+  source  = "terraform-aws-modules/vpc/aws"
+  version = "3.0.0"
+}
+
+module "nested" {
+  providers = {
+    aws = aws.east
+  }
+  source = "../storage//buckets"
+}
+"""
+
+
+def test_get_sources():
+    """Should find the local sources of module blocks outside comments."""
+    assert _dependencies.get_sources(_MAIN) == ["../network", "../storage//buckets"]
+
+
+def test_get_dependencies(tmp_path: pathlib.Path):
+    """Should resolve local sources to the sibling module directories."""
+    directory = tmp_path.joinpath("app")
+    directory.joinpath("inner").mkdir(parents=True)
+    directory.joinpath("main.tf").write_text(_MAIN)
+    directory.joinpath("inner", "main.tf").write_text(
+        'module "a" { source = "../" }\nmodule "b" { source = "../../queue" }\n'
+    )
+    directory.joinpath("notes.md").write_text('module "c" { source = "../docs" }')
+    paths = sorted(p for p in directory.rglob("*") if p.is_file())
+    dependencies = _dependencies.get_dependencies(directory, paths)
+    assert dependencies == {"network", "storage", "queue"}
+
+
+def test_get_waves():
+    """Should order modules into waves after the modules they reference."""
+    dependencies = {
+        "app": {"network", "storage"},
+        "storage": {"network", "external"},
+        "network": set(),
+        "queue": set(),
+    }
+    assert _dependencies.get_waves(dependencies) == [
+        ["network", "queue"],
+        ["storage"],
+        ["app"],
+    ]
+
+
+def test_get_waves_cycle():
+    """Should fail on modules that reference each other in a cycle."""
+    dependencies = {"a": {"b"}, "b": {"c"}, "c": {"b"}, "d": set()}
+    with pytest.raises(_definitions.DependencyCycleError) as info:
+        _dependencies.get_waves(dependencies)
+    assert info.value.modules in (["b", "c", "b"], ["c", "b", "c"])
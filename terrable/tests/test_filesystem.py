@@ -0,0 +1,91 @@
+import pathlib
+
+import terrable
+from terrable import _definitions
+from terrable import _filesystem
+from terrable import _index
+
+MY_DIRECTORY = pathlib.Path(__file__).parent.absolute()
+MODULES_DIRECTORY = MY_DIRECTORY.joinpath("modules")
+
+
+def _get_bucket(tmp_path: pathlib.Path) -> str:
+    """Get the file:// bucket URL of a directory within the temporary directory."""
+    return f"--bucket={tmp_path.joinpath('bucket').as_uri()}"
+
+
+def test_publish_filesystem(tmp_path: pathlib.Path, capsys):
+    """Should publish modules to and list them from a file:// bucket directory."""
+    bucket = _get_bucket(tmp_path)
+    result = terrable.run(["publish", str(MODULES_DIRECTORY), bucket])
+    assert result.data == {"foo": True}
+    assert tmp_path.joinpath("bucket", "terrable", "foo", "1.zip").is_file()
+
+    result = terrable.run(["publish", str(MODULES_DIRECTORY), bucket])
+    assert result.data == {"foo": False}, "Expected unchanged module to be skipped."
+
+    capsys.readouterr()
+    result = terrable.run(["list", "foo", bucket, "--refresh"])
+    assert result.code == "LISTED_VERSIONS"
+    expected = tmp_path.joinpath("bucket", "terrable", "foo", "1.zip").as_uri()
+    assert expected in capsys.readouterr().out
+
+
+def test_reindex_filesystem(tmp_path: pathlib.Path):
+    """Should maintain the catalog index within a file:// bucket directory."""
+    bucket = _get_bucket(tmp_path)
+    terrable.run(["publish", str(MODULES_DIRECTORY), bucket])
+    result = terrable.run(["reindex", bucket])
+    assert result.data["modules"] == ["foo"]
+
+    terrable.run(["publish", str(MODULES_DIRECTORY), bucket, "--force"])
+    path = tmp_path.joinpath("bucket", "terrable", "index.json")
+    data = _index.decode(path.read_bytes())
+    assert data is not None
+    assert [e["key"] for e in data["modules"]["foo"]] == [
+        "terrable/foo/1.zip",
+        "terrable/foo/2.zip",
+    ]
+    assert not path.with_name("index.json.lock").exists()
+
+
+def test_stale_index_filesystem(tmp_path: pathlib.Path, capsys):
+    """Should list the bucket directory while the index is marked as stale."""
+    bucket = _get_bucket(tmp_path)
+    terrable.run(["publish", str(MODULES_DIRECTORY), bucket])
+    terrable.run(["reindex", bucket])
+    context = _definitions.Context(terrable._parse(["list", bucket]))
+    _filesystem.mark_index_stale(context)
+    assert _filesystem.is_index_stale(context)
+
+    capsys.readouterr()
+    terrable.run(["list", bucket, "--verbose", "--refresh"])
+    assert "The catalog index is out of date" in capsys.readouterr().out
+    terrable.run(["reindex", bucket])
+    assert not _filesystem.is_index_stale(context)
+
+
+def test_put_index_conflict(tmp_path: pathlib.Path):
+    """Should refuse to overwrite an index that changed since it was read."""
+    args = terrable._parse(["list", _get_bucket(tmp_path)])
+    context = _definitions.Context(args)
+    assert _filesystem.put_index(context, b"first", None)
+    assert not _filesystem.put_index(context, b"second", None)
+    body, etag = _filesystem.get_index(context)
+    assert body == b"first"
+    assert _filesystem.get_index(context, etag) == (None, etag)
+    assert _filesystem.put_index(context, b"second", etag)
+
+
+def test_publish_filesystem_conflict(tmp_path: pathlib.Path, capsys):
+    """Should publish after a version that another publisher allocated first."""
+    bucket = _get_bucket(tmp_path)
+    terrable.run(["publish", str(MODULES_DIRECTORY), bucket])
+    directory = tmp_path.joinpath("bucket", "terrable", "foo")
+    directory.joinpath("2.json").write_text("{}")
+
+    result = terrable.run(["publish", str(MODULES_DIRECTORY), bucket, "--force"])
+    assert result.data == {"foo": True}
+    assert "Version 2 was published concurrently" in capsys.readouterr().out
+    assert not directory.joinpath("2.zip").exists()
+    assert directory.joinpath("3.zip").is_file()
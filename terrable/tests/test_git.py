@@ -0,0 +1,72 @@
+import pathlib
+import subprocess
+import typing
+
+import terrable
+from terrable import _git
+
+
+def _git_run(directory: pathlib.Path, *arguments: str):
+    """Run a git command within the repository directory."""
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@test", *arguments],
+        cwd=directory,
+        check=True,
+        capture_output=True,
+    )
+
+
+def _create_repository(
+    directory: pathlib.Path, names: typing.List[str]
+) -> pathlib.Path:
+    """Create a repository with committed modules within its modules directory."""
+    modules = directory.joinpath("repository", "modules")
+    for name in names:
+        modules.joinpath(name).mkdir(parents=True)
+        modules.joinpath(name, "main.tf").write_text(f'# "{name}" module\n')
+    modules.parent.joinpath("README.md").write_text("# Modules\n")
+    _git_run(modules.parent, "init", "-q")
+    _git_run(modules.parent, "add", ".")
+    _git_run(modules.parent, "commit", "-q", "-m", "Add modules")
+    return modules
+
+
+def test_get_changed_modules(tmp_path: pathlib.Path):
+    """Should find modules with committed, uncommitted and untracked changes."""
+    modules = _create_repository(tmp_path, ["a", "b", "c", "d"])
+    modules.joinpath("a", "main.tf").write_text("# changed\n")
+    _git_run(modules, "commit", "-q", "-am", "Change a")
+    modules.joinpath("b", "main.tf").write_text("# changed\n")
+    _git_run(modules, "mv", "c/main.tf", "c/renamed.tf")
+    modules.joinpath("e").mkdir()
+    modules.joinpath("e", "main.tf").write_text("# new\n")
+    modules.parent.joinpath("README.md").write_text("# Changed\n")
+
+    assert _git.get_changed_modules(modules, "HEAD~1") == {"a", "b", "c", "e"}
+    assert _git.get_changed_modules(modules, "HEAD") == {"b", "c", "e"}
+
+
+def test_publish_changed_since(tmp_path: pathlib.Path, capsys):
+    """Should only bundle changed modules and modules that were never published."""
+    modules = _create_repository(tmp_path, ["a", "b", "c", "d"])
+    bucket = f"--bucket={tmp_path.joinpath('bucket').as_uri()}"
+    for name in ["a", "b", "c"]:
+        terrable.run(["publish", str(modules), bucket, f"--target={name}"])
+    modules.joinpath("b", "main.tf").write_text("# changed\n")
+
+    capsys.readouterr()
+    result = terrable.run(["publish", str(modules), bucket, "--changed-since=HEAD"])
+    assert result.data == {"a": False, "b": True, "c": False, "d": True}
+    output = capsys.readouterr().out
+    assert "CHANGED SINCE HEAD: b, d" in output
+    assert "BUNDLING: a" not in output
+
+
+def test_publish_changed_since_unknown(tmp_path: pathlib.Path):
+    """Should fail without publishing when the git ref doesn't exist."""
+    modules = _create_repository(tmp_path, ["a"])
+    bucket = f"--bucket={tmp_path.joinpath('bucket').as_uri()}"
+    result = terrable.run(["publish", str(modules), bucket, "--changed-since=nope"])
+    assert result.code == "CHANGES_UNKNOWN"
+    assert "nope" in result.errors["a"]
+    assert not tmp_path.joinpath("bucket").exists()
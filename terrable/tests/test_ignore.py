@@ -0,0 +1,101 @@
+import pathlib
+import typing
+
+from pytest import mark
+
+from terrable import _ignore
+from terrable import _publisher
+
+
+@mark.parametrize(
+    "pattern, path, is_directory, expected",
+    [
+        ("*.tfstate", "terraform.tfstate", False, True),
+        ("*.tfstate", "nested/terraform.tfstate", False, True),
+        ("*.tfstate", "terraform.tfstate.backup", False, False),
+        ("/*.tfstate", "nested/terraform.tfstate", False, False),
+        ("docs/", "docs", True, True),
+        ("docs/", "docs", False, False),
+        ("docs/*.md", "docs/README.md", False, True),
+        ("docs/*.md", "docs/nested/README.md", False, False),
+        ("docs/**/*.md", "docs/README.md", False, True),
+        ("docs/**/*.md", "docs/nested/README.md", False, True),
+        ("**/tests", "a/b/tests", True, True),
+        ("tests/**", "tests/a/b.tf", False, True),
+        ("file?.tf", "file1.tf", False, True),
+        ("file[0-4].tf", "file5.tf", False, False),
+        ("file[!0-4].tf", "file5.tf", False, True),
+        ("\\#notes", "#notes", False, True),
+    ],
+)
+def test_rule_matches(pattern: str, path: str, is_directory: bool, expected: bool):
+    """Should match paths as gitignore patterns would."""
+    directory = pathlib.Path("/module")
+    rule = _ignore.parse([pattern], directory)[0]
+    full_path = str(directory.joinpath(*path.split("/")))
+    assert rule.matches(full_path, is_directory) == expected
+
+
+def test_is_ignored_negated():
+    """Should decide by the last matching rule so that negations re-include paths."""
+    directory = pathlib.Path("/module")
+    rules = _ignore.parse(["# comment", "", "*.json", "!keep.json"], directory)
+    assert _ignore.is_ignored(rules, "/module/drop.json", False)
+    assert not _ignore.is_ignored(rules, "/module/keep.json", False)
+    assert not _ignore.is_ignored(rules, "/module/main.tf", False)
+
+
+def _create_files(directory: pathlib.Path, names: typing.List[str]):
+    """Create the named files with parent directories within the directory."""
+    for name in names:
+        path = directory.joinpath(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+
+
+def test_get_paths(tmp_path: pathlib.Path, monkeypatch):
+    """Should list module files without descending into excluded directories."""
+    module = tmp_path.joinpath("module")
+    _create_files(
+        module,
+        [
+            "main.tf",
+            "terraform.tfstate",
+            "keep.tfstate",
+            ".terraform/providers/plugin",
+            ".git/HEAD",
+            "docs/README.md",
+            "files/policy.json",
+            "files/policy.json~",
+            "files/.terraform/plugin",
+            _ignore.IGNORE_FILENAME,
+        ],
+    )
+    module.joinpath(_ignore.IGNORE_FILENAME).write_text("!keep.tfstate\n")
+    tmp_path.joinpath(_ignore.IGNORE_FILENAME).write_text("/module/docs/\n")
+
+    checked = []
+    is_ignored = _ignore.is_ignored
+
+    def _is_ignored(rules, path, is_directory):
+        checked.append(path)
+        return is_ignored(rules, path, is_directory)
+
+    monkeypatch.setattr(_ignore, "is_ignored", _is_ignored)
+    paths = _publisher._get_paths(module, _ignore.load(tmp_path))
+
+    observed = [p.relative_to(module).as_posix() for p in paths]
+    assert observed == ["keep.tfstate", "main.tf", "files/policy.json"]
+    assert not [p for p in checked if ".terraform" in p and "plugin" in p]
+
+
+def test_get_paths_symlink_loop(tmp_path: pathlib.Path):
+    """Should not follow directory symlinks that loop back into the module."""
+    module = tmp_path.joinpath("module")
+    _create_files(module, ["main.tf"])
+    module.joinpath("loop").symlink_to("..", target_is_directory=True)
+
+    paths = _publisher._get_paths(module, _ignore.load(tmp_path))
+
+    observed = [p.relative_to(module).as_posix() for p in paths]
+    assert observed == ["main.tf"]
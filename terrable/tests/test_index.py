@@ -0,0 +1,223 @@
+import datetime
+import json
+import pathlib
+import typing
+
+import lobotomy
+
+import terrable
+from terrable import _index
+
+MY_DIRECTORY = pathlib.Path(__file__).parent.absolute()
+MODULES_DIRECTORY = MY_DIRECTORY.joinpath("modules")
+
+_INDEX: dict = {
+    "format": _index.FORMAT_VERSION,
+    "modules": {
+        "foo-module": [
+            {
+                "key": "terrable/foo-module/2.zip",
+                "size": 456,
+                "last_modified": "2020-11-12T23:59:06+00:00",
+                "etag": '"def"',
+                "digest": "0123456789abcdef",
+            },
+            {
+                "key": "terrable/foo-module/1.zip",
+                "size": 123,
+                "last_modified": "2020-11-11T23:59:06+00:00",
+                "etag": '"abc"',
+                "digest": None,
+            },
+        ],
+        "bar-module": [
+            {
+                "key": "terrable/bar-module/1.zip",
+                "size": 789,
+                "last_modified": "2020-11-10T23:59:06+00:00",
+                "digest": None,
+            }
+        ],
+    },
+}
+
+
+#: Keys of the bundles of the modules within the index.
+_INDEXED_KEYS = [
+    "terrable/bar-module/1.zip",
+    "terrable/foo-module/1.zip",
+    "terrable/foo-module/2.zip",
+]
+#: Time at which the listed bundles were last modified.
+_MODIFIED = datetime.datetime(2020, 11, 13, tzinfo=datetime.timezone.utc)
+
+
+def _add_index_call(lobotomized: lobotomy.Lobotomy, etag: str = '"index-1"'):
+    """Add a response for fetching the catalog index."""
+    lobotomized.add_call("s3", "get_object", {"Body": json.dumps(_INDEX), "ETag": etag})
+
+
+def _add_marker_call(lobotomized: lobotomy.Lobotomy, stale: bool = False):
+    """Add a response for checking whether the index is marked as stale."""
+    if stale:
+        lobotomized.add_call("s3", "head_object", {})
+    else:
+        lobotomized.add_error_call("s3", "head_object", "404", "Not Found")
+
+
+@lobotomy.Patch()
+def test_list_index(lobotomized: lobotomy.Lobotomy, capsys):
+    """Should list modules and versions from the index without listing the bucket."""
+    _add_index_call(lobotomized)
+    _add_marker_call(lobotomized)
+    result = terrable.run(["list", "--bucket=foo", "--verbose"])
+    assert result.data["modules"] == ["bar-module", "foo-module"]
+    assert not lobotomized.get_service_calls("s3", "list_objects_v2")
+    output = capsys.readouterr().out
+    assert output.index("foo-module/1.zip") < output.index("foo-module/2.zip")
+
+    call = lobotomized.get_service_call("s3", "get_object")
+    assert call.request["Key"] == "terrable/index.json"
+    assert "IfNoneMatch" not in call.request
+
+
+@lobotomy.Patch()
+def test_list_index_not_modified(lobotomized: lobotomy.Lobotomy):
+    """Should reuse the local copy of the index when it hasn't changed."""
+    _add_index_call(lobotomized)
+    lobotomized.add_error_call("s3", "get_object", "304", "Not Modified")
+    _add_marker_call(lobotomized)
+    _add_marker_call(lobotomized)
+    args = ["list", "foo-module", "--bucket=foo", "--listing-ttl=0"]
+    first = terrable.run(args)
+    second = terrable.run(args)
+    assert first.code == second.code == "LISTED_VERSIONS"
+    calls = lobotomized.get_service_calls("s3", "get_object")
+    assert calls[1].request["IfNoneMatch"] == '"index-1"'
+    assert not lobotomized.get_service_calls("s3", "list_objects_v2")
+    call = lobotomized.get_service_calls("s3", "head_object")[0]
+    assert call.request["Key"] == "terrable/index.stale"
+
+
+def _add_listing_call(lobotomized: lobotomy.Lobotomy, keys: typing.List[str]):
+    """Add a response for listing the bundles with the keys."""
+    contents = [{"Key": k, "Size": 1, "LastModified": _MODIFIED} for k in keys]
+    lobotomized.add_call("s3", "list_objects_v2", {"Contents": contents})
+
+
+@lobotomy.Patch()
+def test_list_index_missing_module(lobotomized: lobotomy.Lobotomy, capsys):
+    """Should list the bucket when the index missing a module is marked as stale."""
+    _add_index_call(lobotomized)
+    _add_marker_call(lobotomized, stale=True)
+    _add_listing_call(lobotomized, [*_INDEXED_KEYS, "terrable/baz-module/1.zip"])
+    result = terrable.run(["list", "--bucket=foo", "--verbose"])
+    assert result.data["modules"] == ["bar-module", "baz-module", "foo-module"]
+    output = capsys.readouterr().out
+    assert "The catalog index is out of date" in output
+    assert "baz-module/1.zip" in output
+    assert len(lobotomized.get_service_calls("s3", "list_objects_v2")) == 1
+
+
+@lobotomy.Patch()
+def test_list_index_missing_version(lobotomized: lobotomy.Lobotomy, capsys):
+    """Should list the latest version of a module when the index is missing it."""
+    _add_index_call(lobotomized)
+    _add_marker_call(lobotomized, stale=True)
+    _add_listing_call(lobotomized, ["terrable/foo-module/3.zip"])
+    result = terrable.run(["list", "foo-module", "--bucket=foo", "--latest"])
+    assert result.code == "LISTED_LATEST_VERSION"
+    output = capsys.readouterr().out
+    assert "The catalog index is out of date" in output
+    assert "foo-module/3.zip" in output
+
+
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_list_modules.yaml"))
+def test_list_scan(lobotomized: lobotomy.Lobotomy):
+    """Should list the bucket without reading the index when scanning."""
+    result = terrable.run(["list", "--bucket=foo", "--scan"])
+    assert set(result.data["modules"]) == {"foo-module", "bar-module"}
+    assert not lobotomized.get_service_calls("s3", "get_object")
+
+
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_list_verbose.yaml"))
+def test_reindex(lobotomized: lobotomy.Lobotomy):
+    """Should rebuild the index from a bucket listing when there is none."""
+    lobotomized.add_call("s3", "delete_object", {})
+    lobotomized.add_call("s3", "head_object", {"Metadata": {"digest": "abc"}})
+    lobotomized.add_call("s3", "put_object", {})
+    result = terrable.run(["reindex", "--bucket=foo"])
+    assert result.code == "REINDEXED"
+    call = lobotomized.get_service_call("s3", "delete_object")
+    assert call.request["Key"] == "terrable/index.stale"
+    assert result.data["modules"] == ["bar-module", "foo-module"]
+
+    call = lobotomized.get_service_call("s3", "put_object")
+    assert call.request["IfNoneMatch"] == "*"
+    data = _index.decode(call.request["Body"])
+    assert data is not None
+    assert [e["key"] for e in data["modules"]["foo-module"]] == [
+        "terrable/foo-module/1.zip",
+        "terrable/foo-module/2.zip",
+    ]
+    assert {e["digest"] for e in data["modules"]["bar-module"]} == {"abc"}
+
+
+def _add_publish_calls(lobotomized: lobotomy.Lobotomy):
+    """Add responses for publishing a changed module."""
+    lobotomized.add_call(
+        "s3",
+        "list_objects_v2",
+        {"Contents": [{"Key": "terrable/foo/1.zip", "Size": 1}]},
+    )
+    lobotomized.add_call("s3", "head_object", {"Metadata": {"digest": "abc"}})
+    lobotomized.add_call("s3", "upload_file", {})
+
+
+@lobotomy.Patch()
+def test_publish_index(lobotomized: lobotomy.Lobotomy):
+    """Should add the published version to the index if it hasn't changed since."""
+    _add_publish_calls(lobotomized)
+    _add_index_call(lobotomized)
+    lobotomized.add_call("s3", "put_object", {})
+    result = terrable.run(["publish", str(MODULES_DIRECTORY), "--bucket=foo"])
+    assert result.data == {"foo": True}
+
+    call = lobotomized.get_service_call("s3", "put_object")
+    assert call.request["IfMatch"] == '"index-1"'
+    data = _index.decode(call.request["Body"])
+    assert data is not None
+    assert data["modules"]["foo"][0]["key"] == "terrable/foo/2.zip"
+    assert data["modules"]["foo-module"] == _INDEX["modules"]["foo-module"]
+
+
+@lobotomy.Patch()
+def test_publish_index_conflict(lobotomized: lobotomy.Lobotomy, monkeypatch):
+    """Should retry updating the index when another writer changed it."""
+    monkeypatch.setattr(_index, "_wait", lambda attempt: None)
+    _add_publish_calls(lobotomized)
+    _add_index_call(lobotomized, '"index-1"')
+    _add_index_call(lobotomized, '"index-2"')
+    lobotomized.add_error_call("s3", "put_object", "PreconditionFailed")
+    lobotomized.add_call("s3", "put_object", {})
+    result = terrable.run(["publish", str(MODULES_DIRECTORY), "--bucket=foo"])
+    assert result.data == {"foo": True}
+
+    calls = lobotomized.get_service_calls("s3", "put_object")
+    assert [c.request["IfMatch"] for c in calls] == ['"index-1"', '"index-2"']
+
+
+@lobotomy.Patch()
+def test_publish_index_stale(lobotomized: lobotomy.Lobotomy, monkeypatch):
+    """Should mark the index as stale when it can't be updated."""
+    monkeypatch.setattr(_index, "_WRITE_ATTEMPTS", 1)
+    monkeypatch.setattr(_index, "_wait", lambda attempt: None)
+    _add_publish_calls(lobotomized)
+    _add_index_call(lobotomized)
+    lobotomized.add_error_call("s3", "put_object", "PreconditionFailed")
+    lobotomized.add_call("s3", "put_object", {})
+    result = terrable.run(["publish", str(MODULES_DIRECTORY), "--bucket=foo"])
+    assert result.data == {"foo": True}
+
+    call = lobotomized.get_service_calls("s3", "put_object")[-1]
+    assert call.request["Key"] == "terrable/index.stale"
@@ -1,3 +1,4 @@
+import json
 import pathlib
 
 import lobotomy
@@ -20,6 +21,8 @@ def test_list_verbose(lobotomized: lobotomy.Lobotomy):
     """Should execute the list command successfully."""
     result = terrable.run(["list", "--profile=foo", "--bucket=foo", "--verbose"])
     assert result.code == "LISTED_MODULES"
+    assert result.data["modules"] == ["bar-module", "foo-module"]
+    assert len(lobotomized.get_service_calls("s3", "list_objects_v2")) == 1
 
 
 @lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_list_verbose.yaml"))
@@ -49,3 +52,80 @@ def test_list_modules(lobotomized: lobotomy.Lobotomy):
     result = terrable.run(["list", "--profile=foo", "--bucket=foo"])
     assert result.code == "LISTED_MODULES"
     assert set(result.data["modules"]) == {"foo-module", "bar-module"}
+
+
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_list_verbose.yaml"))
+def test_list_cached(lobotomized: lobotomy.Lobotomy):
+    """Should reuse cached listings until they expire or are refreshed."""
+    for _ in range(3):
+        result = terrable.run(["list", "--bucket=foo", "--verbose"])
+        assert result.data["modules"] == ["bar-module", "foo-module"]
+    assert len(lobotomized.service_calls) == 2
+
+    terrable.run(["list", "--bucket=foo", "--verbose", "--refresh"])
+    assert len(lobotomized.get_service_calls("s3", "list_objects_v2")) == 2
+    terrable.run(["list", "--bucket=foo", "--verbose", "--listing-ttl=0"])
+    assert len(lobotomized.get_service_calls("s3", "list_objects_v2")) == 3
+
+
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_list.yaml"))
+def test_list_cached_by_profile(lobotomized: lobotomy.Lobotomy):
+    """Should cache listings separately for each profile."""
+    for profile in ["foo", "bar", "foo"]:
+        terrable.run(["list", "foo-module", "--bucket=foo", f"--profile={profile}"])
+    assert len(lobotomized.get_service_calls("s3", "list_objects_v2")) == 2
+
+
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_list.yaml"))
+def test_list_invalidated(lobotomized: lobotomy.Lobotomy):
+    """Should list versions of a module again after publishing it."""
+    lobotomized.add_call("s3", "head_object", {"Metadata": {}})
+    lobotomized.add_call("s3", "upload_file", {})
+    terrable.run(["list", "foo", "--bucket=foo"])
+    terrable.run(["list", "foo", "--bucket=foo"])
+    assert len(lobotomized.get_service_calls("s3", "list_objects_v2")) == 1
+
+    terrable.run(["publish", str(MODULES_DIRECTORY), "--bucket=foo", "--force"])
+    assert len(lobotomized.get_service_calls("s3", "list_objects_v2")) == 2
+    terrable.run(["list", "foo", "--bucket=foo"])
+    assert len(lobotomized.get_service_calls("s3", "list_objects_v2")) == 3
+
+
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_list_verbose.yaml"))
+def test_list_json(lobotomized: lobotomy.Lobotomy, capsys):
+    """Should print the sorted listing as a single JSON array."""
+    result = terrable.run(["list", "--bucket=foo", "--latest", "--output=json"])
+    assert result.code == "LISTED_MODULES"
+    records = json.loads(capsys.readouterr().out)
+    assert [(r["module"], r["version"]) for r in records] == [
+        ("bar-module", 2),
+        ("foo-module", 2),
+    ]
+    assert records[0]["url"].endswith("/foo/terrable/bar-module/2.zip")
+
+
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_list_verbose.yaml"))
+def test_list_ndjson(lobotomized: lobotomy.Lobotomy, capsys):
+    """Should print a record per line in the order in which they are listed."""
+    result = terrable.run(["list", "--bucket=foo", "--verbose", "--output=ndjson"])
+    assert result.data == {"count": 4}
+    captured = capsys.readouterr()
+    records = [json.loads(line) for line in captured.out.splitlines()]
+    assert [(r["module"], r["version"]) for r in records] == [
+        ("foo-module", 2),
+        ("foo-module", 1),
+        ("bar-module", 2),
+        ("bar-module", 1),
+    ]
+    assert "No catalog index found" in captured.err
+
+
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_list_verbose.yaml"))
+def test_list_ndjson_latest(lobotomized: lobotomy.Lobotomy, capsys):
+    """Should print only the latest version of each module as it is listed."""
+    terrable.run(["list", "--bucket=foo", "--latest", "--output=ndjson", "--scan"])
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(r["module"], r["version"]) for r in records] == [
+        ("foo-module", 2),
+        ("bar-module", 2),
+    ]
@@ -0,0 +1,163 @@
+import datetime
+import pathlib
+import typing
+
+import lobotomy
+import pytest
+
+import terrable
+from terrable import _definitions
+from terrable import _index
+from terrable import _pruner
+
+MY_DIRECTORY = pathlib.Path(__file__).parent.absolute()
+MODULES_DIRECTORY = MY_DIRECTORY.joinpath("modules")
+NOW = datetime.datetime(2021, 6, 1, tzinfo=datetime.timezone.utc)
+
+
+def _create_versions(count: int) -> list:
+    """Create versions of a module that were published a day apart."""
+    return [
+        _definitions.ModuleVersion.from_entry(
+            "foo",
+            "us-east-1",
+            "bar",
+            {
+                "Key": f"terrable/foo/{number}.zip",
+                "Size": 1,
+                "LastModified": NOW - datetime.timedelta(days=count - number),
+            },
+        )
+        for number in range(1, count + 1)
+    ]
+
+
+@pytest.mark.parametrize(
+    "keep_last, keep_newer_than, pinned, expected",
+    [
+        (3, None, (), [1, 2]),
+        (None, datetime.timedelta(days=1.5), (), [1, 2, 3]),
+        (2, datetime.timedelta(days=3.5), (), [1]),
+        (1, None, (2,), [1, 3, 4]),
+        (0, datetime.timedelta(0), (), [1, 2, 3, 4]),
+        (10, None, (), []),
+    ],
+)
+def test_select(keep_last, keep_newer_than, pinned, expected):
+    """Should delete versions that no policy keeps and always keep the latest."""
+    versions = _create_versions(5)
+    selected = _pruner.select(versions, keep_last, keep_newer_than, pinned, NOW)
+    assert [v.version for v in selected] == expected
+
+
+def test_parse_duration():
+    """Should parse retention durations in days unless another unit is given."""
+    assert _pruner.parse_duration("90") == datetime.timedelta(days=90)
+    assert _pruner.parse_duration("12h") == datetime.timedelta(hours=12)
+    assert _pruner.parse_duration("2W") == datetime.timedelta(weeks=2)
+    with pytest.raises(Exception):
+        _pruner.parse_duration("soon")
+
+
+def test_prune_no_policy():
+    """Should refuse to prune without a policy that keeps some versions."""
+    with pytest.raises(SystemExit):
+        terrable.run(["prune", "--bucket=foo"])
+
+
+def test_prune_command_positional():
+    """Should take the command from the first positional, not from option values."""
+    args = terrable._parse(["prune", "--target", "list", "--keep-last", "3"])
+    assert args.command == "prune"
+    assert args.module_targets == ["list"]
+    args = terrable._parse(["--bucket", "list", "prune", "--keep-last", "3"])
+    assert (args.command, args.bucket) == ("prune", "list")
+
+
+@pytest.mark.parametrize("jobs", ["0", "-1", "many"])
+@pytest.mark.parametrize("command", [["prune", "--keep-last=3"], ["publish", "."]])
+def test_parse_jobs_invalid(command: typing.List[str], jobs: str):
+    """Should refuse fewer than one concurrent job when parsing."""
+    with pytest.raises(SystemExit):
+        terrable._parse([*command, "--bucket=foo", f"--jobs={jobs}"])
+
+
+def test_prune_filesystem(tmp_path: pathlib.Path):
+    """Should delete unkept versions along with their metadata and index entries."""
+    bucket = f"--bucket={tmp_path.joinpath('bucket').as_uri()}"
+    terrable.run(["publish", str(MODULES_DIRECTORY), bucket])
+    terrable.run(["reindex", bucket])
+    for _ in range(3):
+        terrable.run(["publish", str(MODULES_DIRECTORY), bucket, "--force"])
+
+    result = terrable.run(["prune", bucket, "--keep-last=1", "--pin=foo:2"])
+    assert result.code == "PRUNED"
+    assert result.data == {"foo": ["terrable/foo/1.zip", "terrable/foo/3.zip"]}
+    directory = tmp_path.joinpath("bucket", "terrable", "foo")
+    assert sorted(p.name for p in directory.iterdir()) == [
+        "2.json",
+        "2.zip",
+        "4.json",
+        "4.zip",
+    ]
+    data = _index.decode(directory.parent.joinpath("index.json").read_bytes())
+    assert data is not None
+    assert [e["key"] for e in data["modules"]["foo"]] == [
+        "terrable/foo/2.zip",
+        "terrable/foo/4.zip",
+    ]
+
+
+def test_prune_filesystem_dry_run(tmp_path: pathlib.Path):
+    """Should report the versions that would be deleted without deleting them."""
+    bucket = f"--bucket={tmp_path.joinpath('bucket').as_uri()}"
+    terrable.run(["publish", str(MODULES_DIRECTORY), bucket])
+    terrable.run(["publish", str(MODULES_DIRECTORY), bucket, "--force"])
+
+    result = terrable.run(["prune", bucket, "--keep-newer-than=0", "--dry-run"])
+    assert result.data == {"foo": ["terrable/foo/1.zip"]}
+    assert tmp_path.joinpath("bucket", "terrable", "foo", "1.zip").is_file()
+
+
+@lobotomy.Patch()
+def test_prune_batches(lobotomized: lobotomy.Lobotomy):
+    """Should delete versions in batches of up to 1000 keys per request."""
+    contents = [
+        {"Key": f"terrable/foo/{number}.zip", "Size": 1, "LastModified": NOW}
+        for number in range(1, 1501)
+    ]
+    lobotomized.add_call("s3", "list_objects_v2", {"Contents": contents})
+    lobotomized.add_call("s3", "delete_objects", {})
+    lobotomized.add_call(
+        "s3",
+        "delete_objects",
+        {"Errors": [{"Key": "terrable/foo/1499.zip", "Message": "Denied"}]},
+    )
+    lobotomized.add_error_call("s3", "get_object", "NoSuchKey")
+    result = terrable.run(["prune", "--bucket=bar", "--keep-last=1"])
+
+    assert result.code == "PRUNE_FAILED"
+    assert "terrable/foo/1499.zip" in result.errors["foo"]
+    assert len(result.data["foo"]) == 1498
+    calls = lobotomized.get_service_calls("s3", "delete_objects")
+    assert [len(c.request["Delete"]["Objects"]) for c in calls] == [1000, 499]
+
+
+@lobotomy.Patch()
+def test_prune_batch_failed(lobotomized: lobotomy.Lobotomy):
+    """Should report the versions deleted by earlier batches when a batch fails."""
+    contents = [
+        {"Key": f"terrable/foo/{number}.zip", "Size": 1, "LastModified": NOW}
+        for number in range(1, 2502)
+    ]
+    lobotomized.add_call("s3", "list_objects_v2", {"Contents": contents})
+    lobotomized.add_call("s3", "delete_objects", {})
+    lobotomized.add_error_call("s3", "delete_objects", "AccessDenied")
+    lobotomized.add_error_call("s3", "get_object", "NoSuchKey")
+    result = terrable.run(["prune", "--bucket=bar", "--keep-last=1"])
+
+    assert result.code == "PRUNE_FAILED"
+    assert "terrable/foo/1001.zip" in result.errors["foo"]
+    assert "terrable/foo/2500.zip" in result.errors["foo"]
+    assert result.data["foo"] == [f"terrable/foo/{n}.zip" for n in range(1, 1001)]
+    assert len(lobotomized.get_service_calls("s3", "delete_objects")) == 2
@@ -1,10 +1,17 @@
+import concurrent.futures
+import os
 import pathlib
+import shutil
+import threading
+import typing
+import zipfile
 from unittest.mock import MagicMock
 from unittest.mock import patch
 
 import lobotomy
 
 import terrable
+from terrable import _publisher
 from terrable import _utils
 
 MY_DIRECTORY = pathlib.Path(__file__).parent.absolute()
@@ -52,3 +59,331 @@ def test_publish_no_change(
             "--bucket=foo",
         ]
     )
+
+
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_publish_manifest.yaml"))
+def test_publish_manifest_no_change(lobotomized: lobotomy.Lobotomy, tmp_path):
+    """Should detect no changes from the remote manifest without a download."""
+    bundle = _publisher._bundle(MODULES_DIRECTORY.joinpath("foo"), tmp_path)
+    lobotomized.add_call("s3", "head_object", {"Metadata": {"digest": bundle.digest}})
+    result = terrable.run(["publish", str(MODULES_DIRECTORY), "--bucket=foo"])
+    assert result.data == {"foo": False}
+    assert not lobotomized.get_service_calls("s3", "get_object")
+    assert not lobotomized.get_service_calls("s3", "upload_file")
+
+
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_publish_manifest.yaml"))
+def test_publish_manifest_changed(lobotomized: lobotomy.Lobotomy):
+    """Should publish with a manifest when the remote manifest digest differs."""
+    lobotomized.add_call("s3", "head_object", {"Metadata": {"digest": "abc"}})
+    lobotomized.add_call("s3", "upload_file", {})
+    result = terrable.run(["publish", str(MODULES_DIRECTORY), "--bucket=foo"])
+    assert result.data == {"foo": True}
+    call = lobotomized.get_service_call("s3", "upload_file")
+    metadata = call.request["ExtraArgs"]["Metadata"]
+    assert metadata["digest"] != "abc"
+    assert metadata["manifest"] == '{"main.tf":"e3b0c44298fc1c14"}'
+
+
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_publish_manifest.yaml"))
+def test_publish_call_count(lobotomized: lobotomy.Lobotomy):
+    """Should publish a changed module with one call for each step on one client."""
+    lobotomized.add_call("s3", "head_object", {"Metadata": {"digest": "abc"}})
+    lobotomized.add_call("s3", "upload_file", {})
+    result = terrable.run(["publish", str(MODULES_DIRECTORY), "--bucket=foo"])
+    assert result.data == {"foo": True}
+    observed = [(c.service, c.method) for c in lobotomized.service_calls]
+    assert observed == [
+        ("s3", "list_objects_v2"),
+        ("s3", "head_object"),
+        ("s3", "upload_file"),
+        ("s3", "get_object"),
+    ]
+
+
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_publish_manifest.yaml"))
+def test_publish_cached(lobotomized: lobotomy.Lobotomy, tmp_path):
+    """Should skip bundling and comparison for a module unchanged since cached."""
+    bundle = _publisher._bundle(MODULES_DIRECTORY.joinpath("foo"), tmp_path)
+    lobotomized.add_call("s3", "head_object", {"Metadata": {"digest": bundle.digest}})
+    for _ in range(2):
+        result = terrable.run(["publish", str(MODULES_DIRECTORY), "--bucket=foo"])
+        assert result.data == {"foo": False}
+    assert len(lobotomized.get_service_calls("s3", "head_object")) == 1
+
+
+def _create_modules(directory: pathlib.Path, names: typing.List[str]):
+    """Create module directories with a single terraform file in each."""
+    for name in names:
+        directory.joinpath(name).mkdir()
+        directory.joinpath(name, "main.tf").write_text(f'# "{name}" module\n')
+
+
+def test_bundle_compression(tmp_path):
+    """Should compress bundles that compare identical whatever their compression."""
+    directory = MODULES_DIRECTORY.joinpath("foo")
+    stored = _publisher._bundle(directory, tmp_path, compression=zipfile.ZIP_STORED)
+    for name, compression in _publisher.COMPRESSION_TYPES.items():
+        tmp_path.joinpath(name).mkdir()
+        bundle = _publisher._bundle(
+            directory,
+            tmp_path.joinpath(name),
+            compression=compression,
+            compression_level=9 if name != "lzma" else None,
+        )
+        with zipfile.ZipFile(bundle.path) as zipper:
+            infos = zipper.infolist()
+        assert {i.compress_type for i in infos} == {compression}
+        assert bundle.digest == stored.digest
+        assert _utils.compare_zip_files(bundle.path, stored.path, deep=True).identical
+
+
+def test_bundle_parallel(tmp_path, monkeypatch):
+    """Should assemble members compressed on other processes into one bundle."""
+    monkeypatch.setattr(_publisher, "_PARALLEL_THRESHOLD", 0)
+    directory = tmp_path.joinpath("module")
+    directory.joinpath("nested").mkdir(parents=True)
+    for index in range(4):
+        contents = f'variable "v{index}" {{}}\n' * (index + 1) * 100
+        directory.joinpath("nested" if index % 2 else "", f"{index}.tf").write_text(
+            contents
+        )
+
+    serial = _publisher._bundle(directory, tmp_path)
+    tmp_path.joinpath("parallel").mkdir()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+        parallel = _publisher._bundle(
+            directory, tmp_path.joinpath("parallel"), executor=executor
+        )
+
+    assert parallel.files == serial.files
+    with zipfile.ZipFile(parallel.path) as zipper:
+        assert zipper.testzip() is None
+        assert zipper.namelist() == ["0.tf", "2.tf", "nested/1.tf", "nested/3.tf"]
+    assert _utils.compare_zip_files(parallel.path, serial.path, deep=True).identical
+
+
+def test_bundle_parallel_reproducible(tmp_path, monkeypatch):
+    """Should assemble byte-identical bundles whether compressed in parallel or not."""
+    monkeypatch.setattr(_publisher, "_PARALLEL_THRESHOLD", 0)
+    directory = tmp_path.joinpath("module")
+    directory.mkdir()
+    for index in range(3):
+        directory.joinpath(f"{index}.tf").write_text(f'variable "v{index}" {{}}\n' * 50)
+
+    tmp_path.joinpath("serial").mkdir()
+    serial = _publisher._bundle(
+        directory, tmp_path.joinpath("serial"), compression_level=1, reproducible=True
+    )
+    tmp_path.joinpath("parallel").mkdir()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=2) as executor:
+        parallel = _publisher._bundle(
+            directory,
+            tmp_path.joinpath("parallel"),
+            compression_level=1,
+            executor=executor,
+            reproducible=True,
+        )
+
+    paths = [typing.cast(pathlib.Path, b.path) for b in (serial, parallel)]
+    assert paths[0].read_bytes() == paths[1].read_bytes()
+
+
+def test_workspace_lazy_pool():
+    """Should only start worker processes once work is submitted to them."""
+    with _publisher.open_workspace(None, []) as workspace:
+        executor = typing.cast(_publisher._LazyProcessPool, workspace.executor)
+        assert executor._executor is None
+        assert executor.submit(abs, -1).result() == 1
+        assert executor._executor is not None
+
+
+def test_bundle_reproducible(tmp_path: pathlib.Path):
+    """Should create byte-identical bundles regardless of file metadata."""
+    first = tmp_path.joinpath("first", "module")
+    first.joinpath("nested").mkdir(parents=True)
+    first.joinpath("main.tf").write_text('variable "a" {}\n')
+    first.joinpath("nested", "run.sh").write_text("echo\n")
+    first.joinpath("nested", "run.sh").chmod(0o775)
+    second = tmp_path.joinpath("second", "module")
+    shutil.copytree(first, second)
+    second.joinpath("main.tf").chmod(0o600)
+    os.utime(second.joinpath("main.tf"), (0, 0))
+
+    bundles = [
+        _publisher._bundle(d, d.parent, reproducible=True) for d in (first, second)
+    ]
+    paths = [typing.cast(pathlib.Path, b.path) for b in bundles]
+    assert paths[0].read_bytes() == paths[1].read_bytes()
+    with zipfile.ZipFile(paths[0]) as zipper:
+        modes = {i.filename: i.external_attr >> 16 for i in zipper.infolist()}
+        assert {i.date_time for i in zipper.infolist()} == {(1980, 1, 1, 0, 0, 0)}
+    assert modes == {"main.tf": 0o100644, "nested/run.sh": 0o100755}
+
+
+@lobotomy.Patch()
+def test_publish_reproducible_etag(lobotomized: lobotomy.Lobotomy, tmp_path):
+    """Should skip unchanged reproducible bundles by their ETag alone."""
+    bundle = _publisher._bundle(
+        MODULES_DIRECTORY.joinpath("foo"), tmp_path, reproducible=True
+    )
+    lobotomized.add_call(
+        "s3",
+        "list_objects_v2",
+        {
+            "Contents": [
+                {
+                    "Key": "terrable/foo/1.zip",
+                    "Size": bundle.size,
+                    "ETag": _utils.get_etag(bundle.source),
+                }
+            ]
+        },
+    )
+    args = ["publish", str(MODULES_DIRECTORY), "--bucket=foo", "--reproducible"]
+    result = terrable.run(args)
+    assert result.data == {"foo": False}
+    assert not lobotomized.get_service_calls("s3", "head_object")
+
+
+@lobotomy.Patch()
+def test_publish_jobs(lobotomized: lobotomy.Lobotomy, tmp_path, capsys):
+    """Should publish modules concurrently without interleaving their output."""
+    names = ["a", "b", "c", "d"]
+    _create_modules(tmp_path, names)
+    lobotomized.add_call("s3", "list_objects_v2", {"Contents": []})
+    result = terrable.run(
+        ["publish", str(tmp_path), "--bucket=foo", "--jobs=3", "--dry-run"]
+    )
+    assert result.code == "PUBLISHED"
+    assert result.data == {n: True for n in names}
+    assert len(lobotomized.get_service_calls("s3", "list_objects_v2")) == 1
+
+    output = capsys.readouterr().out
+    plan, *blocks = output.split("\nBUNDLING: ")
+    assert "1: a, b, c, d" in plan
+    assert sorted(b.split("\n", 1)[0] for b in blocks) == names
+    for block in blocks:
+        name = block.split("\n", 1)[0]
+        assert f"DRY RUN skipped publishing bundle to terrable/{name}/1.zip" in block
+
+
+@lobotomy.Patch()
+def test_publish_jobs_uploaded(lobotomized: lobotomy.Lobotomy, tmp_path, capsys):
+    """Should keep the upload progress of concurrent modules within their output."""
+    names = ["a", "b", "c", "d"]
+    _create_modules(tmp_path, names)
+    lobotomized.add_call("s3", "list_objects_v2", {"Contents": []})
+    lobotomized.add_error_call("s3", "get_object", "NoSuchKey")
+
+    def upload_file(Callback, **_):
+        # Transfers report their progress on threads of their own.
+        thread = threading.Thread(target=Callback, args=(123,))
+        thread.start()
+        thread.join()
+        return {}
+
+    lobotomized.data["clients"]["s3"]["upload_file"] = upload_file
+    result = terrable.run(["publish", str(tmp_path), "--bucket=foo", "--jobs=4"])
+    assert result.data == {n: True for n in names}
+
+    _, *blocks = capsys.readouterr().out.split("\nBUNDLING: ")
+    for block in blocks:
+        name = block.split("\n", 1)[0]
+        assert block.count("   + Uploading") == 1
+        assert f"   + Uploading {name} 123 bytes\n" in block
+
+
+@lobotomy.Patch()
+def test_publish_jobs_failed(lobotomized: lobotomy.Lobotomy, tmp_path):
+    """Should collect the errors of each module instead of aborting the batch."""
+    names = ["a", "b", "c"]
+    _create_modules(tmp_path, names)
+    lobotomized.add_call("s3", "list_objects_v2", {"Contents": []})
+    lobotomized.add_error_call("s3", "upload_file", "AccessDenied")
+    result = terrable.run(["publish", str(tmp_path), "--bucket=foo", "--jobs=2"])
+    assert result.code == "PUBLISH_FAILED"
+    assert result.data == {n: False for n in names}
+    assert set(result.errors) == set(names)
+
+
+@patch("terrable._utils.compare_zip_files")
+@lobotomy.Patch(path=MY_DIRECTORY.joinpath("test_publish.yaml"))
+def test_publish_in_memory(
+    lobotomized: lobotomy.Lobotomy,
+    compare_zip_files: MagicMock,
+    cache_directory: pathlib.Path,
+):
+    """Should bundle and upload in memory without temporary or cached files."""
+    lobotomized.add_call("s3", "upload_fileobj", {})
+    compare_zip_files.return_value = _utils.ZipComparison(False, "foo")
+    result = terrable.run(
+        ["publish", str(MODULES_DIRECTORY), "--bucket=bar", "--in-memory"]
+    )
+    assert result.data == {"foo": True}
+    assert not lobotomized.get_service_calls("s3", "upload_file")
+
+    local, _ = compare_zip_files.call_args.args
+    assert not isinstance(local, pathlib.Path)
+    call = lobotomized.get_service_call("s3", "upload_fileobj")
+    assert call.request["Key"] == "terrable/foo/3.zip"
+    assert not list(cache_directory.glob("bundles/*/*"))
+
+
+@lobotomy.Patch()
+def test_publish_version_conflict(lobotomized: lobotomy.Lobotomy):
+    """Should publish the next version when another publisher created it first."""
+    lobotomized.add_call("s3", "list_objects_v2", {"Contents": []})
+    lobotomized.add_error_call("s3", "upload_file", "PreconditionFailed")
+    lobotomized.add_call(
+        "s3",
+        "list_objects_v2",
+        {"Contents": [{"Key": "terrable/foo/1.zip", "Size": 1, "ETag": '"a"'}]},
+    )
+    lobotomized.add_call("s3", "head_object", {"Metadata": {"digest": "abc"}})
+    lobotomized.add_call("s3", "upload_file", {})
+    lobotomized.add_error_call("s3", "get_object", "NoSuchKey")
+    result = terrable.run(["publish", str(MODULES_DIRECTORY), "--bucket=foo"])
+    assert result.data == {"foo": True}
+    keys = [
+        c.request["Key"] for c in lobotomized.get_service_calls("s3", "upload_file")
+    ]
+    assert keys == ["terrable/foo/1.zip", "terrable/foo/2.zip"]
+
+
+@lobotomy.Patch()
+def test_publish_dependencies(lobotomized: lobotomy.Lobotomy, tmp_path, capsys):
+    """Should publish modules after the modules they reference as sources."""
+    _create_modules(tmp_path, ["a", "b", "c"])
+    tmp_path.joinpath("a", "main.tf").write_text('module "b" { source = "../b" }')
+    lobotomized.add_call("s3", "list_objects_v2", {"Contents": []})
+    result = terrable.run(["publish", str(tmp_path), "--bucket=foo", "--dry-run"])
+    assert result.data == {n: True for n in ["a", "b", "c"]}
+    output = capsys.readouterr().out
+    assert "1: b, c\n   2: a\n" in output
+    assert output.index("BUNDLING: b") < output.index("BUNDLING: a")
+
+
+@lobotomy.Patch()
+def test_publish_dependency_failed(lobotomized: lobotomy.Lobotomy, tmp_path):
+    """Should skip modules that reference a module that failed to publish."""
+    _create_modules(tmp_path, ["a", "b"])
+    tmp_path.joinpath("a", "main.tf").write_text('module "b" { source = "../b" }')
+    lobotomized.add_call("s3", "list_objects_v2", {"Contents": []})
+    lobotomized.add_error_call("s3", "upload_file", "AccessDenied")
+    result = terrable.run(["publish", str(tmp_path), "--bucket=foo"])
+    assert result.code == "PUBLISH_FAILED"
+    assert "b" in result.errors["a"]
+    assert len(lobotomized.get_service_calls("s3", "upload_file")) == 1
+
+
+@lobotomy.Patch()
+def test_publish_dependency_cycle(lobotomized: lobotomy.Lobotomy, tmp_path):
+    """Should fail before bundling any module when modules form a cycle."""
+    _create_modules(tmp_path, ["a", "b"])
+    tmp_path.joinpath("a", "main.tf").write_text('module "b" { source = "../b" }')
+    tmp_path.joinpath("b", "main.tf").write_text('module "a" { source = "../a" }')
+    result = terrable.run(["publish", str(tmp_path), "--bucket=foo"])
+    assert result.code == "DEPENDENCY_CYCLE"
+    assert set(result.errors) == {"a", "b"}
+    assert not lobotomized.get_service_calls("s3", "list_objects_v2")
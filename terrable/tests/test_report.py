@@ -0,0 +1,75 @@
+import json
+import pathlib
+
+import boto3
+import lobotomy
+from botocore.stub import Stubber
+
+import terrable
+from terrable import _report
+
+MY_DIRECTORY = pathlib.Path(__file__).parent.absolute()
+MODULES_DIRECTORY = MY_DIRECTORY.joinpath("modules")
+
+
+def test_report_calls():
+    """Should record the S3 calls made by an attached client by operation."""
+    client = boto3.Session(
+        aws_access_key_id="a",
+        aws_secret_access_key="b",
+        region_name="us-east-1",
+    ).client("s3")
+    report = _report.Report()
+    report.attach(client)
+    with Stubber(client) as stubber:
+        stubber.add_response("head_object", {"ContentLength": 12})
+        stubber.add_response("head_object", {"ContentLength": 34})
+        stubber.add_response("get_object", {"ContentLength": 56})
+        client.head_object(Bucket="foo", Key="bar")
+        client.head_object(Bucket="foo", Key="bar")
+        client.get_object(Bucket="foo", Key="bar")
+
+    calls = report.to_dict()["s3"]
+    assert {k: v["count"] for k, v in calls.items()} == {
+        "GetObject": 1,
+        "HeadObject": 2,
+    }
+    assert calls["HeadObject"]["bytes"] == 46
+
+
+@lobotomy.Patch()
+def test_publish_report(lobotomized: lobotomy.Lobotomy, tmp_path, capsys):
+    """Should report the time and bytes of each publishing phase."""
+    lobotomized.add_call("s3", "list_objects_v2", {"Contents": []})
+    lobotomized.add_call("s3", "upload_file", {})
+    lobotomized.add_error_call("s3", "get_object", "NoSuchKey")
+    path = tmp_path.joinpath("report.json")
+    result = terrable.run(
+        [
+            "publish",
+            str(MODULES_DIRECTORY),
+            "--bucket=foo",
+            "--timings",
+            f"--report-file={path}",
+        ]
+    )
+    assert result.data["foo"] is True
+    assert set(result.data) == {"foo"}
+    report = result.report
+    assert report is not None
+    assert json.loads(path.read_text()) == report
+
+    phases = report["modules"]["foo"]["phases"]
+    assert set(phases) == {"bundle", "list", "compare", "upload", "index"}
+    assert phases["upload"]["bytes"] == phases["bundle"]["bytes"] > 0
+    assert "Timings" in capsys.readouterr().out
+
+
+@lobotomy.Patch()
+def test_publish_no_report(lobotomized: lobotomy.Lobotomy):
+    """Should leave the report out of the result unless it was requested."""
+    lobotomized.add_call("s3", "list_objects_v2", {"Contents": []})
+    result = terrable.run(
+        ["publish", str(MODULES_DIRECTORY), "--bucket=foo", "--dry-run"]
+    )
+    assert result.report is None
@@ -0,0 +1,80 @@
+import io
+import pathlib
+import typing
+import zipfile
+
+from terrable import _s3
+from terrable import _utils
+
+MY_DIRECTORY = pathlib.Path(__file__).parent.absolute()
+SOURCES_DIRECTORY = MY_DIRECTORY.joinpath("test_utils_compare_zip_files", "sources")
+
+
+class _RangedClient:
+    """Client stand-in that serves ranged GETs of an object from its bytes."""
+
+    def __init__(self, data: bytes):
+        """Serve the given object bytes and record the requested ranges."""
+        self.data = data
+        self.ranges: typing.List[typing.Tuple[int, int]] = []
+
+    def get_object(self, Bucket: str, Key: str, Range: str):  # noqa: N803
+        """Get the requested inclusive byte range of the object."""
+        start, end = (int(v) for v in Range.split("=")[-1].split("-"))
+        self.ranges.append((start, end))
+        return {"Body": io.BytesIO(self.data[start : end + 1])}
+
+
+def _create_large_zip() -> bytes:
+    """Create a zip file with contents large enough to span many blocks."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, mode="w") as zipper:
+        for index in range(20):
+            zipper.writestr(f"file-{index}.bin", bytes([index]) * 100_000)
+    return buffer.getvalue()
+
+
+def test_ranged_object_read():
+    """Should read and seek through the object as a regular file would."""
+    data = bytes(range(256)) * 100
+    reader = _s3.RangedObject(_RangedClient(data), "b", "k", len(data), block_size=100)
+    assert reader.read(10) == data[:10]
+    reader.seek(-50, io.SEEK_END)
+    assert reader.read() == data[-50:]
+    reader.seek(95)
+    assert reader.read(210) == data[95:305]
+    assert reader.read(0) == b""
+    reader.seek(len(data))
+    assert reader.read(10) == b""
+
+
+def test_ranged_object_block_cache():
+    """Should only fetch blocks that aren't already cached."""
+    data = bytes(range(256)) * 100
+    client = _RangedClient(data)
+    reader = _s3.RangedObject(client, "b", "k", len(data), block_size=100)
+    reader.read(150)
+    reader.seek(0)
+    reader.read(250)
+    assert client.ranges == [(0, 199), (200, 299)]
+
+
+def test_ranged_object_compare_zip_files():
+    """Should compare zip files by fetching only the end of the remote bundle."""
+    data = _create_large_zip()
+    client = _RangedClient(data)
+    reader = _s3.RangedObject(client, "b", "k", len(data))
+    result = _utils.compare_zip_files(io.BytesIO(data), reader)
+    assert result.identical
+    fetched = sum(end - start + 1 for start, end in client.ranges)
+    assert fetched <= 2 * reader.block_size < len(data)
+
+
+def test_ranged_object_compare_mismatched():
+    """Should find mismatched files from the central directory of the bundle."""
+    data = SOURCES_DIRECTORY.joinpath("modified-file.zip").read_bytes()
+    reader = _s3.RangedObject(_RangedClient(data), "b", "k", len(data))
+    result = _utils.compare_zip_files(
+        SOURCES_DIRECTORY.joinpath("original.zip"), reader
+    )
+    assert result.mismatch == "policy_lifecycle_untagged.json"
@@ -0,0 +1,30 @@
+import subprocess
+import sys
+
+#: Maximum time in seconds that importing the package may take, excluding the
+#: startup of the interpreter itself.
+_IMPORT_BUDGET = 0.3
+
+_SCRIPT = """
+import sys
+import terrable
+terrable._parse(["publish", ".", "--bucket=foo", "--dry-run"])
+print(",".join(m for m in sys.modules if m.split(".")[0] in ("boto3", "botocore")))
+"""
+
+
+def test_import_time():
+    """Should import the package and parse arguments without importing boto3."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _SCRIPT],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    assert process.stdout.strip() == "", "Expected boto3 to be imported lazily."
+
+    line = next(
+        line for line in process.stderr.splitlines() if line.endswith("| terrable")
+    )
+    elapsed = int(line.split("|")[1]) / 1_000_000
+    assert elapsed < _IMPORT_BUDGET, f"Importing took {elapsed:.3f}s"
@@ -20,6 +20,7 @@ def test_compare_zip_files(filename: str):
     observed = _utils.compare_zip_files(
         a=_DIRECTORY.joinpath("sources", scenario["a"]),
         b=_DIRECTORY.joinpath("sources", scenario["b"]),
+        deep=scenario.get("deep", False),
     )
     expected: aok.Okay = scenario["expected"]
     expected.assert_all(dataclasses.asdict(observed))
@@ -0,0 +1,49 @@
+import pathlib
+from unittest.mock import patch
+
+import terrable
+
+
+def _create_module(directory: pathlib.Path, name: str) -> pathlib.Path:
+    """Create a module directory with a single terraform file."""
+    directory.joinpath(name).mkdir(parents=True)
+    path = directory.joinpath(name, "main.tf")
+    path.write_text(f'# "{name}" module\n')
+    return path
+
+
+def test_watch(tmp_path: pathlib.Path, capsys):
+    """Should publish all modules once and afterwards only those that change."""
+    modules = tmp_path.joinpath("modules")
+    path = _create_module(modules, "a")
+    _create_module(modules, "b")
+    bucket = tmp_path.joinpath("bucket")
+    sleeps = []
+
+    def sleep(seconds: float):
+        sleeps.append(seconds)
+        if len(sleeps) == 1:
+            path.write_text('# "a" module changed\n')
+        elif len(sleeps) == 4:
+            raise KeyboardInterrupt()
+
+    with patch("terrable._watcher.time.sleep", side_effect=sleep), patch(
+        "terrable._storage.get_versions"
+    ) as get_versions:
+        result = terrable.run(
+            [
+                "watch",
+                str(modules),
+                f"--bucket={bucket.as_uri()}",
+                "--interval=2",
+                "--debounce=0.1",
+            ]
+        )
+
+    assert result.code == "WATCH_STOPPED"
+    assert result.data == {"a": 2, "b": 1}
+    assert sleeps == [2, 0.1, 2, 2]
+    assert bucket.joinpath("terrable", "a", "2.zip").is_file()
+    assert not bucket.joinpath("terrable", "b", "2.zip").exists()
+    assert capsys.readouterr().out.count("BUNDLING: b") == 1
+    get_versions.assert_not_called()